@@ -0,0 +1,5 @@
+import sys
+
+from foxbaker.cli import main
+
+sys.exit(main())
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from foxbaker.encode import (AUTO_QUALITY, FFMPEG, format_command, job_encoder, probe_job, rate_control_args,
+                             run_process)
+from foxbaker.encoders import capabilities
+from foxbaker.paths import cache_dir
+
+# Mean SSIM the samples have to reach, 0.98 is hard to tell from the source at normal viewing distance
+TARGET_SSIM = float(os.environ.get("FOXBAKER_AUTO_SSIM") or 0.98)
+SAMPLE_COUNT = 4
+SAMPLE_SECONDS = 3
+# Bitrates tried, those at or above the source's are left out
+BITRATE_LADDER = [300000, 500000, 800000, 1200000, 1800000, 2800000, 4200000, 6500000, 10000000]
+AUTO_CACHE_FILE = "autobitrate.json"
+AUTO_CACHE_ENTRIES = 500
+# Raise when the sampling changes, results of the older sampling are not used then
+AUTO_VERSION = 1
+SSIM_RE = re.compile(r'SSIM .*All:([\d.]+)')
+PSNR_RE = re.compile(r'PSNR .*average:([\d.]+|inf)')
+
+_lock = threading.Lock()
+
+
+def needs_auto_bitrate(job):
+    return job.quality == AUTO_QUALITY or any(r.quality == AUTO_QUALITY for r in job.renditions)
+
+
+def sample_windows(duration, count=SAMPLE_COUNT, seconds=SAMPLE_SECONDS):
+    """(start, length) of `count` samples spread evenly over the video, fewer for short videos."""
+    count = max(1, min(count, int(duration // (seconds * 2))))
+    seconds = min(seconds, duration)
+    return [(max(0.0, min(duration * (i + 0.5) / count - seconds / 2, duration - seconds)), seconds)
+            for i in range(count)]
+
+
+def cache_key(job, encoder, info):
+    st = os.stat(job.video_path)
+    data = [AUTO_VERSION, os.path.abspath(job.video_path), st.st_size, st.st_mtime_ns, encoder.name,
+            encoder.preset_args, TARGET_SSIM, SAMPLE_COUNT, SAMPLE_SECONDS, BITRATE_LADDER, info.bitrate,
+            capabilities(FFMPEG)["version"]]
+    return hashlib.sha1(json.dumps(data).encode("utf-8")).hexdigest()
+
+
+def _load_cache():
+    try:
+        with open(cache_dir() / AUTO_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    path = cache_dir() / AUTO_CACHE_FILE
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def remember(key, result):
+    with _lock:
+        cache = _load_cache()
+        cache.pop(key, None)
+        cache[key] = result
+        while len(cache) > AUTO_CACHE_ENTRIES:
+            cache.pop(next(iter(cache)))
+        _save_cache(cache)
+
+
+def sample_quality(job, encoder, window, bitrate, path, threads, log):
+    """
+    Encodes one sample at `bitrate` and compares it with the source frames.
+    Returns (ssim, psnr, real bitrate), None when ffmpeg failed.
+    """
+    start, seconds = window
+    seek = ["-ss", f"{start:.3f}", "-t", f"{seconds:.3f}"]
+    cmd = [FFMPEG, "-nostdin", "-hide_banner", "-v", "error"] + seek + ["-i", job.video_path, "-map", "0:V:0",
+                                                                          "-c:v", encoder.name]
+    if threads:
+        cmd.extend(["-threads", str(threads)])
+    cmd.extend(rate_control_args(bitrate) + encoder.preset_args + ["-an", "-sn", "-f", "matroska", "-y", path])
+    lines = []
+    if run_process(job, cmd, on_log=lines.append) != 0:
+        log(f"Auto bitrate: sample encode failed: {format_command(cmd)}: {lines[-1] if lines else ''}")
+        return None
+    size = os.path.getsize(path)
+    # Frames are paired by number in one time base, the timestamps of the sample and the source differ in rounding
+    graph = ("[0:v]settb=AVTB,setpts=N,split[e0][e1];[1:v]settb=AVTB,setpts=N,split[r0][r1];"
+             "[e0][r0]ssim;[e1][r1]psnr")
+    cmd = [FFMPEG, "-nostdin", "-hide_banner", "-i", path] + seek + ["-i", job.video_path, "-filter_complex", graph,
+                                                                       "-f", "null", "-"]
+    lines = []
+    rc = run_process(job, cmd, on_log=lines.append)
+    os.remove(path)
+    ssim = next((float(m.group(1)) for m in map(SSIM_RE.search, lines) if m), None)
+    psnr = next((m.group(1) for m in map(PSNR_RE.search, lines) if m), None)
+    if rc != 0 or ssim is None:
+        log(f"Auto bitrate: comparing the sample with the source failed: {lines[-1] if lines else rc}")
+        return None
+    return ssim, float(psnr) if psnr not in (None, "inf") else 100.0, size * 8 / seconds
+
+
+def measure(job, encoder, windows, bitrate, work_dir, log):
+    """Mean SSIM, PSNR and the real bitrate of all samples at `bitrate`, encoded side by side."""
+    workers = min(len(windows), os.cpu_count() or 1)
+    threads = max(1, (job.threads or os.cpu_count() or 1) // workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda item: sample_quality(
+            job, encoder, item[1], bitrate, os.path.join(work_dir, f"sample_{item[0]}_{bitrate}.mkv"), threads, log),
+            enumerate(windows)))
+    if job.cancelled or any(result is None for result in results):
+        return None
+    return [sum(values) / len(values) for values in zip(*results)]
+
+
+def interpolate(lower, upper, target):
+    """Bitrate between two measured (bitrate, ssim) points at which SSIM reaches `target`, on a log scale."""
+    (b0, s0), (b1, s1) = lower, upper
+    if s1 <= s0:
+        return b1
+    t = min(max((target - s0) / (s1 - s0), 0.0), 1.0)
+    return int(math.exp(math.log(b0) + t * (math.log(b1) - math.log(b0))))
+
+
+def choose_bitrate(job, info, log):
+    """
+    The lowest bitrate whose samples reach TARGET_SSIM, None when even the
+    highest tried bitrate below the source's does not. Bisects the ladder,
+    every step encodes all samples in parallel, then interpolates between
+    the last bitrate that missed the target and the first that met it.
+    Returns (bitrate, {bitrate: (ssim, psnr, real bitrate)}), the points are
+    None when a sample could not be encoded or compared.
+    """
+    encoder = job_encoder(job)
+    ladder = [b for b in BITRATE_LADDER if not info.bitrate or b < info.bitrate] or BITRATE_LADDER[:1]
+    windows = sample_windows(info.duration)
+    points = {}
+    work_dir = tempfile.mkdtemp(prefix="foxbaker_auto_")
+    try:
+        lo, hi = 0, len(ladder) - 1
+        best = None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            result = measure(job, encoder, windows, ladder[mid], work_dir, log)
+            if result is None:
+                return None, None
+            ssim, psnr, real = result
+            points[ladder[mid]] = (ssim, psnr, real)
+            log(f"Auto bitrate: {ladder[mid] // 1000} kb/s gives SSIM {ssim:.4f}, PSNR {psnr:.2f} dB "
+                f"({len(windows)} samples of {windows[0][1]:.0f} s)")
+            if ssim >= TARGET_SSIM:
+                best, hi = mid, mid - 1
+            else:
+                lo = mid + 1
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if best is None:
+        return None, points
+    bitrate = ladder[best]
+    below = [b for b in points if b < bitrate]
+    if below:
+        lower = max(below)
+        bitrate = interpolate((lower, points[lower][0]), (bitrate, points[bitrate][0]), TARGET_SSIM)
+    return bitrate, points
+
+
+def prepare_bitrate(job, log=None):
+    """
+    Sets job.auto_bitrate for jobs with the "auto" quality tier, from the
+    cache when the same video was sampled before with the same encoder.
+    Leaves it at None when sampling fails, the tier then takes 90% of the
+    source bitrate like "original".
+    """
+    log = log or (lambda message: None)
+    if not needs_auto_bitrate(job):
+        return
+    info = probe_job(job)
+    if info is None or not info.duration:
+        log("Auto bitrate: the video can not be read, using the source bitrate")
+        return
+    encoder = job_encoder(job)
+    try:
+        key = cache_key(job, encoder, info)
+    except OSError:
+        return
+    with _lock:
+        cached = _load_cache().get(key)
+    if cached is not None:
+        job.auto_bitrate = cached["bitrate"]
+        log(f"Auto bitrate: {job.auto_bitrate // 1000 if job.auto_bitrate else 'source'} kb/s, "
+            "measured before for this video and encoder")
+        return
+    bitrate, points = choose_bitrate(job, info, log)
+    if job.cancelled:
+        return
+    if points is None:
+        log("Auto bitrate: sampling failed, using the source bitrate")
+        return
+    job.auto_bitrate = bitrate
+    remember(key, {"bitrate": bitrate, "points": {str(b): p for b, p in sorted(points.items())}})
+    if bitrate:
+        log(f"Auto bitrate: {bitrate // 1000} kb/s reaches SSIM {TARGET_SSIM}"
+            + (f", the source has {info.bitrate // 1000} kb/s" if info.bitrate else ""))
+    else:
+        log(f"Auto bitrate: no bitrate below the source's reaches SSIM {TARGET_SSIM}, using the source bitrate")
@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows, CPU time and peak memory are not reported there
+    resource = None
+
+from foxbaker.encode import AUTO_QUALITY, QUALITY_NAMES, job_encoder, run_job
+from foxbaker.encoders import ENCODERS, FFMPEG, available, ffmpeg_version
+from foxbaker.jobs import Job
+from foxbaker.paths import cache_dir
+
+# The directory containing the foxbaker package, cases run as `python -m foxbaker.bench case` from there
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIZES = {"720p": (1280, 720), "1080p": (1920, 1080), "4k": (3840, 2160)}
+SUBTITLE_KINDS = ["srt", "ass"]
+MODES = ["normal", "segmented"]
+DEFAULT_DURATION = 10
+FRAME_RATE = 25
+# Relative change that counts as a regression in `compare`
+DEFAULT_THRESHOLD = 0.10
+# +1: higher is better, -1: lower is better
+METRICS = {"wall_seconds": -1, "cpu_seconds": -1, "peak_rss_mb": -1, "output_bytes": -1, "fps": 1, "speed": 1}
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+WrapStyle: 0
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,64,&H00FFFFFF,&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,3,2,2,60,60,60,1
+Style: Sign,Arial,48,&H0000FFFF,&H000000FF,&H00400000,&H00000000,1,0,0,0,100,100,2,0,1,4,0,7,20,20,20,1
+Style: Karaoke,Arial,72,&H00FFFFFF,&H00FF8000,&H00000000,&H00000000,1,0,0,0,100,100,0,0,1,4,3,8,60,60,60,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+def _ass_time(seconds):
+    cs = int(round(seconds * 100))
+    return f"{cs // 360000}:{cs // 6000 % 60:02d}:{cs // 100 % 60:02d}.{cs % 100:02d}"
+
+
+def _srt_time(seconds):
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def write_srt(path, duration):
+    """A plain dialogue line every two seconds."""
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        for i, start in enumerate(range(0, duration, 2), 1):
+            f.write(f"{i}\n{_srt_time(start)} --> {_srt_time(start + 1.8)}\n"
+                    f"Line {i} of the benchmark dialogue\nwith a second row\n\n")
+
+
+def write_heavy_ass(path, duration):
+    """
+    Dialogue plus the kind of typesetting that makes libass slow: several
+    moving, blurred and rotating signs on screen at once and a karaoke line
+    with per-syllable colour sweeps.
+    """
+    events = []
+    for start in range(0, duration, 2):
+        events.append(f"0,{_ass_time(start)},{_ass_time(start + 1.8)},Default,,0,0,0,,"
+                      f"{{\\fad(200,200)}}Benchmark dialogue at {start} s\\Nwith a second row")
+        for sign in range(6):
+            x, y = 100 + sign * 280, 120 + sign * 60
+            events.append(f"1,{_ass_time(start)},{_ass_time(start + 2)},Sign,,0,0,0,,"
+                          f"{{\\move({x},{y},{x + 200},{y + 300})\\blur3\\t(\\frz{15 * (sign + 1)}\\fscx130)"
+                          f"\\bord6\\3c&H{sign * 30:02X}4080&}}Sign number {sign}")
+        syllables = "".join(f"{{\\kf25\\t(\\fscy120)}}syl{n} " for n in range(8))
+        events.append(f"2,{_ass_time(start)},{_ass_time(start + 2)},Karaoke,,0,0,0,,{{\\blur1}}{syllables}")
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write(ASS_HEADER)
+        for event in events:
+            f.write(f"Dialogue: {event}\n")
+
+
+def prepare_inputs(size, duration, directory):
+    """Creates (once) the test video of one size and the subtitle files, returns {kind: (video, subtitles)}."""
+    width, height = SIZES[size]
+    video = os.path.join(directory, f"testsrc_{size}_{duration}s.mkv")
+    if not os.path.exists(video):
+        tmp = video + ".tmp.mkv"
+        cmd = [FFMPEG, "-nostdin", "-v", "error", "-f", "lavfi", "-i",
+               f"testsrc2=size={width}x{height}:rate={FRAME_RATE}:duration={duration}",
+               "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+               "-c:v", "libx264", "-preset", "ultrafast", "-crf", "16", "-g", str(FRAME_RATE * 2),
+               "-c:a", "aac", "-b:a", "128k", "-y", tmp]
+        subprocess.run(cmd, check=True)
+        os.replace(tmp, video)
+    srt = os.path.join(directory, f"dialogue_{duration}s.srt")
+    ass = os.path.join(directory, f"heavy_{duration}s.ass")
+    write_srt(srt, duration)
+    write_heavy_ass(ass, duration)
+    return {"srt": (video, srt), "ass": (video, ass)}
+
+
+def benchmark_encoders():
+    """`software` plus the GPU vendors with a working H.264 encoder."""
+    names = ["software"]
+    for encoder in ENCODERS:
+        if encoder.codec == "h264" and encoder.hardware and encoder.selectable and available(encoder.name):
+            names.append(encoder.vendor)
+    return names
+
+
+def run_case(case):
+    """Runs one job the way the GUI and the CLI do and measures it, meant to run in its own process."""
+    job = Job(case["video"], case["subtitles"], case["output"], quality=QUALITY_NAMES.index(case["quality"]),
+              hw_enabled=case["encoder"] != "software",
+              hw_type=None if case["encoder"] == "software" else case["encoder"],
+              segmented=case["mode"] == "segmented", preflight=False, cache=False)
+    speeds = []
+    job.start_time = time.time()
+    started = time.monotonic()
+    rc = run_job(job, on_speed=lambda job, speed: speeds.append(speed))
+    wall = time.monotonic() - started
+
+    result = {"returncode": rc, "encoder_name": job_encoder(job).name, "wall_seconds": round(wall, 3),
+              "fps": round(job.total_frames / wall, 2) if job.total_frames and wall > 0 else None,
+              "speed": round(statistics.median(speeds), 3) if speeds else None,
+              "output_bytes": os.path.getsize(case["output"]) if os.path.exists(case["output"]) else None,
+              "cpu_seconds": None, "peak_rss_mb": None}
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        result["cpu_seconds"] = round(usage.ru_utime + usage.ru_stime, 2)
+        # Kilobytes on Linux, bytes on macOS
+        result["peak_rss_mb"] = round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    return result
+
+
+def _median_result(runs):
+    merged = dict(runs[0])
+    for name in METRICS:
+        values = [run[name] for run in runs if run.get(name) is not None]
+        merged[name] = statistics.median(values) if values else None
+    return merged
+
+
+def run_suite(args):
+    directory = os.path.abspath(args.work_dir or cache_dir("bench"))
+    os.makedirs(directory, exist_ok=True)
+    encoders = args.encoders.split(",") if args.encoders else benchmark_encoders()
+    cases = []
+    for size in args.sizes.split(","):
+        inputs = prepare_inputs(size, args.duration, directory)
+        for kind in args.subtitles.split(","):
+            video, subtitles = inputs[kind]
+            for mode in args.modes.split(","):
+                for quality in args.qualities.split(","):
+                    for encoder in encoders:
+                        name = f"{size}-{kind}-{mode}-{quality}-{encoder}"
+                        cases.append({"name": name, "size": size, "subtitle_kind": kind, "mode": mode,
+                                      "quality": quality, "encoder": encoder, "video": video,
+                                      "subtitles": subtitles, "output": os.path.join(directory, f"out_{name}.mp4")})
+
+    results = []
+    for case in cases:
+        runs = []
+        for _ in range(args.repeat):
+            # A fresh interpreter per run, so the child process usage belongs to this case alone
+            proc = subprocess.run([sys.executable, "-m", "foxbaker.bench", "case", json.dumps(case)],
+                                  capture_output=True, text=True, encoding="utf-8", errors="replace", cwd=ROOT_DIR)
+            lines = proc.stdout.strip().splitlines()
+            try:
+                runs.append(json.loads(lines[-1]))
+            except (IndexError, ValueError):
+                runs.append({"returncode": proc.returncode, "error": proc.stderr.strip()[-500:]})
+        result = {key: case[key] for key in ("name", "size", "subtitle_kind", "mode", "quality", "encoder")}
+        result.update(_median_result(runs))
+        results.append(result)
+        if os.path.exists(case["output"]):
+            os.remove(case["output"])
+        print(f"{case['name']}: {result.get('wall_seconds')} s, {result.get('fps')} fps", file=sys.stderr)
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "ffmpeg": ffmpeg_version(),
+              "host": platform.node(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+              "duration": args.duration, "repeat": args.repeat, "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    if args.baseline:
+        return print_comparison(load_report(args.baseline), report, args.threshold)
+    return 0
+
+
+def load_report(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_reports(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Lists (case, metric, old, new, change, regression) for every metric both
+    reports have. Cases that failed now but not before are regressions too.
+    """
+    old_results = {result["name"]: result for result in baseline.get("results", [])}
+    rows = []
+    for result in current.get("results", []):
+        old = old_results.get(result["name"])
+        if old is None:
+            continue
+        if result.get("returncode") != 0 and old.get("returncode") == 0:
+            rows.append((result["name"], "returncode", 0, result.get("returncode"), None, True))
+            continue
+        for metric, direction in METRICS.items():
+            before, after = old.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            rows.append((result["name"], metric, before, after, change, change * direction < -threshold))
+    return rows
+
+
+def print_comparison(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Prints the comparison and returns 1 if anything regressed, for use as an exit code."""
+    rows = compare_reports(baseline, current, threshold)
+    if baseline.get("ffmpeg") != current.get("ffmpeg") or baseline.get("host") != current.get("host"):
+        print("Note: the reports come from different machines or FFmpeg versions")
+    regressions = 0
+    for name, metric, before, after, change, regression in rows:
+        if regression:
+            regressions += 1
+        change_text = "" if change is None else f"{change:+.1%}"
+        print(f"{'REGRESSION' if regression else 'ok':<10} {name:<40} {metric:<13} {before!s:>12} -> {after!s:<12} "
+              f"{change_text}")
+    print(f"{regressions} regression(s) beyond {threshold:.0%} in {len(rows)} measurements")
+    return 1 if regressions else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="foxbaker.bench", description="Encoding benchmarks on generated inputs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmark matrix and write a JSON report")
+    run.add_argument("-o", "--output", default="bench.json")
+    run.add_argument("--sizes", default=",".join(SIZES), help=f"comma separated, of {', '.join(SIZES)}")
+    run.add_argument("--subtitles", default=",".join(SUBTITLE_KINDS),
+                     help="srt: plain dialogue, ass: heavy typesetting and karaoke")
+    run.add_argument("--qualities", default=",".join(QUALITY_NAMES[:AUTO_QUALITY]),
+                     help=f"comma separated, of {', '.join(QUALITY_NAMES)}")
+    run.add_argument("--encoders", help="software and/or GPU vendors (NVIDIA, AMD, Intel), "
+                                        "defaults to every one that works")
+    run.add_argument("--modes", default=MODES[0], help=f"comma separated, of {', '.join(MODES)}")
+    run.add_argument("--duration", type=int, default=DEFAULT_DURATION, help="seconds of generated video")
+    run.add_argument("--repeat", type=int, default=1, help="runs per case, the median is reported")
+    run.add_argument("--work-dir", help="where inputs are generated, defaults to the cache directory")
+    run.add_argument("--baseline", help="compare the new report against this one")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    compare = commands.add_parser("compare", help="flag regressions of a report against a baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                         help="relative change that counts as a regression, default 0.10")
+
+    case = commands.add_parser("case")
+    case.add_argument("case", help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "case":
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+    if args.command == "compare":
+        return print_comparison(load_report(args.baseline), load_report(args.current), args.threshold)
+    return run_suite(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
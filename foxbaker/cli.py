@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from foxbaker.deadline import parse_finish_time
+from foxbaker.encode import QUALITY_NAMES, run_job
+from foxbaker.history import expect_job
+from foxbaker.jobs import Job, Rendition, SubtitleTrack, default_output_name
+from foxbaker.logbuffer import DEBUG, INFO, JobLogFile, classify
+from foxbaker.mux import LANGUAGES
+from foxbaker.remote import WORKERS, WorkerPool, run_remote
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_FFMPEG_NOT_FOUND = 3
+EXIT_INTERRUPTED = 130
+
+# "hardware" takes the first GPU encoder that passes a test encode
+ENCODERS = {"software": (False, None), "hardware": (True, None), "amd": (True, "AMD"), "nvidia": (True, "NVIDIA"),
+            "intel": (True, "Intel")}
+
+
+def emit(event, **fields):
+    """Progress is printed as one JSON object per line so other tools can follow it."""
+    sys.stdout.write(json.dumps({"event": event, **fields}, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="foxbaker", description="Burn .ass/.srt subtitles into a video without the GUI.")
+    parser.add_argument("-i", "--input", required=True, help="input video file")
+    parser.add_argument("-s", "--subtitle", required=True, help="subtitle file (.ass/.srt)")
+    parser.add_argument("-o", "--output", help="output file, defaults to '<input name>s.mp4' next to the input")
+    parser.add_argument("-q", "--quality", choices=QUALITY_NAMES, default=QUALITY_NAMES[0])
+    parser.add_argument("-e", "--encoder", choices=list(ENCODERS), default="software")
+    parser.add_argument("--threads", type=int, default=0, help="encoder threads, 0 lets ffmpeg decide")
+    parser.add_argument("--rendition", action="append", default=[], metavar="QUALITY:PATH",
+                        help="render one more output from the same decode, can be repeated; replaces -o and -q, "
+                             "e.g. --rendition original:ep.mp4 --rendition low:ep_720.webm")
+    parser.add_argument("--soft", action="store_true",
+                        help="mux the subtitles as a track and copy the video instead of burning them in, the output "
+                             "defaults to .mkv then")
+    parser.add_argument("--track", action="append", default=[], metavar="[LANG:]PATH",
+                        help="one more subtitle file muxed as a track after -s, can be repeated, implies --soft; "
+                             "the language is taken from names like ep01.ru.ass otherwise, e.g. --track eng:ep01.ass")
+    parser.add_argument("--language", metavar="LANG", help="language of the -s track with --soft, e.g. rus or ru")
+    parser.add_argument("--segmented", action="store_true",
+                        help="encode keyframe-aligned chunks in parallel processes and join them")
+    parser.add_argument("--smart", action="store_true",
+                        help="re-encode only the parts with subtitles and copy the rest, falls back to a full "
+                             "encode when the source can not be matched")
+    parser.add_argument("--finish-by", metavar="TIME",
+                        help="pick the slowest x264 preset that finishes by this time, HH:MM or an ISO date and time")
+    parser.add_argument("--target-speed", type=float, metavar="X",
+                        help="pick the slowest x264 preset that keeps up this speed, e.g. 2 for twice real time")
+    parser.add_argument("--no-preflight", action="store_true",
+                        help="skip the compatibility checks and the 2 second trial encode before the real one")
+    parser.add_argument("--cache", action="store_true",
+                        help="reuse the output of an earlier job with the same video, subtitles and settings, "
+                             "and keep this one in the output cache, which has to be on the output's file system")
+    parser.add_argument("--worker", action="append", metavar="HOST:PORT",
+                        help="encode on a worker started with `python -m foxbaker.remote serve`, can be repeated, "
+                             "the least loaded one is used; defaults to FOXBAKER_WORKERS")
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="copy ffmpeg output to stderr, -vv also prints the -progress lines")
+    parser.add_argument("--log-file", help="write the full ffmpeg output to this file, rotated at 5 MB")
+    return parser
+
+
+def parse_rendition(value):
+    quality, sep, path = value.partition(":")
+    if not sep or quality not in QUALITY_NAMES or not path:
+        raise ValueError(f"Invalid --rendition {value!r}, expected one of {', '.join(QUALITY_NAMES)} and a path, "
+                         "e.g. medium:out.mp4")
+    return Rendition(path, QUALITY_NAMES.index(quality))
+
+
+def parse_language(value):
+    code = value.lower()
+    if code in LANGUAGES:
+        return LANGUAGES[code]
+    if len(code) != 3 or not code.isalpha():
+        raise ValueError(f"Invalid language {value!r}, expected an ISO 639 code like rus or ru")
+    return code
+
+
+def parse_track(value):
+    # A one-letter prefix is a Windows drive
+    language, sep, path = value.partition(":")
+    if not sep or len(language) < 2:
+        return SubtitleTrack(value)
+    if not path:
+        raise ValueError(f"Invalid --track {value!r}, expected a path, e.g. eng:ep01.ass")
+    return SubtitleTrack(path, parse_language(language))
+
+
+def job_from_args(args):
+    mux = args.soft or bool(args.track)
+    output = args.output
+    if not output:
+        output = os.path.join(os.path.dirname(os.path.abspath(args.input)),
+                              default_output_name(args.input) + (".mkv" if mux else ".mp4"))
+    hw_enabled, hw_type = ENCODERS[args.encoder]
+    renditions = [parse_rendition(value) for value in args.rendition]
+    deadline = None
+    if args.finish_by:
+        try:
+            deadline = parse_finish_time(args.finish_by)
+        except ValueError:
+            raise ValueError(f"Invalid --finish-by {args.finish_by!r}, expected HH:MM or YYYY-MM-DD HH:MM")
+    if args.target_speed is not None and args.target_speed <= 0:
+        raise ValueError("--target-speed must be greater than 0")
+    tracks = [parse_track(value) for value in args.track]
+    for track in tracks:
+        if not os.path.isfile(track.path):
+            raise ValueError(f"Subtitle file not found: {track.path}")
+    if mux and renditions:
+        raise ValueError("--rendition needs an encode and can not be used with --soft or --track")
+    language = parse_language(args.language) if args.language else None
+    job = Job(args.input, args.subtitle, output, quality=QUALITY_NAMES.index(args.quality), hw_enabled=hw_enabled,
+              hw_type=hw_type, segmented=args.segmented, renditions=renditions,
+              smart=args.smart, deadline=deadline, target_speed=args.target_speed, preflight=not args.no_preflight,
+              cache=args.cache, mux=mux, subtitle_tracks=tracks, language=language)
+    job.threads = args.threads
+    return job
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not os.path.isfile(args.input):
+        emit("error", message=f"Input video not found: {args.input}")
+        return EXIT_USAGE
+    if not os.path.isfile(args.subtitle):
+        emit("error", message=f"Subtitle file not found: {args.subtitle}")
+        return EXIT_USAGE
+
+    try:
+        job = job_from_args(args)
+    except ValueError as e:
+        emit("error", message=str(e))
+        return EXIT_USAGE
+    outputs = [rendition.output_path for rendition in job.renditions] or [job.output_path]
+    for output in outputs:
+        output_dir = os.path.dirname(os.path.abspath(output))
+        if not os.path.isdir(output_dir):
+            emit("error", message=f"Output directory not found: {output_dir}")
+            return EXIT_USAGE
+
+    log_level = DEBUG if args.verbose > 1 else INFO
+    log_file = JobLogFile(args.log_file) if args.log_file else None
+
+    def on_log(line):
+        if not line:
+            return
+        level = classify(line)
+        if args.verbose and level >= log_level:
+            sys.stderr.write(line + "\n")
+        if log_file:
+            log_file.write(line, level)
+
+    def on_progress(job):
+        # run_job only calls this when the progress or the ETA changed
+        fields = {}
+        if job.renditions:
+            fields["outputs"] = [{"output": r.output_path, "progress": round(r.progress, 4)} for r in job.renditions]
+        emit("progress", progress=round(job.progress, 4), speed=job.speed, fps=job.fps,
+             eta=None if job.eta is None else round(job.eta), **fields)
+
+    # Predicted from similar earlier jobs, null without any. run_job() starts the ETA from it
+    expect_job(job, log=on_log)
+    emit("start", input=job.video_path, subtitle=job.subtitle_path, output=job.output_path, outputs=outputs,
+         expected_seconds=None if job.expected_seconds is None else round(job.expected_seconds),
+         expected_bytes=job.expected_bytes)
+    job.start_time = time.time()
+    try:
+        workers = args.worker or WORKERS
+        if workers:
+            rc = run_remote(job, WorkerPool(workers), on_log=on_log, on_progress=on_progress)
+        else:
+            rc = run_job(job, on_log=on_log, on_progress=on_progress)
+    except FileNotFoundError:
+        emit("error", message="FFmpeg not found. Please ensure it is installed and in your system's PATH")
+        return EXIT_FFMPEG_NOT_FOUND
+    except KeyboardInterrupt:
+        job.cancel()
+        emit("cancelled")
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        emit("error", message=str(e))
+        return EXIT_FAILED
+    finally:
+        if log_file:
+            log_file.close()
+
+    elapsed = time.time() - job.start_time
+    if rc != 0:
+        emit("error", message=f"ffmpeg exited with code {rc}", returncode=rc)
+        return EXIT_FAILED
+    fields = {}
+    if job.metrics:
+        # Remote jobs are measured on the worker
+        fields = {"metrics": job.metrics.summary(), "report": job.metrics.report_path}
+    emit("done", output=job.output_path, size=os.path.getsize(job.output_path), elapsed=round(elapsed, 2),
+         outputs=[{"output": output, "size": os.path.getsize(output)} for output in outputs], **fields)
+    return EXIT_OK
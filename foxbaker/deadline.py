@@ -0,0 +1,218 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from foxbaker.encode import BITRATE_OPTIONS, format_command, job_encoder, probe_job, run_process, video_codec_args
+from foxbaker.metrics import stage
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.probe import get_keyframes
+from foxbaker.progress import EtaEstimator, notify_on_change
+from foxbaker.segments import Chunk, chunk_command, concat_chunks, plan_chunks
+from foxbaker.subtitles import load_subtitles
+
+# x264 presets from the slowest to the fastest with their typical speed relative to medium.
+# Only the ratios are used, the absolute speed is measured on the job's own video
+PRESET_SPEEDS = [("veryslow", 0.17), ("slower", 0.35), ("slow", 0.65), ("medium", 1.0), ("fast", 1.25),
+                 ("faster", 1.6), ("veryfast", 2.8), ("superfast", 4.0), ("ultrafast", 6.0)]
+PRESET_FACTORS = dict(PRESET_SPEEDS)
+CALIBRATION_PRESET = "medium"
+CALIBRATION_SAMPLES = 3
+CALIBRATION_SECONDS = 6
+# The preset can change at every chunk boundary
+DEADLINE_CHUNK_SECONDS = 60
+# The required speed is raised by this much so that a slightly optimistic prediction still makes it
+SPEED_MARGIN = 1.15
+# Weight of the newest chunk in the measured speed
+SPEED_SMOOTHING = 0.5
+# The chunks are joined without re-encoding, so everything that ends up in the SPS/PPS has to be the
+# same for every preset. These are medium's values, ultrafast would e.g. turn CABAC and B-frames off
+STREAM_PARAMS = "ref=3:bframes=3:b-pyramid=normal:weightp=2:weightb=1:cabac=1:8x8dct=1"
+# Below subme 6 x264 turns psy-rd off and with it the -2 it adds to the chroma QP offset in the PPS
+NO_PSY_PRESETS = ("faster", "veryfast", "superfast", "ultrafast")
+
+
+def parse_finish_time(text, now=None):
+    """
+    "HH:MM", meaning the next time the clock shows it, or an ISO date and time.
+    Returns a Unix timestamp, raises ValueError for anything else.
+    """
+    now = now or datetime.now()
+    text = text.strip()
+    try:
+        clock = datetime.strptime(text, "%H:%M")
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+    moment = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+    if moment <= now:
+        moment += timedelta(days=1)
+    return moment.timestamp()
+
+
+def format_clock(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+
+
+def required_speed(job, media_seconds, now=None):
+    """Seconds of video per second needed to finish `media_seconds` by the job's deadline or target speed."""
+    if job.deadline:
+        left = job.deadline - (time.time() if now is None else now)
+        return float("inf") if left <= 0 else media_seconds / left
+    return job.target_speed
+
+
+def choose_preset(medium_speed, needed):
+    """The slowest preset predicted to keep up `needed`, the fastest one when none does."""
+    for preset, factor in PRESET_SPEEDS:
+        if medium_speed * factor >= needed * SPEED_MARGIN:
+            return preset
+    return PRESET_SPEEDS[-1][0]
+
+
+def preset_codec_args(job, original_bitrate, preset):
+    params = STREAM_PARAMS + (":chroma-qp-offset=-2" if preset in NO_PSY_PRESETS else "")
+    return video_codec_args(job, original_bitrate, preset=preset) + ["-x264-params", params]
+
+
+def _timed(job, cmd, log, on_event=None):
+    started = time.monotonic()
+    rc = run_process(job, cmd, on_log=log, on_event=on_event)
+    return rc, time.monotonic() - started
+
+
+def calibrate(job, subtitles, suffix, keyframes, frame_times, frame_duration, start_time, frame_rate,
+              original_bitrate, work_dir, log):
+    """
+    Encodes a few short samples spread over the video with CALIBRATION_PRESET
+    and returns the speed reached, None when the video is too short to sample
+    or a sample failed. The samples go through the same chunk command as the
+    real encode, subtitles included.
+    """
+    span = frame_times[-1] - frame_times[0]
+    if span < CALIBRATION_SECONDS * CALIBRATION_SAMPLES * 3:
+        return None
+    media, elapsed = 0.0, 0.0
+    for i in range(CALIBRATION_SAMPLES):
+        target = frame_times[0] + span * (i + 1) / (CALIBRATION_SAMPLES + 1)
+        start = max([kf for kf in keyframes if kf <= target] or keyframes[:1])
+        end = min(start + CALIBRATION_SECONDS, frame_times[-1])
+        sample = Chunk(i + 1, start, end, 0)
+        sample.path = os.path.join(work_dir, f"sample_{i}.{job.output_format or 'mp4'}")
+        sub_path = os.path.join(work_dir, f"sample_{i}{suffix}")
+        offset = subtitles.write_window(sub_path, start, end)
+        cmd = chunk_command(job, sample, sub_path, offset,
+                            preset_codec_args(job, original_bitrate, CALIBRATION_PRESET),
+                            frame_duration, start_time, frame_rate, last=False)
+        rc, seconds = _timed(job, cmd, lambda line: log(f"Sample {i}: {line}"))
+        if rc != 0:
+            return None
+        media += end - start
+        elapsed += seconds
+        os.remove(sample.path)
+    return media / elapsed if elapsed > 0 else None
+
+
+def run_deadline(job, on_log=None, on_progress=None, on_speed=None):
+    """
+    Encodes the job in keyframe-aligned chunks one after another with the
+    slowest x264 preset that still finishes by job.deadline, or keeps up
+    job.target_speed, and joins them without re-encoding.
+
+    The speed of CALIBRATION_PRESET is measured on samples first and then
+    corrected after every chunk, so the preset gets faster at the next chunk
+    when complex scenes slow the encode down and slower again when there is
+    time to spare. Returns None when the job can not be encoded this way
+    (another encoder than libx264, no keyframe list) and should run normally.
+    """
+    log = on_log or (lambda message: None)
+    encoder = job_encoder(job)
+    if encoder.name != "libx264":
+        log(f"Deadline: presets are only adapted for libx264, encoding with {encoder.name} as usual")
+        return None
+    notify = notify_on_change(on_progress)
+    eta = EtaEstimator(expected=job.expected_seconds)
+    info = probe_job(job)
+    frame_rate = info.frame_rate if info else None
+    keyframes, frame_times, start_time = get_keyframes(job.video_path)
+    if not frame_times or not keyframes:
+        log("Deadline: could not read the keyframe list, encoding as usual")
+        return None
+
+    original_bitrate = None
+    if info and BITRATE_OPTIONS.get(job.quality, 0) == 0:
+        original_bitrate = info.bitrate
+    span = frame_times[-1] - frame_times[0]
+    chunks, frame_duration = plan_chunks(keyframes, frame_times, max(1, int(span // DEADLINE_CHUNK_SECONDS)))
+    job.total_frames = len(frame_times)
+
+    work_dir = tempfile.mkdtemp(prefix="foxbaker_deadline_")
+    try:
+        with stage(job, "normalize"):
+            subtitle_path = normalize_subtitles(job.subtitle_path)
+        subtitles = load_subtitles(subtitle_path)
+        suffix = Path(subtitle_path).suffix or ".ass"
+
+        medium_speed = calibrate(job, subtitles, suffix, keyframes, frame_times, frame_duration, start_time,
+                                 frame_rate, original_bitrate, work_dir, log)
+        if job.cancelled:
+            return -1
+        media_total = sum(chunk.duration for chunk in chunks)
+        needed = required_speed(job, media_total)
+        predicted = None
+        if medium_speed:
+            preset = choose_preset(medium_speed, needed)
+            predicted = time.time() + media_total / (medium_speed * PRESET_FACTORS[preset])
+            log(f"Deadline: need {needed:.2f}x, {CALIBRATION_PRESET} runs at {medium_speed:.2f}x, "
+                f"starting with preset {preset}, predicted finish {format_clock(predicted)}")
+        else:
+            log(f"Deadline: need {needed:.2f}x, video too short to sample, starting with {CALIBRATION_PRESET}")
+
+        frames_before = 0
+        for i, chunk in enumerate(chunks):
+            media_left = sum(c.duration for c in chunks[i:])
+            needed = required_speed(job, media_left)
+            preset = choose_preset(medium_speed, needed) if medium_speed else CALIBRATION_PRESET
+            sub_path = os.path.join(work_dir, f"chunk_{chunk.index:04d}{suffix}")
+            offset = subtitles.write_window(sub_path, chunk.start, chunk.end)
+            chunk.path = os.path.join(work_dir, f"chunk_{chunk.index:04d}.{job.output_format or 'mp4'}")
+            cmd = chunk_command(job, chunk, sub_path, offset, preset_codec_args(job, original_bitrate, preset),
+                                frame_duration, start_time, frame_rate, last=i == len(chunks) - 1)
+            log(f"Chunk {chunk.index} ({preset}, need {needed:.2f}x): " + format_command(cmd))
+
+            def on_event(event):
+                job.fps = event.fps
+                if event.speed is not None:
+                    job.speed = event.speed
+                    if on_speed: on_speed(job, event.speed)
+                if event.frame is not None:
+                    frames_done = frames_before + min(event.frame, chunk.frames)
+                    job.progress = min(frames_done / job.total_frames, 1.0)
+                    job.eta = eta.update(frames_done, job.total_frames)
+                    notify(job)
+
+            rc, seconds = _timed(job, cmd, lambda line: log(f"Chunk {chunk.index}: {line}"), on_event)
+            if job.cancelled:
+                return -1
+            if rc != 0:
+                log("Deadline encode failed, see chunk output above")
+                return rc
+            frames_before += chunk.frames
+            speed = chunk.duration / max(seconds, 1e-3)
+            measured = speed / PRESET_FACTORS[preset]
+            medium_speed = measured if not medium_speed else \
+                SPEED_SMOOTHING * measured + (1 - SPEED_SMOOTHING) * medium_speed
+            log(f"Chunk {chunk.index} ran at {speed:.2f}x with preset {preset}")
+
+        rc = concat_chunks(job, chunks, work_dir, frame_rate, log)
+        finished = time.time()
+        summary = f"Deadline: finished at {format_clock(finished)}"
+        if predicted:
+            summary += f", predicted {format_clock(predicted)}"
+        if job.deadline:
+            summary += f", deadline {format_clock(job.deadline)}"
+        log(summary)
+        return rc
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,330 @@
+import os
+import subprocess
+
+from foxbaker.encoders import FFMPEG, HW_INIT_ERROR_RE, encoder_pix_fmts, mark_failed, output_codec, select_encoder
+from foxbaker.filtergraph import filter_thread_args, plan_chain, source_pix_fmt, source_size
+from foxbaker.fonts import prepare_fonts
+from foxbaker.metrics import JobMetrics, stage, wait_with_usage
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.probe import probe_media
+from foxbaker.progress import EtaEstimator, notify_on_change, pump_lines, read_progress
+
+# Audio codecs each container can take as a stream copy, formats not listed take anything
+AUDIO_COPY_CODECS = {
+    "mp4": {"aac", "mp3", "mp2", "ac3", "eac3", "opus", "flac", "alac", "pcm_s16le"},
+    "mov": {"aac", "mp3", "mp2", "ac3", "eac3", "alac", "pcm_s16le", "pcm_s24le", "pcm_s16be", "pcm_s24be"},
+    "avi": {"aac", "mp3", "mp2", "ac3", "flac", "pcm_s16le", "pcm_u8"},
+    "webm": {"opus", "vorbis"},
+}
+# What the audio is converted to when it can not be copied. AVI gets AC-3 because its
+# encoder is built into every ffmpeg, unlike libmp3lame
+AUDIO_TRANSCODE_ARGS = {
+    "webm": ["-c:a", "libopus", "-b:a", "128k"],
+    "avi": ["-c:a", "ac3", "-b:a", "192k"],
+}
+AUDIO_TRANSCODE_DEFAULT = ["-c:a", "aac", "-b:a", "192k"]
+
+# Indices match the order of "quality_menu_values" in the language files
+QUALITY_NAMES = ["original", "medium", "low", "auto"]
+BITRATE_OPTIONS = {0: 0, 1: 1200000, 2: 600000}
+# Keeps the source size and takes the bitrate measured on sample encodes, see autobitrate.prepare_bitrate()
+AUTO_QUALITY = 3
+
+CREATION_FLAGS = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+
+
+def plan_video_filter(job, subtitle_path, threads=None):
+    """The cheapest filter chain for the job's tier, see filtergraph.plan_chain()."""
+    return plan_chain(job.quality, subtitle_path, source_size(job.video_path), threads or job.threads, job.fontsdir,
+                      source_pix_fmt(job.video_path), encoder_pix_fmts(job_encoder(job).name))
+
+
+def build_video_filter(job, subtitle_path, threads=None):
+    return plan_video_filter(job, subtitle_path, threads).graph
+
+
+def rate_control_args(target_bitrate):
+    return ["-b:v", str(target_bitrate), "-maxrate", str(int(target_bitrate * 1.2)), "-bufsize",
+            str(target_bitrate * 2)]
+
+
+def video_codec_args(job, original_bitrate=None, threads=None, quality=None, output_format=None, preset=None):
+    """
+    Encoder, bitrate and preset arguments for a quality tier, the job's own
+    unless `quality` is given. The encoder is the one select_encoder() finds
+    working for the output format, WebM can not hold H.264 and gets VP9.
+    `preset` replaces the encoder's default -preset.
+    """
+    quality = job.quality if quality is None else quality
+    encoder = job_encoder(job, output_format)
+    args = ["-c:v", encoder.name]
+
+    threads = job.threads if threads is None else threads
+    if threads:
+        args.extend(["-threads", str(threads)])
+
+    target_bitrate = BITRATE_OPTIONS.get(quality, 0)
+    if quality == AUTO_QUALITY and job.auto_bitrate:
+        target_bitrate = job.auto_bitrate
+    if target_bitrate > 0:
+        args.extend(rate_control_args(target_bitrate))
+    elif original_bitrate:
+        args.extend(rate_control_args(max(int(original_bitrate * 0.9), 1000000)))
+    else:
+        args.extend(encoder.quality_args)
+    args.extend(encoder.preset_args if preset is None else ["-preset", preset])
+    return args
+
+
+def job_encoder(job, output_format=None):
+    return select_encoder(output_codec(output_format or job.output_format), hardware=job.hw_enabled,
+                          vendor=job.hw_type)
+
+
+def audio_copy_possible(output_format, source_codecs):
+    allowed = AUDIO_COPY_CODECS.get(output_format)
+    return allowed is None or all(codec in allowed for codec in source_codecs)
+
+
+def audio_codec_args(output_format, source_codecs=None):
+    """
+    Copies the source audio when the container can hold it and converts it
+    otherwise. Without `source_codecs` only formats that take everything copy.
+    """
+    if source_codecs is not None and audio_copy_possible(output_format, source_codecs):
+        return ["-c:a", "copy"]
+    if output_format not in AUDIO_COPY_CODECS:
+        return ["-c:a", "copy"]
+    return AUDIO_TRANSCODE_ARGS.get(output_format, AUDIO_TRANSCODE_DEFAULT)
+
+
+def source_audio_codecs(video_path):
+    """Codecs of the audio streams, None when the file could not be probed."""
+    try:
+        return probe_media(video_path).audio_codecs
+    except (OSError, RuntimeError):
+        return None
+
+
+def build_command(job, subtitle_path, original_bitrate=None, input_args=(), output=None):
+    """The ffmpeg command of a plain encode, `input_args` go before -i and `output` replaces job.output_path."""
+    # -progress replaces the stats line, so stderr only carries real messages
+    cmd = [FFMPEG, "-nostdin", "-nostats"]
+    cmd.extend(filter_thread_args(job.threads))
+    cmd.extend(input_args)
+    cmd.extend(["-i", job.video_path, "-vf", build_video_filter(job, subtitle_path)])
+    cmd.extend(video_codec_args(job, original_bitrate))
+    cmd.extend(audio_codec_args(job.output_format, source_audio_codecs(job.video_path)))
+    cmd.extend(["-progress", "pipe:1", "-y"])
+    cmd.extend(output or [job.output_path])
+    return cmd
+
+
+def format_command(cmd):
+    return " ".join(f'"{c}"' if " " in c else c for c in cmd)
+
+
+def run_process(job, cmd, on_log=None, on_event=None):
+    """
+    Runs one ffmpeg command on behalf of `job` and returns its exit code.
+
+    stderr is passed line by line to on_log(line) from a helper thread, the
+    `-progress pipe:1` blocks on stdout to on_event(ProgressEvent). The raw
+    progress lines go to on_log as well, foxbaker.logbuffer files them as DEBUG.
+    Jobs started by run_job() record the process in job.metrics.
+    """
+    process = job.attach(subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                          encoding="utf-8", errors="replace", creationflags=CREATION_FLAGS))
+    metrics = job.metrics.start_process(cmd) if job.metrics else None
+    try:
+        log_thread = pump_lines(process.stderr, on_log or (lambda line: None))
+        for event in read_progress(process.stdout, on_log):
+            if metrics: metrics.progress(event, process.pid)
+            if on_event: on_event(event)
+        rc, usage = wait_with_usage(process)
+        log_thread.join()
+        if metrics: metrics.finish(rc, usage)
+        return rc
+    finally:
+        job.detach(process)
+
+
+def probe_job(job):
+    """MediaInfo of the job's video or None, fills in job.total_duration and job.total_frames."""
+    try:
+        with stage(job, "probe"):
+            info = probe_media(job.video_path)
+    except (OSError, RuntimeError):
+        return None
+    if not job.total_duration:
+        job.total_duration = info.duration
+    if not job.total_frames:
+        job.total_frames = info.frame_count or 0
+    return info
+
+
+def run_job(job, on_log=None, on_progress=None, on_speed=None):
+    """
+    Runs one job to completion and returns ffmpeg's exit code, -1 when it was
+    cancelled.
+
+    Raises FileNotFoundError when ffmpeg is not installed and RuntimeError
+    when the job can not be done, e.g. when its preflight check failed.
+    Callbacks are called from worker threads: on_log(line), on_progress(job)
+    after job.progress or job.eta changed and on_speed(job, speed).
+
+    When a hardware encoder fails to start, it is not used again in this
+    session and the job runs once more with the next one, in the end with
+    software encoding. Jobs with `preflight` set are checked with a short
+    trial encode first.
+
+    Where the time went is recorded in job.metrics and saved as a JSON
+    report and in the Prometheus text file, see foxbaker.metrics.
+
+    The fonts an .ass script uses are looked up first and handed to libass
+    in a prepared folder, see foxbaker.fonts. The "auto" quality tier then
+    measures its bitrate on sample encodes, see foxbaker.autobitrate.
+
+    Jobs with `mux` set are not encoded at all, the subtitles are muxed as
+    tracks next to the copied video, see foxbaker.mux.
+
+    job.eta starts from the time foxbaker.history predicts from similar
+    earlier jobs, and every job that finished is added to that history.
+    """
+    log = on_log or (lambda message: None)
+    job.metrics = JobMetrics(job)
+    from foxbaker.history import record_job, seed_eta
+    from foxbaker.outputcache import unshare_output
+    try:
+        with stage(job, "history"):
+            seed_eta(job, log=log)
+        # ffmpeg writes into an existing file, one restored from the output cache may share it with others
+        for output in job.renditions or [job]:
+            unshare_output(output.output_path)
+        if job.mux:
+            from foxbaker.mux import run_mux
+            rc = run_mux(job, log, on_progress, on_speed)
+        else:
+            with stage(job, "fonts"):
+                prepare_fonts(job, log)
+            from foxbaker.autobitrate import prepare_bitrate
+            with stage(job, "auto_bitrate"):
+                prepare_bitrate(job, log)
+            rc = -1 if job.cancelled else _run_cached(job, log, on_progress, on_speed)
+    except Exception as e:
+        job.metrics.finish(None, str(e))
+        _save_metrics(job, log)
+        raise
+    job.metrics.finish(rc)
+    _save_metrics(job, log)
+    record_job(job, log)
+    return rc
+
+
+def _save_metrics(job, log):
+    try:
+        log("Metrics: " + job.metrics.save())
+    except OSError as e:
+        log(f"Metrics could not be saved: {e}")
+
+
+def _run_cached(job, log, on_progress, on_speed):
+    """Takes the outputs from foxbaker.outputcache when the same job ran before, stores them otherwise."""
+    if not job.cache:
+        return _run_with_fallback(job, log, on_progress, on_speed)
+    from foxbaker import outputcache
+    with stage(job, "cache"):
+        key = outputcache.job_key(job)
+        if key and outputcache.restore(key, job, log):
+            job.progress = 1.0
+            for rendition in job.renditions:
+                rendition.progress = 1.0
+            if on_progress: on_progress(job)
+            return 0
+    rc = _run_with_fallback(job, log, on_progress, on_speed)
+    if rc == 0 and key and not job.cancelled:
+        with stage(job, "cache"):
+            # Planned again, a GPU encoder that failed to start changes the command
+            outputcache.store(outputcache.job_key(job), job, log)
+    return rc
+
+
+def _run_with_fallback(job, log, on_progress, on_speed):
+    while True:
+        encoder = job_encoder(job)
+        if job.hw_enabled and not encoder.hardware:
+            log(f"No working hardware encoder found, using {encoder.name}")
+        if job.preflight:
+            from foxbaker.preflight import preflight
+            with stage(job, "preflight"):
+                report = preflight(job, log)
+            if job.cancelled:
+                return -1
+            if report.init_error:
+                mark_failed(encoder.name, report.init_error)
+                log(f"{encoder.name} could not be initialized in the preflight trial, trying another encoder")
+                continue
+            if report.errors:
+                raise RuntimeError("Preflight failed: " + "; ".join(report.errors))
+        init_errors = []
+
+        def on_line(line):
+            if encoder.hardware and HW_INIT_ERROR_RE.search(line):
+                init_errors.append(line)
+            log(line)
+
+        with stage(job, "encode"):
+            rc = _run_job(job, on_line, on_progress, on_speed)
+        if rc == 0 or job.cancelled or not init_errors:
+            return rc
+        mark_failed(encoder.name, init_errors[0])
+        log(f"{encoder.name} could not be initialized, retrying the job with another encoder")
+        job.progress = 0.0
+        job.eta = None
+
+
+def _run_job(job, on_log=None, on_progress=None, on_speed=None):
+    if job.renditions:
+        from foxbaker.renditions import run_renditions
+        return run_renditions(job, on_log=on_log, on_progress=on_progress, on_speed=on_speed)
+    if job.smart:
+        from foxbaker.smartrender import run_smart
+        rc = run_smart(job, on_log=on_log, on_progress=on_progress, on_speed=on_speed)
+        if rc is not None:
+            return rc
+    if job.deadline or job.target_speed:
+        from foxbaker.deadline import run_deadline
+        rc = run_deadline(job, on_log=on_log, on_progress=on_progress, on_speed=on_speed)
+        if rc is not None:
+            return rc
+    if job.segmented:
+        from foxbaker.segments import run_segmented
+        return run_segmented(job, on_log=on_log, on_progress=on_progress, on_speed=on_speed)
+
+    log = on_log or (lambda message: None)
+    notify = notify_on_change(on_progress)
+    eta = EtaEstimator(expected=job.expected_seconds)
+    info = probe_job(job)
+    original_bitrate = info.bitrate if info and BITRATE_OPTIONS.get(job.quality, 0) == 0 else None
+
+    with stage(job, "normalize"):
+        subtitle_path = normalize_subtitles(job.subtitle_path)
+    cmd = build_command(job, subtitle_path, original_bitrate)
+    log("Filter graph: " + plan_video_filter(job, subtitle_path).describe())
+    log("Command: " + format_command(cmd))
+
+    def on_event(event):
+        job.fps = event.fps
+        if event.speed is not None:
+            job.speed = event.speed
+            if on_speed: on_speed(job, event.speed)
+        # Frames advance evenly even where the output timestamps jump, e.g. in variable frame rate sources
+        if event.frame is not None and job.total_frames:
+            job.progress = min(event.frame / job.total_frames, 1.0)
+            job.eta = eta.update(event.frame, job.total_frames)
+        elif event.out_time is not None and job.total_duration > 0:
+            job.progress = min(event.out_time / job.total_duration, 1.0)
+            job.eta = eta.update(event.out_time, job.total_duration)
+        notify(job)
+
+    return run_process(job, cmd, on_log=log, on_event=on_event)
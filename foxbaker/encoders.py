@@ -0,0 +1,226 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+from foxbaker.paths import cache_dir
+
+FFMPEG = os.environ.get("FOXBAKER_FFMPEG", "ffmpeg")
+
+ENCODER_CACHE_FILE = "encoders.json"
+ENCODER_CACHE_ENTRIES = 20
+# Broken drivers tend to hang instead of failing, a test encode taking longer than this counts as failed
+TEST_TIMEOUT = 20
+TEST_SOURCE = "color=c=black:s=320x240:r=25"
+TEST_FRAMES = 10
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+# " V....D libx264   libx264 H.264 / AVC / MPEG-4 AVC ..." in `ffmpeg -encoders`
+ENCODER_LINE_RE = re.compile(r'^\s*V[A-Z.]{5}\s+(\S+)')
+# "Supported pixel formats: yuv420p yuvj420p ..." in `ffmpeg -h encoder=libx264`
+PIX_FMTS_RE = re.compile(r'Supported pixel formats:\s*(.+)')
+# stderr lines meaning the GPU or its driver could not be set up, as opposed to a bad input or a full disk
+HW_INIT_ERROR_RE = re.compile(r'cannot load|no \S+ capable devices|device creation failed|failed to (initiali[sz]e|create)'
+                              r'|error (initializing output stream|while opening encoder)|could not open encoder'
+                              r'|openencodesessionex failed|unsupported device|driver does not support', re.IGNORECASE)
+
+# Container formats that can not hold H.264
+FORMAT_CODECS = {"webm": "vp9"}
+
+
+class Encoder:
+    """
+    An ffmpeg video encoder with the arguments FOXBaker uses for it: quality_args
+    select constant quality when no bitrate is given, preset_args the speed.
+    """
+
+    def __init__(self, name, codec, vendor=None, quality_args=(), preset_args=(), test_args=(), selectable=True):
+        self.name = name
+        self.codec = codec
+        # None for software encoders
+        self.vendor = vendor
+        self.quality_args = list(quality_args)
+        self.preset_args = list(preset_args)
+        # Extra arguments the test encode needs, e.g. to upload frames to the GPU
+        self.test_args = list(test_args)
+        # VAAPI needs the frames uploaded inside the filter graph, which the encode commands do not do yet
+        self.selectable = selectable
+
+    @property
+    def hardware(self):
+        return self.vendor is not None
+
+
+# Hardware first, then in order of preference within a codec
+ENCODERS = [
+    Encoder("h264_nvenc", "h264", "NVIDIA", ["-rc", "constqp", "-qp", "22"], ["-preset", "p4"]),
+    Encoder("h264_qsv", "h264", "Intel", ["-global_quality", "22"], ["-preset", "faster"]),
+    Encoder("h264_amf", "h264", "AMD", ["-rc", "cqp", "-qp_i", "20", "-qp_p", "22", "-qp_b", "24"],
+            ["-quality", "speed"]),
+    Encoder("h264_vaapi", "h264", "VAAPI", ["-qp", "22"],
+            test_args=["-vaapi_device", VAAPI_DEVICE, "-vf", "format=nv12,hwupload"], selectable=False),
+    Encoder("libx264", "h264", None, ["-crf", "20"], ["-preset", "medium"]),
+    Encoder("libx265", "hevc", None, ["-crf", "22"], ["-preset", "medium"]),
+    Encoder("libsvtav1", "av1", None, ["-crf", "32"], ["-preset", "8"]),
+    Encoder("libvpx-vp9", "vp9", None, ["-crf", "31", "-b:v", "0"],
+            ["-deadline", "good", "-cpu-used", "4", "-row-mt", "1"]),
+]
+ENCODERS_BY_NAME = {encoder.name: encoder for encoder in ENCODERS}
+
+_capabilities = {}
+# (ffmpeg, encoder name) -> the pixel formats it takes
+_pix_fmts = {}
+# Encoders that failed to start during this session, e.g. because the GPU ran out of encode sessions
+_failed = {}
+_lock = threading.Lock()
+
+
+def _run(cmd, timeout=TEST_TIMEOUT):
+    return subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace", timeout=timeout)
+
+
+def ffmpeg_version(ffmpeg=FFMPEG):
+    """First line of `ffmpeg -version`, raises FileNotFoundError when the binary is missing."""
+    lines = _run([ffmpeg, "-version"]).stdout.splitlines()
+    return lines[0].strip() if lines else ""
+
+
+def list_encoders(ffmpeg=FFMPEG):
+    """Names of the video encoders the ffmpeg build was compiled with."""
+    result = _run([ffmpeg, "-hide_banner", "-encoders"])
+    return [m.group(1) for m in map(ENCODER_LINE_RE.match, result.stdout.splitlines()) if m]
+
+
+def list_hwaccels(ffmpeg=FFMPEG):
+    result = _run([ffmpeg, "-hide_banner", "-hwaccels"])
+    return [line.strip() for line in result.stdout.splitlines()[1:] if line.strip()]
+
+
+def test_encoder(encoder, ffmpeg=FFMPEG):
+    """Encodes a few black frames, returns None on success or the reason the encoder can not be used."""
+    cmd = [ffmpeg, "-hide_banner", "-nostdin", "-v", "error", "-f", "lavfi", "-i", TEST_SOURCE,
+           "-frames:v", str(TEST_FRAMES)]
+    cmd.extend(encoder.test_args)
+    cmd.extend(["-c:v", encoder.name])
+    cmd.extend(encoder.preset_args)
+    cmd.extend(["-f", "null", "-"])
+    try:
+        result = _run(cmd)
+    except subprocess.TimeoutExpired:
+        return f"test encode did not finish within {TEST_TIMEOUT} s"
+    if result.returncode != 0:
+        lines = [line for line in result.stderr.splitlines() if line.strip()]
+        return lines[-1] if lines else f"exit code {result.returncode}"
+    return None
+
+
+def encoder_pix_fmts(name, ffmpeg=FFMPEG):
+    """Pixel formats the encoder takes, an empty list when ffmpeg does not say or can not be run."""
+    if (ffmpeg, name) not in _pix_fmts:
+        try:
+            match = PIX_FMTS_RE.search(_run([ffmpeg, "-hide_banner", "-h", f"encoder={name}"]).stdout)
+        except (OSError, subprocess.TimeoutExpired):
+            return []
+        _pix_fmts[ffmpeg, name] = match.group(1).split() if match else []
+    return _pix_fmts[ffmpeg, name]
+
+
+def probe_capabilities(ffmpeg=FFMPEG):
+    """
+    Checks every known encoder against an ffmpeg binary.
+
+    Returns {"version", "hwaccels", "encoders": {name: error or None}} where an
+    encoder maps to None when a test encode with it succeeded. Encoders the
+    build does not list are not tried.
+    """
+    listed = set(list_encoders(ffmpeg))
+    encoders = {}
+    for encoder in ENCODERS:
+        encoders[encoder.name] = test_encoder(encoder, ffmpeg) if encoder.name in listed else "not in this build"
+    return {"version": ffmpeg_version(ffmpeg), "hwaccels": list_hwaccels(ffmpeg), "encoders": encoders}
+
+
+def _cache_key(ffmpeg, version):
+    return f"{os.path.realpath(shutil.which(ffmpeg) or ffmpeg)}|{version}"
+
+
+def _load_cache():
+    try:
+        with open(cache_dir() / ENCODER_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    path = cache_dir() / ENCODER_CACHE_FILE
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def capabilities(ffmpeg=FFMPEG, refresh=False):
+    """
+    The probe_capabilities() result for `ffmpeg`, kept on disk per binary path
+    and version so the test encodes only run again after ffmpeg changed.
+    Raises FileNotFoundError when ffmpeg is missing. Blocks for seconds on the
+    first call, do not call it from the Tk thread.
+    """
+    with _lock:
+        if not refresh and ffmpeg in _capabilities:
+            return _capabilities[ffmpeg]
+        key = _cache_key(ffmpeg, ffmpeg_version(ffmpeg))
+        cache = _load_cache()
+        caps = None if refresh else cache.get(key)
+        if caps is None:
+            caps = probe_capabilities(ffmpeg)
+            cache.pop(key, None)
+            cache[key] = caps
+            while len(cache) > ENCODER_CACHE_ENTRIES:
+                cache.pop(next(iter(cache)))
+            _save_cache(cache)
+        _capabilities[ffmpeg] = caps
+        return caps
+
+
+def available(name, ffmpeg=FFMPEG):
+    """True when the encoder passed its test encode and has not failed in this session."""
+    passed = capabilities(ffmpeg)["encoders"].get(name, "unknown encoder") is None
+    with _lock:
+        return passed and name not in _failed
+
+
+def mark_failed(name, reason):
+    """Keeps a working-on-paper encoder from being selected again until the program restarts."""
+    with _lock:
+        _failed[name] = reason
+
+
+def select_encoder(codec="h264", hardware=False, vendor=None, ffmpeg=FFMPEG):
+    """
+    Picks the encoder for a codec: with `hardware` the first working GPU
+    encoder, the one from `vendor` if it works, otherwise the first working
+    software encoder. When nothing passed its test, the first software
+    encoder is returned anyway and ffmpeg reports what is wrong.
+    """
+    candidates = [encoder for encoder in ENCODERS if encoder.codec == codec and encoder.selectable]
+    if hardware:
+        gpu = sorted((encoder for encoder in candidates if encoder.hardware), key=lambda e: e.vendor != vendor)
+        for encoder in gpu:
+            if available(encoder.name, ffmpeg):
+                return encoder
+    software = [encoder for encoder in candidates if not encoder.hardware]
+    for encoder in software:
+        if available(encoder.name, ffmpeg):
+            return encoder
+    return software[0]
+
+
+def output_codec(output_format):
+    return FORMAT_CODECS.get(output_format, "h264")
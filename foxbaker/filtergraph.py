@@ -0,0 +1,230 @@
+import re
+from pathlib import Path
+
+from foxbaker.probe import probe_media
+
+# Output size of the quality tiers that scale, the others keep the source size
+TIER_SIZES = {2: (1280, 720)}
+# swscale flags per tier. bicubic is swscale's default, so the 720p tier looks exactly as it always did
+TIER_SCALE_FLAGS = {2: "bicubic"}
+# Rough cost of a filter per megapixel of frame, only used to compare graphs with each other.
+# libass blends glyph bitmaps whose size grows with the frame, so rendering is paid per pixel as well
+SUBTITLES_COST = 1.0
+SCALE_COSTS = {"fast_bilinear": 0.3, "bilinear": 0.5, "area": 0.6, "bicubic": 0.8, "lanczos": 1.2}
+# Chroma subsampling and bit depth as ffmpeg spells them in pixel format names: yuv422p10le, nv12, p010le, rgb48be
+CHROMA_RES = [("gray", re.compile(r'^(gray|ya\d)')),
+              ("444", re.compile(r'444|nv24|nv42|rgb|bgr|gbr')),
+              ("422", re.compile(r'422|nv16|nv20|yuyv|uyvy|yvyu|y210|p21\d')),
+              ("440", re.compile(r'440')),
+              ("411", re.compile(r'41[01]|uyyvyy')),
+              ("420", re.compile(r'420|nv12|nv21|p01\d'))]
+DEPTH_RE = re.compile(r'(?:rgb|bgr)a?(48|64)|(?:p|gray|ya|rgb|bgr)0?(\d{1,2})(?:le|be)|^(y21|nv2)0')
+ALPHA_RE = re.compile(r'yuva|gbrap|rgba|bgra|argb|abgr|^ya')
+# Frames in GPU memory, only picked when the encoder takes nothing else
+HW_PIX_FMTS = {"cuda", "qsv", "vaapi", "d3d11", "dxva2_vld", "videotoolbox_vld", "drm_prime", "vulkan", "opencl",
+               "mediacodec"}
+
+
+def escape_filter_path(path):
+    return Path(path).as_posix().replace(":", r"\:")
+
+
+def subtitles_filter(subtitle_path, original_size=None, fontsdir=None):
+    """
+    libass lays the script out for the frame it draws on. When the frame was
+    scaled first, original_size tells it the source size so positions, font
+    sizes and the aspect ratio come out as if it drew on the source and the
+    result was scaled afterwards. `fontsdir` is a folder of fonts libass
+    loads before asking fontconfig, see fonts.prepare_fonts().
+    """
+    vf = f"subtitles='{escape_filter_path(subtitle_path)}'"
+    if fontsdir:
+        vf += f":fontsdir='{escape_filter_path(fontsdir)}'"
+    if original_size:
+        vf += f":original_size={original_size[0]}x{original_size[1]}"
+    return vf
+
+
+def scale_filter(quality, threads=None):
+    size = TIER_SIZES.get(quality)
+    if not size:
+        return None
+    vf = f"scale={size[0]}:{size[1]}:flags={TIER_SCALE_FLAGS.get(quality, 'bicubic')}"
+    # Slice threading in swscale gives the same pixels as a single thread
+    if threads:
+        vf += f":threads={threads}"
+    return vf
+
+
+def pix_fmt_traits(pix_fmt):
+    """(chroma subsampling, bits per component, alpha) read from the name of a pixel format."""
+    chroma = next((name for name, pattern in CHROMA_RES if pattern.search(pix_fmt)), None)
+    match = DEPTH_RE.search(pix_fmt)
+    if not match:
+        depth = 8
+    elif match.group(1):
+        depth = 16
+    elif match.group(3):
+        depth = 10
+    else:
+        depth = int(match.group(2))
+    return chroma, depth, bool(ALPHA_RE.search(pix_fmt))
+
+
+def closest_pix_fmt(pix_fmt, encoder_pix_fmts):
+    """
+    The encoder's pixel format that loses the least of the source: the same
+    chroma subsampling first, then the same or the next higher bit depth,
+    the same alpha and limited range. rgb24 goes to libx264 as yuv444p, as
+    ffmpeg's own negotiation would pick.
+    """
+    chroma, depth, alpha = pix_fmt_traits(pix_fmt)
+
+    def loss(fmt):
+        fmt_chroma, fmt_depth, fmt_alpha = pix_fmt_traits(fmt)
+        return (fmt in HW_PIX_FMTS, fmt_chroma != chroma, fmt_depth < depth, abs(fmt_depth - depth), fmt_alpha != alpha,
+                fmt.startswith("yuvj"))
+
+    return min(encoder_pix_fmts, key=loss)
+
+
+def pixel_format_filter(pix_fmt, encoder_pix_fmts):
+    """
+    format= filter that converts the source for the encoder, None when the
+    encoder takes the source's pixel format as it is or either is unknown.
+    """
+    if not pix_fmt or not encoder_pix_fmts or pix_fmt in encoder_pix_fmts:
+        return None
+    return f"format={closest_pix_fmt(pix_fmt, encoder_pix_fmts)}"
+
+
+def _chain(*filters):
+    return ",".join(f for f in filters if f)
+
+
+def filter_thread_args(threads, complex_graph=False):
+    """Keeps the filter graph to the job's share of the CPU when several jobs run side by side."""
+    if not threads:
+        return []
+    return ["-filter_complex_threads" if complex_graph else "-filter_threads", str(threads)]
+
+
+def _megapixels(size):
+    return size[0] * size[1] / 1000000.0
+
+
+def _scale_cost(quality, source, target):
+    flags = TIER_SCALE_FLAGS.get(quality, "bicubic")
+    return SCALE_COSTS.get(flags, 1.0) * (_megapixels(source) + _megapixels(target)) / 2
+
+
+class FilterPlan:
+    """The chosen filter graph with its estimated cost and that of the graph FOXBaker used to build."""
+
+    def __init__(self, graph, cost=None, naive_cost=None, pix_fmt=None, conversion=None):
+        # -vf chain, or the list of -filter_complex parts of a multi-output job
+        self.graph = graph
+        self.cost = cost
+        self.naive_cost = naive_cost
+        # Source pixel format and the format= filter converting it for the encoder, None when none is needed
+        self.pix_fmt = pix_fmt
+        self.conversion = conversion
+
+    def describe(self):
+        graph = self.graph if isinstance(self.graph, str) else ";".join(self.graph)
+        if self.cost is None:
+            text = f"{graph} (source size unknown, not planned"
+        else:
+            text = f"{graph} (estimated cost {self.cost:.2f}, subtitles-first graph {self.naive_cost:.2f}"
+        if self.conversion:
+            text += f", {self.pix_fmt} converted before the subtitles"
+        elif self.pix_fmt:
+            text += f", {self.pix_fmt} taken by the encoder as it is"
+        return text + ")"
+
+
+def source_size(video_path):
+    try:
+        info = probe_media(video_path)
+    except (OSError, RuntimeError):
+        return None
+    return (info.width, info.height) if info.width and info.height else None
+
+
+def source_pix_fmt(video_path):
+    try:
+        return probe_media(video_path).pix_fmt
+    except (OSError, RuntimeError):
+        return None
+
+
+def plan_chain(quality, subtitle_path, source, threads=None, fontsdir=None, pix_fmt=None, encoder_pix_fmts=None):
+    """
+    Cheapest -vf chain that burns the subtitles and scales to the tier's size.
+    Downscaling first means libass renders onto the small frame, upscaling
+    first would make it render more pixels than necessary.
+
+    A source the encoder can not take is converted right before the
+    subtitles, after a downscale, so the same swscale pass does both and
+    libass blends in the format the encoder gets. A source it takes stays
+    as it is, no conversion is added.
+    """
+    scale = scale_filter(quality, threads)
+    convert = pixel_format_filter(pix_fmt, encoder_pix_fmts)
+    naive = _chain(convert, subtitles_filter(subtitle_path, fontsdir=fontsdir), scale)
+    target = TIER_SIZES.get(quality)
+    if not source:
+        return FilterPlan(naive, pix_fmt=pix_fmt, conversion=convert)
+    if not scale:
+        cost = SUBTITLES_COST * _megapixels(source)
+        return FilterPlan(naive, cost, cost, pix_fmt, convert)
+    naive_cost = SUBTITLES_COST * _megapixels(source) + _scale_cost(quality, source, target)
+    scaled_cost = _scale_cost(quality, source, target) + SUBTITLES_COST * _megapixels(target)
+    if scaled_cost < naive_cost:
+        return FilterPlan(_chain(scale, convert, subtitles_filter(subtitle_path, source, fontsdir)),
+                          scaled_cost, naive_cost, pix_fmt, convert)
+    return FilterPlan(naive, naive_cost, naive_cost, pix_fmt, convert)
+
+
+def plan_split(qualities, subtitle_path, source, threads=None, fontsdir=None, pix_fmt=None, encoder_pix_fmts=None):
+    """
+    -filter_complex parts for a multi-output job, output i leaves as [v{i}].
+
+    Either the subtitles are rendered once on the source and the result is
+    split and scaled per output, or the source is split per output size and
+    every size is scaled first and rendered on its own, whichever is cheaper.
+    `encoder_pix_fmts` has the formats of each output's encoder, the source
+    is converted before the subtitles when all of them need the same
+    conversion and otherwise left to ffmpeg per output.
+    """
+    count = len(qualities)
+    conversions = {pixel_format_filter(pix_fmt, formats) for formats in encoder_pix_fmts or [None]}
+    convert = conversions.pop() if len(conversions) == 1 else None
+    naive = [f"[0:v]{_chain(convert, subtitles_filter(subtitle_path, fontsdir=fontsdir))},split={count}"
+             + "".join(f"[s{i}]" for i in range(count))]
+    naive.extend(f"[s{i}]{scale_filter(quality, threads) or 'null'}[v{i}]" for i, quality in enumerate(qualities))
+    if not source:
+        return FilterPlan(naive, pix_fmt=pix_fmt, conversion=convert)
+    naive_cost = SUBTITLES_COST * _megapixels(source) + sum(
+        _scale_cost(quality, source, TIER_SIZES[quality]) for quality in qualities if quality in TIER_SIZES)
+
+    # One branch per output size, outputs of the same size share it
+    groups = {}
+    for i, quality in enumerate(qualities):
+        groups.setdefault(TIER_SIZES.get(quality), []).append(i)
+    grouped_cost = 0.0
+    graph = []
+    if len(groups) > 1:
+        graph.append(f"[0:v]split={len(groups)}" + "".join(f"[g{k}]" for k in range(len(groups))))
+    for k, (size, outputs) in enumerate(groups.items()):
+        quality = qualities[outputs[0]]
+        chain = _chain(convert, subtitles_filter(subtitle_path, fontsdir=fontsdir))
+        grouped_cost += SUBTITLES_COST * _megapixels(size or source)
+        if size:
+            chain = _chain(scale_filter(quality, threads), convert, subtitles_filter(subtitle_path, source, fontsdir))
+            grouped_cost += _scale_cost(quality, source, size)
+        source_label = f"[g{k}]" if len(groups) > 1 else "[0:v]"
+        graph.append(f"{source_label}{chain},split={len(outputs)}" + "".join(f"[v{i}]" for i in outputs))
+    if grouped_cost < naive_cost:
+        return FilterPlan(graph, grouped_cost, naive_cost, pix_fmt, convert)
+    return FilterPlan(naive, naive_cost, naive_cost, pix_fmt, convert)
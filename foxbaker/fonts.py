@@ -0,0 +1,445 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from foxbaker.encoders import FFMPEG
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.paths import cache_dir
+from foxbaker.probe import probe_media
+
+FONT_EXTENSIONS = {".ttf", ".otf", ".ttc", ".otc"}
+# Folders next to the subtitle file that releases keep their fonts in, searched before the system fonts
+PROJECT_FONT_FOLDERS = ["fonts", "Fonts", "attachments", "Attachments"]
+# More font folders, separated like PATH
+EXTRA_FONT_DIRS = [d for d in os.environ.get("FOXBAKER_FONT_DIRS", "").split(os.pathsep) if d]
+INDEX_FILE = "index.json"
+# Raise when the index layout changes, older indexes are rebuilt then
+INDEX_VERSION = 1
+# Prepared fontsdir and extracted attachment folders kept each, the least recently used are removed above this
+FONT_FOLDERS_KEPT = 100
+# Name IDs libass matches a font name against: family, full name, PostScript name, typographic family
+NAME_IDS = {1, 4, 6, 16}
+ASS_FONT_OVERRIDE_RE = re.compile(r'\\fn([^\\}]*)')
+ASS_OVERRIDE_BLOCK_RE = re.compile(r'\{[^}]*\}')
+
+_lock = threading.Lock()
+_index = None
+
+
+def system_font_dirs():
+    if os.name == 'nt':
+        windir = os.environ.get("WINDIR", r"C:\Windows")
+        local = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return [os.path.join(windir, "Fonts"), os.path.join(local, "Microsoft", "Windows", "Fonts")]
+    if sys.platform == "darwin":
+        return ["/System/Library/Fonts", "/Library/Fonts", os.path.expanduser("~/Library/Fonts")]
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return ["/usr/share/fonts", "/usr/local/share/fonts", os.path.join(data_home, "fonts"),
+            os.path.expanduser("~/.fonts")]
+
+
+def project_font_dirs(subtitle_path):
+    directory = os.path.dirname(os.path.abspath(subtitle_path))
+    return [directory] + [os.path.join(directory, name) for name in PROJECT_FONT_FOLDERS]
+
+
+def _decode_name(platform, encoding, data):
+    if platform == 0 or (platform == 3 and encoding in (0, 1, 10)):
+        return data.decode("utf-16-be", errors="replace")
+    if platform == 1 and encoding == 0:
+        return data.decode("mac_roman", errors="replace")
+    return None
+
+
+def _face_names(f, offset):
+    """Names of the sfnt face whose table directory starts at `offset`."""
+    f.seek(offset + 4)
+    (num_tables,) = struct.unpack(">H", f.read(2))
+    f.seek(offset + 12)
+    tables = {}
+    for _ in range(num_tables):
+        tag, _, table_offset, length = struct.unpack(">4sIII", f.read(16))
+        tables[tag] = (table_offset, length)
+    if b"name" not in tables:
+        return set()
+    table_offset, length = tables[b"name"]
+    f.seek(table_offset)
+    data = f.read(length)
+    _, count, string_offset = struct.unpack(">HHH", data[:6])
+    names = set()
+    for i in range(count):
+        platform, encoding, _, name_id, size, start = struct.unpack(">HHHHHH", data[6 + i * 12:18 + i * 12])
+        if name_id not in NAME_IDS:
+            continue
+        name = _decode_name(platform, encoding, data[string_offset + start:string_offset + start + size])
+        if name and name.strip():
+            names.add(name.strip().lower())
+    return names
+
+
+def font_names(path):
+    """
+    Lowercased family, full and PostScript names of a TrueType/OpenType file
+    or collection, read from its `name` table. Raises OSError or ValueError
+    for files that are not fonts.
+    """
+    with open(path, "rb") as f:
+        tag = f.read(4)
+        if tag == b"ttcf":
+            f.seek(8)
+            (count,) = struct.unpack(">I", f.read(4))
+            offsets = struct.unpack(f">{count}I", f.read(4 * count))
+        elif tag in (b"\x00\x01\x00\x00", b"OTTO", b"true"):
+            offsets = [0]
+        else:
+            raise ValueError("not a TrueType or OpenType font")
+        names = set()
+        for offset in offsets:
+            names |= _face_names(f, offset)
+    return sorted(names)
+
+
+def _load_index():
+    global _index
+    if _index is None:
+        try:
+            with open(cache_dir("fonts") / INDEX_FILE, "r", encoding="utf-8") as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+        if _index.get("version") != INDEX_VERSION:
+            _index = {"version": INDEX_VERSION, "dirs": {}}
+    return _index
+
+
+def _save_index():
+    path = cache_dir("fonts") / INDEX_FILE
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_index, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _scan_dir(directory, dirs, fonts, seen, recursive=True):
+    """
+    Adds the fonts of `directory` and, when `recursive`, its subfolders to `fonts` (path -> names).
+    Like fontconfig, a folder is only listed again when its mtime changed.
+    Returns True when the index was updated.
+    """
+    directory = os.path.abspath(directory)
+    if directory in seen:
+        return False
+    seen.add(directory)
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return False
+    entry = dirs.get(directory)
+    changed = False
+    if entry is None or entry["mtime"] != mtime:
+        entry = {"mtime": mtime, "subdirs": [], "fonts": {}}
+        try:
+            with os.scandir(directory) as it:
+                for item in it:
+                    if item.is_dir():
+                        entry["subdirs"].append(item.name)
+                    elif os.path.splitext(item.name)[1].lower() in FONT_EXTENSIONS:
+                        try:
+                            entry["fonts"][item.name] = font_names(item.path)
+                        except (OSError, ValueError, struct.error):
+                            pass
+        except OSError:
+            return False
+        dirs[directory] = entry
+        changed = True
+    for name, names in entry["fonts"].items():
+        fonts[os.path.join(directory, name)] = names
+    for name in entry["subdirs"] if recursive else []:
+        changed = _scan_dir(os.path.join(directory, name), dirs, fonts, seen) or changed
+    return changed
+
+
+def font_index(directories, recursive=True):
+    """Every font below `directories` with its names, in the order the directories are given."""
+    fonts = {}
+    with _lock:
+        index = _load_index()
+        seen = set()
+        changed = False
+        for directory in directories:
+            changed = _scan_dir(directory, index["dirs"], fonts, seen, recursive) or changed
+        if changed:
+            _save_index()
+    return fonts
+
+
+def _ass_sections(lines):
+    section = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            section = stripped.lower()
+        else:
+            yield section, line
+
+
+def used_fonts(subtitle_path):
+    """
+    Font names an .ass script asks for: the Fontname of every style and every
+    inline \\fn override. Empty for other subtitle formats.
+    """
+    with open(subtitle_path, "r", encoding="utf-8-sig", errors="replace") as f:
+        lines = f.read().splitlines()
+    if not any(line.strip().lower() == "[script info]" for line in lines):
+        return []
+    names = {}
+    fontname_index = 1
+    text_index = 9
+    for section, line in _ass_sections(lines):
+        key, _, value = line.partition(":")
+        key = key.strip().lower()
+        if section in ("[v4+ styles]", "[v4 styles]"):
+            if key == "format":
+                fields = [name.strip().lower() for name in value.split(",")]
+                fontname_index = fields.index("fontname") if "fontname" in fields else None
+            elif key == "style" and fontname_index is not None:
+                fields = value.split(",")
+                if len(fields) > fontname_index:
+                    name = fields[fontname_index].strip()
+                    names.setdefault(name.lstrip("@").lower(), name.lstrip("@"))
+        elif section == "[events]":
+            if key == "format":
+                fields = [name.strip().lower() for name in value.split(",")]
+                text_index = fields.index("text") if "text" in fields else len(fields) - 1
+            elif key == "dialogue":
+                text = value.split(",", text_index)[-1]
+                for block in ASS_OVERRIDE_BLOCK_RE.findall(text):
+                    for name in ASS_FONT_OVERRIDE_RE.findall(block):
+                        # An empty \fn goes back to the style's font
+                        name = name.strip().lstrip("@")
+                        if name:
+                            names.setdefault(name.lower(), name)
+    return sorted(names.values(), key=str.lower)
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def _is_font_attachment(attachment):
+    mimetype = (attachment.get("mimetype") or "").lower()
+    extension = os.path.splitext(attachment.get("filename") or "")[1].lower()
+    return extension in FONT_EXTENSIONS or "font" in mimetype or "opentype" in mimetype
+
+
+def extract_attachments(video_path, info=None):
+    """
+    Writes the fonts attached to a Matroska video into a folder of the cache
+    and returns it, None when the video has no fonts attached. The folder is
+    kept per video file, so every attachment is extracted once.
+    """
+    info = info or probe_media(video_path)
+    attachments = [(i, a) for i, a in enumerate(info.attachments) if _is_font_attachment(a)]
+    if not attachments:
+        return None
+    root = cache_dir("fonts") / "attachments"
+    root.mkdir(exist_ok=True)
+    directory = root / hashlib.sha1(_file_key(video_path).encode("utf-8")).hexdigest()
+    if directory.is_dir():
+        os.utime(directory)
+        return directory
+    tmp = Path(tempfile.mkdtemp(prefix=directory.name + ".", dir=root))
+    os.chmod(tmp, 0o755)
+    try:
+        cmd = [FFMPEG, "-nostdin", "-hide_banner", "-v", "error"]
+        for number, (i, attachment) in enumerate(attachments):
+            extension = os.path.splitext(attachment.get("filename") or "")[1].lower()
+            # Our own names, the ones stored in the file could point anywhere
+            name = f"{number:03d}{extension if extension in FONT_EXTENSIONS else '.ttf'}"
+            cmd.extend([f"-dump_attachment:t:{i}", str(tmp / name)])
+        cmd.extend(["-i", video_path, "-t", "0", "-f", "null", "-"])
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace")
+        if not any(tmp.iterdir()):
+            raise RuntimeError(f"ffmpeg extracted no attachments: {result.stderr.strip() or result.returncode}")
+        os.replace(tmp, directory)
+    except OSError:
+        # Another job extracted them at the same time
+        if not directory.is_dir():
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    _trim_folders(root)
+    return directory
+
+
+class FontReport:
+    def __init__(self):
+        # Font name as the script writes it -> the files of its family
+        self.resolved = {}
+        self.missing = []
+        # Fonts attached to the video
+        self.attached = 0
+        self.fontsdir = None
+
+
+def resolve_fonts(names, sources):
+    """
+    Finds a file for each font name in `sources`, a list of font indexes
+    searched in order. All faces of a family are taken, libass picks the bold
+    and italic ones from them.
+    """
+    report = FontReport()
+    for name in names:
+        key = name.lower()
+        for fonts in sources:
+            files = [path for path, font in fonts.items() if key in font]
+            if files:
+                report.resolved[name] = files
+                break
+        else:
+            report.missing.append(name)
+    return report
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def attached_font(path):
+    """True for a font extract_attachments() took out of a video, it goes wherever the video goes."""
+    return cache_dir("fonts") / "attachments" in Path(path).parents
+
+
+def prepare_fontsdir(files):
+    """
+    A cache folder holding exactly `files`, for the subtitles filter's
+    fontsdir option. libass loads the fonts of that folder itself and does
+    not have to find them through fontconfig.
+    """
+    keys = sorted(_file_key(path) for path in files)
+    root = cache_dir("fonts") / "sets"
+    root.mkdir(exist_ok=True)
+    directory = root / hashlib.sha1(json.dumps(keys).encode("utf-8")).hexdigest()[:20]
+    if not directory.is_dir():
+        tmp = Path(tempfile.mkdtemp(prefix=directory.name + ".", dir=root))
+        os.chmod(tmp, 0o755)
+        try:
+            for i, path in enumerate(sorted(set(files))):
+                _link(path, tmp / f"{i:03d}_{os.path.basename(path)}")
+            os.replace(tmp, directory)
+        except OSError:
+            if not directory.is_dir():
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    os.utime(directory)
+    _trim_folders(root)
+    return directory
+
+
+def _trim_folders(root):
+    try:
+        folders = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(root)
+                      if entry.is_dir() and "." not in entry.name)
+    except OSError:
+        return
+    for _, path in folders[:-FONT_FOLDERS_KEPT]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def check_fonts(video_path, subtitle_path, info=None, origin_path=None):
+    """
+    Resolves the fonts an .ass script uses, searching the fonts attached to
+    the video first, then the folders next to the subtitle file, the folders
+    in FOXBAKER_FONT_DIRS and the system fonts. `subtitle_path` is the file
+    that is parsed, usually the normalize_subtitles() copy in the cache, and
+    `origin_path` the file the user picked, whose folder is searched.
+    """
+    names = used_fonts(subtitle_path)
+    attached = extract_attachments(video_path, info) if video_path else None
+    sources = []
+    if attached:
+        sources.append(font_index([attached]))
+    project = project_font_dirs(origin_path or subtitle_path)
+    # Only the files of the subtitle's own folder, it may hold a whole drive of videos
+    sources.append(font_index(project[:1], recursive=False))
+    sources.append(font_index(project[1:] + EXTRA_FONT_DIRS))
+    sources.append(font_index(system_font_dirs()))
+    report = resolve_fonts(names, sources)
+    report.attached = len(sources[0]) if attached else 0
+    return report
+
+
+def prepare_fonts(job, log=None):
+    """
+    Resolves the fonts of the job's subtitles, reports the missing ones and
+    sets job.fontsdir to a folder with the fonts found, which the subtitles
+    filter is then pointed at. Never raises, the encode can go on without.
+    """
+    log = log or (lambda message: None)
+    job.fontsdir = None
+    try:
+        report = check_fonts(job.video_path, normalize_subtitles(job.subtitle_path), origin_path=job.subtitle_path)
+        if report.resolved:
+            job.fontsdir = str(prepare_fontsdir([path for files in report.resolved.values() for path in files]))
+    except (OSError, RuntimeError, UnicodeError) as e:
+        log(f"Fonts could not be prepared, libass looks them up itself: {e}")
+        return None
+    if report.attached:
+        log(f"Fonts: {report.attached} attached to the video")
+    if report.resolved:
+        log(f"Fonts: {len(report.resolved)} found, fontsdir {job.fontsdir}")
+    if report.missing:
+        log(f"Fonts: not found, libass substitutes another font for {', '.join(report.missing)}")
+    return report
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="foxbaker.fonts",
+                                     description="Check which fonts an .ass file uses and where they are found.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("check", help="resolve the fonts of a subtitle file, missing fonts exit with 1")
+    check.add_argument("subtitles")
+    check.add_argument("--video", help="take the fonts attached to this video into account")
+    commands.add_parser("index", help="update the font index and print how many fonts it knows")
+    commands.add_parser("clear", help="remove the font index, extracted attachments and prepared folders")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "check":
+        report = check_fonts(args.video, normalize_subtitles(args.subtitles), origin_path=args.subtitles)
+        print(json.dumps({"resolved": report.resolved, "missing": report.missing, "attached": report.attached},
+                         ensure_ascii=False, indent=2))
+        return 1 if report.missing else 0
+    if args.command == "index":
+        started = time.monotonic()
+        fonts = font_index(EXTRA_FONT_DIRS + system_font_dirs())
+        print(json.dumps({"fonts": len(fonts), "seconds": round(time.monotonic() - started, 3),
+                          "directories": EXTRA_FONT_DIRS + system_font_dirs()}))
+        return 0
+    with _lock:
+        shutil.rmtree(cache_dir("fonts"), ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
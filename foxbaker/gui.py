@@ -0,0 +1,1093 @@
+import sys
+
+import customtkinter as ctk
+import tkinter as tk
+from tkinter import filedialog, messagebox
+import os
+from pathlib import Path
+import time
+import json
+import glob
+import threading
+
+from foxbaker.deadline import parse_finish_time
+from foxbaker.encode import AUTO_QUALITY, QUALITY_NAMES, run_job
+from foxbaker.encoders import ENCODERS, available
+from foxbaker.history import format_size, predict_job
+from foxbaker.logbuffer import DEBUG, INFO, LOG_DIR, JobLogFile, LogBuffer, classify, job_log_path
+from foxbaker.preview import PREVIEW_FRAMES, Previewer, line_text, parse_time
+from foxbaker.probe import probe_media
+from foxbaker.remote import JOBS_PER_WORKER, WORKERS, WorkerPool, run_remote
+from foxbaker.progress import EtaEstimator
+from foxbaker.sprites import ATLAS_FILE, IDLE_FRAMES, IDLE_ROW, RUN_FLIPPED_ROW, RUN_FRAMES, RUN_ROW, cut_frames
+from foxbaker.subtitles import format_ass_time
+from foxbaker.jobs import Job, JobQueue, Rendition, Scheduler, QUEUED, RUNNING, DONE, FAILED, CANCELLED, default_output_name
+from foxbaker.uistate import FINISHED, LOG, PROGRESS, QUEUE, UiState
+
+# Лог перерисовывается пачками не чаще этого интервала, виджет хранит не больше LOG_WIDGET_LINES строк
+LOG_FLUSH_MS = 250
+LOG_WIDGET_LINES = 2000
+# Анимация, прогресс и лог обновляются в одном таймере, пока окно свёрнуто он не запускается
+UI_TICK_MS = 50
+FOX_IDLE_FRAME_MS = 150
+FOX_RUN_FRAME_MS = 100
+
+
+def resource_path(relative_path):
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    try:
+        # PyInstaller creates a temp folder and stores path in _MEIPASS
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+
+    return os.path.join(base_path, relative_path)
+
+
+class LocalizationManager:
+    def __init__(self, lang_dir='lang', default_lang='ru'):
+        self.locales = {}
+        self.lang_dir = lang_dir
+        self.language_map = {}
+        self.load_languages()
+        self.current_lang = default_lang
+        if default_lang not in self.locales:
+            self.current_lang = next(iter(self.locales))
+
+    def load_languages(self):
+        lang_files = glob.glob(os.path.join(self.lang_dir, '*.json'))
+        for file in lang_files:
+            lang_code = Path(file).stem
+            try:
+                with open(file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    self.locales[lang_code] = data
+                    self.language_map[data.get('language_name', lang_code)] = lang_code
+            except Exception as e:
+                print(f"Error loading language file {file}: {e}")
+
+    def get(self, key):
+        return self.locales.get(self.current_lang, {}).get(key, key)
+
+    def get_available_languages(self):
+        return {code: data.get('language_name', code) for code, data in self.locales.items()}
+
+    def set_language(self, lang_name):
+        lang_code = self.language_map.get(lang_name)
+        if lang_code and lang_code in self.locales:
+            self.current_lang = lang_code
+            return True
+        return False
+
+
+class FOXBaker:
+    def __init__(self, profile=None):
+        # Используем новую функцию для поиска папки lang
+        lang_path = resource_path('lang')
+        self.loc = LocalizationManager(lang_dir=lang_path, default_lang='en')
+        if profile: profile.mark("localization")
+
+        ctk.set_appearance_mode("dark")
+        self.root = ctk.CTk()
+        self.root.title(self.loc.get("window_title"))
+        self.root.geometry("700x780")
+        self.root.minsize(600, 650)
+        self.root.configure(fg_color="#211A16")
+
+        self.video_path = tk.StringVar()
+        self.subtitle_path = tk.StringVar()
+        self.output_name = tk.StringVar()
+        self.output_dir = tk.StringVar()
+        self.quality_mode = tk.StringVar()
+        self.output_format = tk.StringVar(value="mp4")
+        self.hw_accel_enabled = tk.BooleanVar(value=False)
+        self.hw_accel_type = tk.StringVar(value="AMD")
+        self.segmented_enabled = tk.BooleanVar(value=False)
+        self.all_qualities_enabled = tk.BooleanVar(value=False)
+        self.smart_render_enabled = tk.BooleanVar(value=False)
+        self.soft_subtitles_enabled = tk.BooleanVar(value=False)
+        self.output_cache_enabled = tk.BooleanVar(value=False)
+        self.finish_by = tk.StringVar(value="")
+        self.preview_time = tk.StringVar(value="")
+        self.is_processing = False
+        self.queue = JobQueue()
+        # С FOXBAKER_WORKERS задания кодируются на других машинах
+        self.worker_pool = WorkerPool(WORKERS) if WORKERS else None
+        self.scheduler = Scheduler(self.queue, self.run_ffmpeg, on_change=self.on_job_changed,
+                                   on_idle=self.on_queue_idle,
+                                   max_jobs=len(WORKERS) * JOBS_PER_WORKER if WORKERS else None)
+        self.queue_rows = {}
+        self.log_buffer = LogBuffer()
+        self.log_verbose = tk.BooleanVar(value=False)
+        # Лог, панель выбора GPU и кадры бега создаются при первом использовании
+        self.log_text = None
+        self.log_verbose_checkbox = None
+        self.hw_accel_frame = None
+        self.working_encoders = None
+        self.sprite_atlas = None
+        # Окно предпросмотра и Previewer создаются при первом нажатии и живут, пока не сменятся файлы
+        self.preview_window = None
+        self.previewer = None
+        self.preview_key = None
+        self.preview_line = None
+        self.preview_images = []
+        self.preview_busy = False
+        self.ui_state = UiState()
+        self.tick_id = None
+        self.window_visible = True
+        self.next_fox_frame = 0
+        self.last_log_flush = 0
+        self.progress_width = 0
+        self.log_visible = False
+        self.hw_accel_menu_visible = False
+        self.fox_idle_frames = []
+        self.fox_run_frames = []
+        self.fox_run_frames_flipped = []
+        self.current_fox_frame = 0
+        self.fox_position = 0
+        self.fox_direction = 1
+        self.progress_canvas = None
+        self.progress_window = None
+        self.fox_image_id = None
+        self.fox_text_id = None
+        self.start_time = 0
+        self.current_progress = 0
+        self.eta_estimator = EtaEstimator()
+        self.displayed_progress = None
+
+        self.load_fox_sprites()
+        if profile: profile.mark("sprites")
+        self.setup_ui()
+        self.start_fox_idle_animation()
+        self.root.bind("<Configure>", self.on_window_resize)
+        self.root.bind("<Map>", self.on_window_map)
+        self.root.bind("<Unmap>", self.on_window_unmap)
+        self.update_ui_text()
+        self.check_encoders()
+        self.schedule_tick()
+        if profile:
+            profile.mark("widgets")
+            self.root.after_idle(lambda: self.report_startup(profile))
+
+    def load_fox_sprites(self):
+        # Один заранее собранный PNG (python -m foxbaker.sprites), Tk читает его сам, без PIL
+        try:
+            self.sprite_atlas = tk.PhotoImage(file=resource_path(ATLAS_FILE))
+            self.fox_idle_frames = cut_frames(self.sprite_atlas, IDLE_ROW, IDLE_FRAMES)
+        except Exception as e:
+            print(f"Sprite loading error: {e}")
+
+    def load_fox_run_sprites(self):
+        if self.fox_run_frames or self.sprite_atlas is None: return
+        try:
+            self.fox_run_frames = cut_frames(self.sprite_atlas, RUN_ROW, RUN_FRAMES)
+            self.fox_run_frames_flipped = cut_frames(self.sprite_atlas, RUN_FLIPPED_ROW, RUN_FRAMES)
+        except Exception as e:
+            print(f"Sprite loading error: {e}")
+
+    def report_startup(self, profile):
+        profile.mark("first draw")
+        print(profile.report())
+
+    def setup_ui(self):
+        top_frame = ctk.CTkFrame(self.root, fg_color="transparent")
+        top_frame.pack(fill="x", padx=20, pady=(10, 0))
+
+        self.title_label = ctk.CTkLabel(top_frame, font=ctk.CTkFont(size=48, weight="bold"), text_color="#D95B14")
+        self.title_label.pack(fill="x")  # Этот виджет теперь заполняет всю ширину и центрирует текст
+
+        lang_values = list(self.loc.get_available_languages().values())
+        self.lang_menu = ctk.CTkOptionMenu(top_frame, values=lang_values, command=self.change_language,
+                                           width=120, fg_color="#423A36", button_color="#423A36",
+                                           button_hover_color="#574F4A", text_color="#F0E6DD")
+        # Используем place для точного позиционирования справа, не влияя на заголовок
+        self.lang_menu.place(relx=1.0, rely=0.5, x=-5, anchor="e")
+        self.lang_menu.set(self.loc.get_available_languages().get(self.loc.current_lang))
+
+        self.main_frame = ctk.CTkScrollableFrame(self.root, fg_color="transparent")
+        self.main_frame.pack(fill="both", expand=True, padx=20, pady=20)
+
+        # --- Все остальные виджеты остаются как были, до кнопок логов ---
+
+        video_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        video_frame.pack(fill="x", padx=10, pady=5)
+        self.video_label = ctk.CTkLabel(video_frame, font=ctk.CTkFont(size=14, weight="bold"), text_color="#F0E6DD")
+        self.video_label.pack(anchor="w")
+        video_input_frame = ctk.CTkFrame(video_frame, fg_color="transparent")
+        video_input_frame.pack(fill="x")
+        self.video_entry = ctk.CTkEntry(video_input_frame, textvariable=self.video_path, height=35,
+                                        font=ctk.CTkFont(size=12), fg_color="#3D3530", border_width=0,
+                                        text_color="#F0E6DD")
+        self.video_entry.pack(side="left", fill="x", expand=True, padx=(0, 10))
+        self.video_browse_button = ctk.CTkButton(video_input_frame, command=self.browse_video, width=80, height=35,
+                                                 fg_color="#423A36", hover_color="#574F4A", text_color="#F0E6DD")
+        self.video_browse_button.pack(side="right")
+
+        sub_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        sub_frame.pack(fill="x", padx=10, pady=5)
+        self.sub_label = ctk.CTkLabel(sub_frame, font=ctk.CTkFont(size=14, weight="bold"), text_color="#F0E6DD")
+        self.sub_label.pack(anchor="w")
+        sub_input_frame = ctk.CTkFrame(sub_frame, fg_color="transparent")
+        sub_input_frame.pack(fill="x")
+        self.sub_entry = ctk.CTkEntry(sub_input_frame, textvariable=self.subtitle_path, height=35,
+                                      font=ctk.CTkFont(size=12), fg_color="#3D3530", border_width=0,
+                                      text_color="#F0E6DD")
+        self.sub_entry.pack(side="left", fill="x", expand=True, padx=(0, 10))
+        self.sub_browse_button = ctk.CTkButton(sub_input_frame, command=self.browse_subtitles, width=80, height=35,
+                                               fg_color="#423A36", hover_color="#574F4A", text_color="#F0E6DD")
+        self.sub_browse_button.pack(side="right")
+
+        name_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        name_frame.pack(fill="x", padx=10, pady=5)
+        self.name_label = ctk.CTkLabel(name_frame, font=ctk.CTkFont(size=14, weight="bold"), text_color="#F0E6DD")
+        self.name_label.pack(anchor="w")
+        name_input_frame = ctk.CTkFrame(name_frame, fg_color="transparent")
+        name_input_frame.pack(fill="x")
+        self.name_entry = ctk.CTkEntry(name_input_frame, textvariable=self.output_name, height=35,
+                                       font=ctk.CTkFont(size=12), fg_color="#3D3530", border_width=0,
+                                       text_color="#F0E6DD")
+        self.name_entry.pack(side="left", fill="x", expand=True, padx=(0, 10))
+        self.format_menu = ctk.CTkOptionMenu(name_input_frame, variable=self.output_format,
+                                             values=["mp4", "mkv", "avi", "mov", "webm"], width=80, height=35,
+                                             fg_color="#423A36", button_color="#423A36", button_hover_color="#574F4A",
+                                             text_color="#F0E6DD")
+        self.format_menu.pack(side="right")
+
+        output_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        output_frame.pack(fill="x", padx=10, pady=5)
+        self.output_dir_label = ctk.CTkLabel(output_frame, font=ctk.CTkFont(size=14, weight="bold"),
+                                             text_color="#F0E6DD")
+        self.output_dir_label.pack(anchor="w")
+        output_input_frame = ctk.CTkFrame(output_frame, fg_color="transparent")
+        output_input_frame.pack(fill="x")
+        self.output_entry = ctk.CTkEntry(output_input_frame, textvariable=self.output_dir, height=35,
+                                         font=ctk.CTkFont(size=12), fg_color="#3D3530", border_width=0,
+                                         text_color="#F0E6DD")
+        self.output_entry.pack(side="left", fill="x", expand=True, padx=(0, 10))
+        self.output_dir_browse_button = ctk.CTkButton(output_input_frame, command=self.browse_output_dir, width=80,
+                                                      height=35, fg_color="#423A36", hover_color="#574F4A",
+                                                      text_color="#F0E6DD")
+        self.output_dir_browse_button.pack(side="right")
+
+        button_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        button_frame.pack(fill="x", padx=10, pady=10)
+        self.start_button = ctk.CTkButton(button_frame, command=self.start_processing, height=45,
+                                          font=ctk.CTkFont(size=16, weight="bold"), fg_color="#D95B14",
+                                          hover_color="#F26E21", text_color="#F0E6DD")
+        self.start_button.pack(side="left", fill="x", expand=True, padx=(0, 10))
+        self.add_queue_button = ctk.CTkButton(button_frame, command=self.add_to_queue, height=45, width=120,
+                                              font=ctk.CTkFont(size=14), fg_color="#423A36",
+                                              hover_color="#574F4A", text_color="#F0E6DD")
+        self.add_queue_button.pack(side="left", padx=(0, 10))
+        self.preview_button = ctk.CTkButton(button_frame, command=self.open_preview, height=45, width=120,
+                                            font=ctk.CTkFont(size=14), fg_color="#423A36",
+                                            hover_color="#574F4A", text_color="#F0E6DD")
+        self.preview_button.pack(side="left", padx=(0, 10))
+        self.quality_menu = ctk.CTkOptionMenu(button_frame, variable=self.quality_mode, width=120, height=45,
+                                              fg_color="#423A36", button_color="#423A36", button_hover_color="#574F4A",
+                                              font=ctk.CTkFont(size=14), text_color="#F0E6DD")
+        self.quality_menu.pack(side="right")
+
+        hw_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        hw_frame.pack(fill="x", padx=10, pady=5)
+        self.hw_frame = hw_frame
+        self.hw_accel_checkbox = ctk.CTkCheckBox(hw_frame, variable=self.hw_accel_enabled,
+                                                 command=self.toggle_hw_accel_menu, font=ctk.CTkFont(size=13),
+                                                 fg_color="#D95B14", text_color="#F0E6DD")
+        self.hw_accel_checkbox.pack(anchor="w")
+        finish_frame = ctk.CTkFrame(hw_frame, fg_color="transparent")
+        finish_frame.pack(anchor="w", side="bottom", pady=(5, 0))
+        self.finish_by_label = ctk.CTkLabel(finish_frame, font=ctk.CTkFont(size=13), text_color="#F0E6DD")
+        self.finish_by_label.pack(side="left", padx=(0, 10))
+        self.finish_by_entry = ctk.CTkEntry(finish_frame, textvariable=self.finish_by, width=80, height=28,
+                                            font=ctk.CTkFont(size=12), fg_color="#3D3530", border_width=0,
+                                            text_color="#F0E6DD")
+        self.finish_by_entry.pack(side="left")
+        self.segmented_checkbox = ctk.CTkCheckBox(hw_frame, variable=self.segmented_enabled,
+                                                  font=ctk.CTkFont(size=13), fg_color="#D95B14",
+                                                  text_color="#F0E6DD")
+        self.segmented_checkbox.pack(anchor="w", side="bottom", pady=(5, 0))
+        self.smart_render_checkbox = ctk.CTkCheckBox(hw_frame, variable=self.smart_render_enabled,
+                                                     font=ctk.CTkFont(size=13), fg_color="#D95B14",
+                                                     text_color="#F0E6DD")
+        self.smart_render_checkbox.pack(anchor="w", side="bottom", pady=(5, 0))
+        self.all_qualities_checkbox = ctk.CTkCheckBox(hw_frame, variable=self.all_qualities_enabled,
+                                                      font=ctk.CTkFont(size=13), fg_color="#D95B14",
+                                                      text_color="#F0E6DD")
+        self.all_qualities_checkbox.pack(anchor="w", side="bottom", pady=(5, 0))
+        self.soft_subtitles_checkbox = ctk.CTkCheckBox(hw_frame, variable=self.soft_subtitles_enabled,
+                                                       font=ctk.CTkFont(size=13), fg_color="#D95B14",
+                                                       text_color="#F0E6DD")
+        self.soft_subtitles_checkbox.pack(anchor="w", side="bottom", pady=(5, 0))
+        self.output_cache_checkbox = ctk.CTkCheckBox(hw_frame, variable=self.output_cache_enabled,
+                                                     font=ctk.CTkFont(size=13), fg_color="#D95B14",
+                                                     text_color="#F0E6DD")
+        self.output_cache_checkbox.pack(anchor="w", side="bottom", pady=(5, 0))
+
+        queue_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        queue_frame.pack(fill="x", padx=10, pady=5)
+        self.queue_label = ctk.CTkLabel(queue_frame, font=ctk.CTkFont(size=14, weight="bold"), text_color="#F0E6DD")
+        self.queue_label.pack(anchor="w")
+        self.queue_list_frame = ctk.CTkFrame(queue_frame, fg_color="#3D3530")
+        self.queue_list_frame.pack(fill="x")
+        self.queue_empty_label = ctk.CTkLabel(self.queue_list_frame, font=ctk.CTkFont(size=12),
+                                              text_color="#A89F98")
+        self.queue_empty_label.pack(anchor="w", padx=10, pady=5)
+
+        self.status_label = ctk.CTkLabel(self.main_frame, font=ctk.CTkFont(size=14), text_color="#F0E6DD")
+        self.status_label.pack(pady=(10, 10))
+        progress_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        progress_frame.pack(fill="x", padx=10, pady=5)
+        self.progress_canvas = tk.Canvas(progress_frame, height=44, bg="#211A16", bd=0, highlightthickness=0)
+        self.progress_canvas.pack(fill="x")
+        self.progress_bar = ctk.CTkProgressBar(self.progress_canvas, height=20, progress_color="#D95B14",
+                                               fg_color="#3D3530")
+        self.progress_bar.set(0)
+        self.progress_window = self.progress_canvas.create_window(0, 22, anchor="nw", window=self.progress_bar,
+                                                                  width=self.progress_canvas.winfo_width())
+        self.progress_canvas.bind("<Configure>", self._on_progress_canvas_resize)
+        initial_frame = self.fox_idle_frames[0] if self.fox_idle_frames else None
+        if initial_frame:
+            self.fox_image_id = self.progress_canvas.create_image(5, 4, anchor="nw", image=initial_frame)
+
+        info_frame = ctk.CTkFrame(progress_frame, fg_color="transparent")
+        info_frame.pack(fill="x", pady=(5, 0))
+        self.progress_percent_label = ctk.CTkLabel(info_frame, text="0%", font=ctk.CTkFont(size=12),
+                                                   text_color="#F0E6DD")
+        self.progress_percent_label.pack(side="left")
+        self.time_remaining_label = ctk.CTkLabel(info_frame, font=ctk.CTkFont(size=12), text_color="#F0E6DD")
+        self.time_remaining_label.pack(side="right")
+        self.cancel_button = ctk.CTkButton(self.main_frame, command=self.cancel_processing, height=35,
+                                           fg_color="#A93F3F", hover_color="#C85F5F")
+        self.cancel_button.pack(pady=5, padx=10)
+
+        # --- Изменения здесь ---
+        # Кнопки логов теперь пакуются отдельно для идеального центрирования
+        self.log_toggle_button = ctk.CTkButton(self.main_frame, command=self.toggle_log, height=30,
+                                               fg_color="transparent", hover_color="#423A36", text_color="#F0E6DD")
+        self.log_toggle_button.pack(pady=(5, 0), padx=10)
+
+        self.copy_logs_button = ctk.CTkButton(self.main_frame, command=self.copy_logs, height=30, fg_color="#423A36",
+                                              hover_color="#574F4A")
+        self.copy_logs_button.pack(pady=(5, 10), padx=10)
+        # --- Конец изменений ---
+
+        self.video_path.trace("w", self.update_output_defaults)
+
+    def change_language(self, lang_name):
+        if self.loc.set_language(lang_name):
+            self.update_ui_text()
+
+    def update_ui_text(self):
+        self.root.title(self.loc.get("window_title"))
+        self.title_label.configure(text=self.loc.get("main_title"))
+        self.video_label.configure(text=self.loc.get("video_file_label"))
+        self.video_browse_button.configure(text=self.loc.get("browse_button"))
+        self.sub_label.configure(text=self.loc.get("subtitle_file_label"))
+        self.sub_browse_button.configure(text=self.loc.get("browse_button"))
+        self.name_label.configure(text=self.loc.get("output_name_label"))
+        self.output_dir_label.configure(text=self.loc.get("output_dir_label"))
+        self.output_dir_browse_button.configure(text=self.loc.get("browse_button"))
+        self.start_button.configure(text=self.loc.get("start_button"))
+        self.add_queue_button.configure(text=self.loc.get("add_to_queue_button"))
+        self.preview_button.configure(text=self.loc.get("preview_button"))
+        if self.preview_window is not None and self.preview_window.winfo_exists():
+            self.update_preview_text()
+        self.update_queue_estimate()
+        self.queue_empty_label.configure(text=self.loc.get("queue_empty"))
+
+        quality_menu_values = self.loc.get("quality_menu_values")
+        self.quality_mode.set(quality_menu_values[0])
+        self.quality_menu.configure(values=quality_menu_values)
+
+        self.hw_accel_checkbox.configure(text=self.loc.get("hw_accel_checkbox"))
+        self.segmented_checkbox.configure(text=self.loc.get("segmented_checkbox"))
+        self.all_qualities_checkbox.configure(text=self.loc.get("all_qualities_checkbox"))
+        self.smart_render_checkbox.configure(text=self.loc.get("smart_render_checkbox"))
+        self.soft_subtitles_checkbox.configure(text=self.loc.get("soft_subtitles_checkbox"))
+        self.output_cache_checkbox.configure(text=self.loc.get("output_cache_checkbox"))
+        self.finish_by_label.configure(text=self.loc.get("finish_by_label"))
+        if self.hw_accel_frame:
+            self.hw_accel_type_label.configure(text=self.loc.get("hw_accel_type_label"))
+        self.status_label.configure(text=self.loc.get("status_ready"))
+        self.cancel_button.configure(text=self.loc.get("cancel_button"))
+        self.log_toggle_button.configure(
+            text=self.loc.get("show_logs_button") if not self.log_visible else self.loc.get("hide_logs_button"))
+        self.copy_logs_button.configure(text=self.loc.get("copy_logs_button"))
+        if self.log_verbose_checkbox:
+            self.log_verbose_checkbox.configure(text=self.loc.get("log_verbose_checkbox"))
+
+        # --- ВОТ ИСПРАВЛЕНИЕ ---
+        self.time_remaining_label.configure(text="")  # Добавлена эта строка
+        self.displayed_progress = None
+        self.refresh_queue_view()
+
+    def build_log_widgets(self):
+        self.log_text = ctk.CTkTextbox(self.main_frame, height=150, font=ctk.CTkFont(family="Consolas", size=10),
+                                       fg_color="#1C1C1C", text_color="#F0E6DD")
+        self.log_verbose_checkbox = ctk.CTkCheckBox(self.main_frame, variable=self.log_verbose,
+                                                    command=self.toggle_log_verbose, font=ctk.CTkFont(size=11),
+                                                    fg_color="#D95B14", text_color="#F0E6DD",
+                                                    text=self.loc.get("log_verbose_checkbox"))
+        # Всё, что накопилось до открытия лога, уже лежит в буфере
+        self.log_buffer.drain()
+        text = self.log_buffer.text(self.log_buffer.level)
+        if text:
+            self.log_text.insert("end", "\n".join(text.split("\n")[-LOG_WIDGET_LINES:]) + "\n")
+
+    def toggle_log(self):
+        self.log_visible = not self.log_visible
+        if self.log_visible:
+            if self.log_text is None: self.build_log_widgets()
+            self.log_verbose_checkbox.pack(anchor="w", padx=10, pady=(0, 5))
+            self.log_text.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+            self.log_toggle_button.configure(text=self.loc.get("hide_logs_button"))
+            self.update_ui_layout()
+            self.log_text.see("end")
+        else:
+            self.log_verbose_checkbox.pack_forget()
+            self.log_text.pack_forget()
+            self.log_toggle_button.configure(text=self.loc.get("show_logs_button"))
+
+    def validate_inputs(self):
+        if not self.video_path.get() or not os.path.exists(self.video_path.get()):
+            messagebox.showerror(self.loc.get("error_msg_title"), self.loc.get("invalid_video_file_msg"))
+            return False
+        if not self.subtitle_path.get() or not os.path.exists(self.subtitle_path.get()):
+            messagebox.showerror(self.loc.get("error_msg_title"), self.loc.get("invalid_subtitle_file_msg"))
+            return False
+        if not self.output_name.get().strip():
+            messagebox.showerror(self.loc.get("error_msg_title"), self.loc.get("invalid_output_name_msg"))
+            return False
+        if not self.output_dir.get() or not os.path.exists(self.output_dir.get()):
+            messagebox.showerror(self.loc.get("error_msg_title"), self.loc.get("invalid_output_dir_msg"))
+            return False
+        if self.finish_by.get().strip():
+            try:
+                parse_finish_time(self.finish_by.get())
+            except ValueError:
+                messagebox.showerror(self.loc.get("error_msg_title"), self.loc.get("invalid_finish_time_msg"))
+                return False
+        return True
+
+    @staticmethod
+    def format_remaining(remaining):
+        return f"{int(remaining // 60):02d}:{int(remaining % 60):02d}"
+
+    def update_progress_info(self, progress):
+        if progress <= 0:
+            self.eta_estimator.reset()
+        # Скорость сглаживается, поэтому оценка не скачет на сложных сценах
+        remaining = self.eta_estimator.update(progress, 1.0)
+        if progress <= 0.01 or remaining is None:
+            # Пока скорость не измерена, оценка берётся из истории
+            remaining = self.predicted_remaining()
+        if remaining is None:
+            eta_text = self.loc.get("time_remaining_label_calc")
+        elif remaining >= 1:
+            eta_text = self.loc.get("time_remaining_label_prefix") + self.format_remaining(remaining)
+        else:
+            eta_text = self.loc.get("time_remaining_label_finishing")
+        # Виджеты трогаем только когда видимое значение изменилось
+        state = (round(progress, 3), eta_text)
+        if state == self.displayed_progress: return
+        self.displayed_progress = state
+        self.progress_bar.set(progress)
+        self.progress_percent_label.configure(text=f"{int(progress * 100)}%")
+        self.time_remaining_label.configure(text=eta_text)
+
+    def predicted_remaining(self, jobs=None):
+        """Оставшееся время очереди по ETA идущих заданий и прогнозу для ждущих, None если прогноза нет."""
+        jobs = self.queue.pending() if jobs is None else jobs
+        if not jobs or any(job.eta is None and job.expected_seconds is None for job in jobs):
+            return None
+        total = sum(job.eta if job.eta is not None else job.expected_seconds for job in jobs)
+        return total / max(1, min(len(jobs), self.scheduler.slots or 1))
+
+    def snapshot_job(self):
+        # Настройки фиксируются в момент постановки в очередь, воркеры не читают Tk-переменные
+        output_path = os.path.join(self.output_dir.get(),
+                                   f"{self.output_name.get().strip()}.{self.output_format.get()}")
+        quality = self.loc.get("quality_menu_values").index(self.quality_mode.get())
+        renditions = []
+        # Мягкие субтитры не кодируют видео, так что и уровни качества им не нужны
+        mux = self.soft_subtitles_enabled.get()
+        if self.all_qualities_enabled.get() and not mux:
+            # Все уровни качества за одно декодирование: имя_original.mp4, имя_medium.mp4, имя_low.mp4
+            base, ext = os.path.splitext(output_path)
+            renditions = [Rendition(f"{base}_{name}{ext}", q) for q, name in enumerate(QUALITY_NAMES[:AUTO_QUALITY])]
+        # Время "к 07:00" считается от момента постановки в очередь
+        deadline = parse_finish_time(self.finish_by.get()) if self.finish_by.get().strip() else None
+        return Job(self.video_path.get(), self.subtitle_path.get(), output_path, quality=quality,
+                   hw_enabled=self.hw_accel_enabled.get(), hw_type=self.hw_accel_type.get(),
+                   segmented=self.segmented_enabled.get(), renditions=renditions,
+                   smart=self.smart_render_enabled.get(), deadline=deadline, mux=mux,
+                   cache=self.output_cache_enabled.get())
+
+    def run_ffmpeg(self, job):
+        self.update_status("status_processing_video")
+        log_file = None
+
+        def on_log(line):
+            level = classify(line)
+            self.log_message(f"[{job.id}] {line}", level)
+            if log_file: log_file.write(line, level)
+
+        if LOG_DIR:
+            try:
+                log_file = JobLogFile(job_log_path(job, LOG_DIR))
+            except OSError as e:
+                self.log_message(f"[{job.id}] Log file error: {e}")
+        try:
+            if self.worker_pool:
+                return run_remote(job, self.worker_pool, on_log=on_log,
+                                  on_progress=lambda job: self.ui_state.publish(PROGRESS),
+                                  on_speed=self.scheduler.report_speed)
+            return run_job(job, on_log=on_log,
+                           on_progress=lambda job: self.ui_state.publish(PROGRESS),
+                           on_speed=self.scheduler.report_speed)
+        except FileNotFoundError:
+            job.error = "ffmpeg_not_found_msg"
+            self.log_message(f"[{job.id}] Error: FFmpeg not found")
+        except Exception as e:
+            job.error = str(e)
+            self.log_message(f"[{job.id}] Error: {str(e)}")
+        finally:
+            if log_file: log_file.close()
+        return None
+
+    def add_to_queue(self):
+        if not self.validate_inputs(): return False
+        if not self.is_processing:
+            self.queue.clear_finished()
+        job = self.snapshot_job()
+        self.queue.add(job)
+        self.prefetch_media_info(job.video_path, job)
+        self.refresh_queue_view()
+        if self.is_processing:
+            self.scheduler.wake()
+        return True
+
+    def start_processing(self):
+        if self.is_processing: return
+        self.queue.clear_finished()
+        if not self.queue.next_queued() and not self.add_to_queue(): return
+        self.is_processing = True
+        self.start_button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+        self.update_status("status_processing_start")
+        self.start_time = time.time()
+        self.progress_bar.set(0)
+        self.update_progress_info(0)
+        self.refresh_queue_view()
+        self.start_fox_run_animation()
+        self.scheduler.start()
+
+    def cancel_processing(self):
+        if self.is_processing:
+            self.queue.cancel_all()
+            self.log_message("Process cancelled by user.")
+            self.update_status("status_processing_cancelled")
+
+    def cancel_job(self, job_id):
+        job = self.queue.get(job_id)
+        if job is None: return
+        if job.finished:
+            self.queue.remove(job_id)
+        elif self.queue.cancel(job_id):
+            self.log_message(f"[{job.id}] Job cancelled by user.")
+        self.refresh_queue_view()
+
+    def move_job(self, job_id, offset):
+        if self.queue.move(job_id, offset):
+            self.refresh_queue_view()
+
+    def on_job_changed(self, job):
+        if job.status == FAILED and job.returncode is not None:
+            self.log_message(f"[{job.id}] FFmpeg exited with code {job.returncode}")
+        self.ui_state.publish(QUEUE)
+
+    def on_queue_idle(self):
+        self.ui_state.publish(FINISHED)
+
+    def finish_queue(self):
+        batch = [job for job in self.queue.jobs() if job.finished and job.end_time >= self.start_time]
+        self.stop_processing()
+        self.refresh_queue_view()
+        done = [job for job in batch if job.status == DONE]
+        failed = [job for job in batch if job.status == FAILED]
+        cancelled = [job for job in batch if job.status == CANCELLED]
+        if len(batch) == 1:
+            self.finish_single_job(batch[0])
+        elif batch:
+            if cancelled and not done and not failed:
+                self.update_status("status_processing_cancelled")
+            else:
+                self.update_status("status_processing_error" if failed else "status_processing_done")
+            if done or failed:
+                messagebox.showinfo(self.loc.get("info_msg_title"),
+                                    self.loc.get("queue_finished_msg").format(done=len(done), failed=len(failed),
+                                                                              cancelled=len(cancelled)))
+
+    def throughput_summary(self, job):
+        # Сводка из job.metrics, у заданий на удалённых воркерах её нет
+        summary = job.metrics.summary() if job.metrics else None
+        if not summary or not summary["fps"]:
+            return ""
+        text = "\n" + self.loc.get("throughput_stats").format(
+            fps=summary["fps"], speed=summary["speed"] or 0, time=self.format_remaining(summary["wall_seconds"]))
+        if summary["cpu_seconds"] is not None and summary["peak_rss_bytes"] is not None:
+            text += "\n" + self.loc.get("resource_stats").format(cpu=summary["cpu_seconds"],
+                                                                  memory=summary["peak_rss_bytes"] / (1024 * 1024))
+        return text
+
+    def finish_single_job(self, job):
+        if job.status == CANCELLED:
+            self.update_status("status_processing_cancelled")
+        elif job.status == DONE:
+            self.update_status("status_processing_done")
+            self.update_progress_info(1.0)
+            outputs = [r.output_path for r in job.renditions] or [job.output_path]
+            try:
+                original_size = os.path.getsize(job.video_path) / (1024 * 1024)
+                output_size = sum(os.path.getsize(path) for path in outputs) / (1024 * 1024)
+                compression_ratio = (
+                            (original_size - output_size) / original_size * 100) if original_size > 0 else 0
+                size_info = f"\nOriginal size: {original_size:.1f} MB\nOutput size: {output_size:.1f} MB\nCompression: {compression_ratio:.1f}%"
+                size_info += self.throughput_summary(job)
+                messagebox.showinfo(self.loc.get("success_msg_title"),
+                                    self.loc.get("processing_success_with_stats_msg").format(stats=size_info,
+                                                                                             path="\n".join(outputs)))
+            except:
+                messagebox.showinfo(self.loc.get("success_msg_title"),
+                                    self.loc.get("processing_success_msg").format(path="\n".join(outputs)))
+        elif job.error == "ffmpeg_not_found_msg":
+            self.update_status("status_ffmpeg_not_found")
+            messagebox.showerror(self.loc.get("error_msg_title"), self.loc.get("ffmpeg_not_found_msg"))
+        elif job.error:
+            self.update_status("status_error_occurred")
+            messagebox.showerror(self.loc.get("error_msg_title"),
+                                 self.loc.get("generic_error_msg").format(error=job.error))
+        else:
+            self.update_status("status_processing_error")
+            messagebox.showerror(self.loc.get("error_msg_title"), self.loc.get("processing_failed_msg"))
+
+    def stop_processing(self):
+        self.is_processing = False
+        self.start_button.configure(state="normal")
+        self.cancel_button.configure(state="disabled")
+        self.start_fox_idle_animation()
+
+    def refresh_queue_view(self):
+        jobs = self.queue.jobs()
+        if [job.id for job in jobs] != list(self.queue_rows):
+            for row in self.queue_rows.values():
+                row["frame"].destroy()
+            self.queue_rows = {job.id: self._create_queue_row(job) for job in jobs}
+        if jobs:
+            self.queue_empty_label.pack_forget()
+        else:
+            self.queue_empty_label.pack(anchor="w", padx=10, pady=5)
+        for job in jobs:
+            self._update_queue_row(job)
+
+    def _create_queue_row(self, job):
+        frame = ctk.CTkFrame(self.queue_list_frame, fg_color="transparent")
+        frame.pack(fill="x", padx=5, pady=2)
+        label = ctk.CTkLabel(frame, anchor="w", font=ctk.CTkFont(size=12), text_color="#F0E6DD")
+        label.pack(side="left", fill="x", expand=True, padx=5)
+        for text, command in (("✕", lambda: self.cancel_job(job.id)),
+                              ("▼", lambda: self.move_job(job.id, 1)),
+                              ("▲", lambda: self.move_job(job.id, -1))):
+            ctk.CTkButton(frame, text=text, command=command, width=28, height=24, fg_color="#423A36",
+                          hover_color="#574F4A", text_color="#F0E6DD").pack(side="right", padx=(2, 0))
+        return {"frame": frame, "label": label}
+
+    def _update_queue_row(self, job):
+        row = self.queue_rows.get(job.id)
+        if not row: return
+        text = f"{job.name} — {self.loc.get('job_status_' + job.status)}"
+        if job.status == RUNNING:
+            text += f" {int(job.progress * 100)}%"
+            if job.renditions:
+                text += " (" + " / ".join(f"{int(r.progress * 100)}%" for r in job.renditions) + ")"
+            if job.eta is not None:
+                text += f", {self.format_remaining(job.eta)}"
+        elif job.status == QUEUED and job.expected_seconds is not None:
+            text += f", ~{self.format_remaining(job.expected_seconds)}"
+            if job.expected_bytes:
+                text += f", ~{format_size(job.expected_bytes)}"
+        if row.get("text") != text:
+            row["text"] = text
+            row["label"].configure(text=text)
+
+    def update_queue_progress(self):
+        for job in self.queue.jobs():
+            self._update_queue_row(job)
+        self.update_queue_estimate()
+        if self.is_processing:
+            self.update_progress_info(self.queue.overall_progress())
+
+    def update_queue_estimate(self):
+        text = self.loc.get("queue_label")
+        jobs = self.queue.pending()
+        remaining = self.predicted_remaining(jobs)
+        if remaining is not None:
+            size = sum(job.expected_bytes or 0 for job in jobs)
+            text += " " + self.loc.get("queue_estimate_label").format(time=self.format_remaining(remaining),
+                                                                      size=format_size(size))
+        if self.queue_label.cget("text") != text:
+            self.queue_label.configure(text=text)
+
+    def update_status(self, status_key):
+        self.ui_state.set_status(status_key)
+
+    def copy_logs(self):
+        self.root.clipboard_clear()
+        self.root.clipboard_append(self.log_buffer.text())
+        messagebox.showinfo(self.loc.get("info_msg_title"), self.loc.get("logs_copied_msg"))
+
+    def open_preview(self):
+        if not self.video_path.get() or not os.path.exists(self.video_path.get()):
+            messagebox.showerror(self.loc.get("error_msg_title"), self.loc.get("invalid_video_file_msg"))
+            return
+        if not self.subtitle_path.get() or not os.path.exists(self.subtitle_path.get()):
+            messagebox.showerror(self.loc.get("error_msg_title"), self.loc.get("invalid_subtitle_file_msg"))
+            return
+        if self.preview_window is None or not self.preview_window.winfo_exists():
+            self.build_preview_window()
+        self.preview_window.deiconify()
+        self.preview_window.lift()
+        key = (self.video_path.get(), self.subtitle_path.get())
+        if key != self.preview_key:
+            self.preview_key = key
+            self.previewer = None
+            self.preview_line = None
+        self.show_preview(self.preview_line or 0)
+
+    def build_preview_window(self):
+        window = ctk.CTkToplevel(self.root)
+        window.configure(fg_color="#211A16")
+        window.transient(self.root)
+        nav_frame = ctk.CTkFrame(window, fg_color="transparent")
+        nav_frame.pack(fill="x", padx=10, pady=(10, 5))
+        self.preview_prev_button = ctk.CTkButton(nav_frame, command=lambda: self.preview_step(-1), width=120,
+                                                 height=32, fg_color="#423A36", hover_color="#574F4A",
+                                                 text_color="#F0E6DD")
+        self.preview_prev_button.pack(side="left", padx=(0, 10))
+        self.preview_next_button = ctk.CTkButton(nav_frame, command=lambda: self.preview_step(1), width=120,
+                                                 height=32, fg_color="#423A36", hover_color="#574F4A",
+                                                 text_color="#F0E6DD")
+        self.preview_next_button.pack(side="left", padx=(0, 10))
+        self.preview_go_button = ctk.CTkButton(nav_frame, command=self.preview_go, width=80, height=32,
+                                               fg_color="#D95B14", hover_color="#F26E21", text_color="#F0E6DD")
+        self.preview_go_button.pack(side="right")
+        time_entry = ctk.CTkEntry(nav_frame, textvariable=self.preview_time, width=100, height=32,
+                                  font=ctk.CTkFont(size=12), fg_color="#3D3530", border_width=0, text_color="#F0E6DD")
+        time_entry.pack(side="right", padx=(0, 10))
+        time_entry.bind("<Return>", lambda event: self.preview_go())
+        self.preview_time_label = ctk.CTkLabel(nav_frame, font=ctk.CTkFont(size=13), text_color="#F0E6DD")
+        self.preview_time_label.pack(side="right", padx=(0, 10))
+        self.preview_info_label = ctk.CTkLabel(window, font=ctk.CTkFont(size=12), text_color="#F0E6DD",
+                                               justify="left", anchor="w", wraplength=960)
+        self.preview_info_label.pack(fill="x", padx=10)
+        # Кадры — обычные tk.PhotoImage, PNG Tk читает сам
+        self.preview_grid = tk.Frame(window, bg="#211A16")
+        self.preview_grid.pack(padx=10, pady=(5, 10))
+        self.preview_window = window
+        self.update_preview_text()
+
+    def update_preview_text(self):
+        self.preview_window.title(self.loc.get("preview_window_title"))
+        self.preview_prev_button.configure(text=self.loc.get("preview_prev_button"))
+        self.preview_next_button.configure(text=self.loc.get("preview_next_button"))
+        self.preview_go_button.configure(text=self.loc.get("preview_go_button"))
+        self.preview_time_label.configure(text=self.loc.get("preview_time_label"))
+
+    def preview_step(self, offset):
+        if self.previewer is None or not len(self.previewer.timeline): return
+        timeline = self.previewer.timeline
+        self.show_preview(timeline.next_line(self.preview_line) if offset > 0
+                          else timeline.previous_line(self.preview_line))
+
+    def preview_go(self):
+        try:
+            at = parse_time(self.preview_time.get())
+        except ValueError:
+            messagebox.showerror(self.loc.get("error_msg_title"), self.loc.get("invalid_preview_time_msg"),
+                                 parent=self.preview_window)
+            return
+        self.show_preview(None, at)
+
+    def show_preview(self, line, at=None):
+        # Рендер идёт в потоке, нажатия во время рендера пропускаются
+        if self.preview_busy: return
+        self.preview_busy = True
+        self.preview_info_label.configure(text=self.loc.get("preview_rendering"))
+        key = self.preview_key
+        previewer = self.previewer
+
+        def worker():
+            nonlocal previewer, line, at
+            paths, error = None, None
+            try:
+                # Первый раз читаются субтитры, шрифты и размер видео, дальше только ffmpeg
+                previewer = previewer or Previewer(*key)
+                timeline = previewer.timeline
+                if at is None:
+                    line = line if len(timeline) else None
+                    at = timeline.events[line].start if line is not None else 0.0
+                else:
+                    line = timeline.line_at(at)
+                paths = previewer.render(at, frames=PREVIEW_FRAMES)
+            except FileNotFoundError:
+                error = self.loc.get("ffmpeg_not_found_msg")
+            except Exception as e:
+                error = str(e)
+            self.root.after(0, lambda: self.apply_preview(key, previewer, line, at, paths, error))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def apply_preview(self, key, previewer, line, at, paths, error):
+        self.preview_busy = False
+        if self.preview_window is None or not self.preview_window.winfo_exists() or key != self.preview_key: return
+        if error:
+            self.preview_info_label.configure(text=self.loc.get("generic_error_msg").format(error=error))
+            return
+        self.previewer = previewer
+        self.preview_line = line
+        self.preview_time.set(format_ass_time(at))
+        for child in self.preview_grid.winfo_children():
+            child.destroy()
+        # Tk не держит ссылки на картинки сам, без списка они пропадут
+        self.preview_images = [tk.PhotoImage(file=path).subsample(2) for path in paths]
+        for i, image in enumerate(self.preview_images):
+            tk.Label(self.preview_grid, image=image, bd=0, bg="#211A16").grid(row=i // 3, column=i % 3, padx=2,
+                                                                             pady=2)
+        timeline = previewer.timeline
+        if line is None:
+            text = self.loc.get("preview_no_line").format(time=format_ass_time(at))
+        else:
+            text = self.loc.get("preview_line_info").format(number=line + 1, total=len(timeline),
+                                                           time=format_ass_time(timeline.events[line].start),
+                                                           text=line_text(timeline.events[line]))
+        if previewer.missing_fonts:
+            text += "\n" + self.loc.get("preview_missing_fonts").format(fonts=", ".join(previewer.missing_fonts))
+        self.preview_info_label.configure(text=text)
+
+    # All other helper/utility methods remain the same
+    def browse_video(self):
+        fn = filedialog.askopenfilename(filetypes=[("Video files", "*.mp4 *.avi *.mov *.mkv *.webm")])
+        if fn: self.video_path.set(fn)
+
+    def browse_subtitles(self):
+        fn = filedialog.askopenfilename(filetypes=[("Subtitle files", "*.ass *.srt"), ("All files", "*.*")])
+        if fn: self.subtitle_path.set(fn)
+
+    def browse_output_dir(self):
+        fn = filedialog.askdirectory()
+        if fn: self.output_dir.set(fn)
+
+    def update_output_defaults(self, *args):
+        v = self.video_path.get()
+        if v and os.path.exists(v):
+            self.output_name.set(default_output_name(v))
+            if not self.output_dir.get(): self.output_dir.set(str(Path(v).parent))
+            if os.path.isfile(v): self.prefetch_media_info(v)
+
+    def prefetch_media_info(self, path, job=None):
+        # ffprobe на сетевых дисках может работать секундами, поэтому не в потоке Tk.
+        # Результат попадает в кэш, и run_job потом не запускает ffprobe повторно
+        def worker():
+            try:
+                info = probe_media(path)
+            except Exception as e:
+                self.log_message(f"Probe error: {e}")
+                return
+            if job is None:
+                self.log_message(f"{os.path.basename(path)}: {info.width}x{info.height} {info.video_codec}, "
+                                 f"{info.fps or 0:.3f} fps, {info.duration:.1f}s, audio: {info.audio_codec}")
+            else:
+                if not job.total_duration:
+                    job.total_duration = info.duration
+                # Время и размер по похожим прошлым заданиям — видны в очереди ещё до старта
+                try:
+                    prediction = predict_job(job, info)
+                except Exception as e:
+                    self.log_message(f"History error: {e}")
+                    prediction = None
+                if prediction and job.expected_seconds is None:
+                    job.expected_seconds = prediction.seconds
+                    job.expected_bytes = prediction.output_bytes
+                self.ui_state.publish(QUEUE, PROGRESS)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def on_window_resize(self, event):
+        if event.widget == self.root: self.update_ui_layout()
+
+    def update_ui_layout(self):
+        if self.log_visible and self.log_text is not None:
+            available_height = self.root.winfo_height() - 600
+            self.log_text.configure(height=max(100, min(200, available_height)))
+
+    def on_window_map(self, event):
+        if event.widget is self.root:
+            self.window_visible = True
+            self.schedule_tick()
+
+    def on_window_unmap(self, event):
+        # Свёрнутое окно ничего не перерисовывает, накопленные изменения применятся при разворачивании
+        if event.widget is self.root:
+            self.window_visible = False
+            if self.tick_id: self.root.after_cancel(self.tick_id)
+            self.tick_id = None
+
+    def schedule_tick(self):
+        if self.tick_id is None and self.window_visible:
+            self.tick_id = self.root.after(UI_TICK_MS, self.tick)
+
+    def tick(self):
+        self.tick_id = None
+        if not self.window_visible: return
+        now = time.monotonic()
+        changes, status_key = self.ui_state.take()
+        if status_key: self.status_label.configure(text=self.loc.get(status_key))
+        if QUEUE in changes: self.refresh_queue_view()
+        if QUEUE in changes or PROGRESS in changes: self.update_queue_progress()
+        if LOG in changes:
+            if now - self.last_log_flush >= LOG_FLUSH_MS / 1000:
+                self.last_log_flush = now
+                self.flush_log()
+            else:
+                self.ui_state.publish(LOG)
+        if now >= self.next_fox_frame:
+            self.next_fox_frame = now + (FOX_RUN_FRAME_MS if self.is_processing else FOX_IDLE_FRAME_MS) / 1000
+            if self.is_processing: self.animate_fox_run()
+            else: self.animate_fox_idle()
+        # До finish_queue: её messagebox крутит вложенный цикл событий, в котором тики должны продолжаться
+        self.schedule_tick()
+        if FINISHED in changes: self.finish_queue()
+
+    def _on_progress_canvas_resize(self, event):
+        self.progress_canvas.itemconfig(self.progress_window, width=event.width)
+        self.progress_width = event.width
+        max_pos = max(0, event.width - 30)
+        if self.fox_position > max_pos:
+            self.fox_position = max_pos
+            if self.fox_image_id: self.progress_canvas.coords(self.fox_image_id, self.fox_position, 4)
+
+    def check_encoders(self):
+        # Пробные кодирования идут секунды при первом запуске, потом результат берётся из кэша
+        def worker():
+            try:
+                working = {encoder.vendor: encoder.name for encoder in ENCODERS
+                           if encoder.hardware and encoder.selectable and available(encoder.name)}
+            except Exception as e:
+                self.log_message(f"Encoder check error: {e}")
+                return
+            self.log_message("Hardware encoders: " + (", ".join(working.values()) or "none"))
+            self.root.after(0, lambda: self.apply_encoder_check(working))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def apply_encoder_check(self, working):
+        self.working_encoders = working
+        if self.hw_accel_frame is None: return
+        radios = {"AMD": self.hw_amd_radio, "NVIDIA": self.hw_nvidia_radio, "Intel": self.hw_intel_radio}
+        for vendor, radio in radios.items():
+            radio.configure(state="normal" if vendor in working else "disabled")
+        if working and self.hw_accel_type.get() not in working:
+            self.hw_accel_type.set(next(vendor for vendor in radios if vendor in working))
+
+    def build_hw_accel_panel(self):
+        self.hw_accel_frame = ctk.CTkFrame(self.hw_frame, fg_color="#3D3530")
+        self.hw_accel_type_label = ctk.CTkLabel(self.hw_accel_frame, font=ctk.CTkFont(size=12), text_color="#F0E6DD",
+                                                text=self.loc.get("hw_accel_type_label"))
+        self.hw_accel_type_label.pack(anchor="w", padx=10, pady=(10, 5))
+        self.hw_amd_radio = ctk.CTkRadioButton(self.hw_accel_frame, text="AMD (h24_amf)", variable=self.hw_accel_type,
+                                               value="AMD", font=ctk.CTkFont(size=11), fg_color="#D95B14",
+                                               text_color="#F0E6DD")
+        self.hw_amd_radio.pack(anchor="w", padx=20, pady=2)
+        self.hw_nvidia_radio = ctk.CTkRadioButton(self.hw_accel_frame, text="NVIDIA (h264_nvenc)",
+                                                  variable=self.hw_accel_type, value="NVIDIA",
+                                                  font=ctk.CTkFont(size=11), fg_color="#D95B14", text_color="#F0E6DD")
+        self.hw_nvidia_radio.pack(anchor="w", padx=20, pady=2)
+        self.hw_intel_radio = ctk.CTkRadioButton(self.hw_accel_frame, text="Intel (h264_qsv)",
+                                                 variable=self.hw_accel_type, value="Intel",
+                                                 font=ctk.CTkFont(size=11), fg_color="#D95B14", text_color="#F0E6DD")
+        self.hw_intel_radio.pack(anchor="w", padx=20, pady=(2, 10))
+        if self.working_encoders is not None:
+            self.apply_encoder_check(self.working_encoders)
+
+    def toggle_hw_accel_menu(self):
+        self.hw_accel_menu_visible = not self.hw_accel_menu_visible
+        if self.hw_accel_frame is None: self.build_hw_accel_panel()
+        if self.hw_accel_enabled.get():
+            self.hw_accel_frame.pack(fill="x", padx=20, pady=5)
+        else:
+            self.hw_accel_frame.pack_forget()
+
+    def animate_fox_idle(self):
+        if not self.is_processing and self.fox_idle_frames:
+            frame = self.fox_idle_frames[self.current_fox_frame]
+            if self.fox_image_id: self.progress_canvas.itemconfigure(self.fox_image_id, image=frame)
+            self.current_fox_frame = (self.current_fox_frame + 1) % len(self.fox_idle_frames)
+
+    def animate_fox_run(self):
+        if self.is_processing and self.fox_run_frames:
+            frames = self.fox_run_frames if self.fox_direction == 1 else self.fox_run_frames_flipped
+            frame = frames[self.current_fox_frame]
+            if self.fox_image_id: self.progress_canvas.itemconfigure(self.fox_image_id, image=frame)
+
+            if self.progress_width > 30:
+                max_position = self.progress_width - 30
+                self.fox_position += self.fox_direction * 3
+                if self.fox_position >= max_position:
+                    self.fox_direction = -1
+                elif self.fox_position <= 0:
+                    self.fox_direction = 1
+                self.progress_canvas.coords(self.fox_image_id, self.fox_position, 4)
+
+            self.current_fox_frame = (self.current_fox_frame + 1) % len(frames)
+
+    def start_fox_idle_animation(self):
+        if not self.is_processing:
+            self.fox_position = 5;
+            self.current_fox_frame = 0
+            self.next_fox_frame = 0
+
+    def start_fox_run_animation(self):
+        if self.is_processing:
+            self.load_fox_run_sprites()
+            self.fox_position = 5;
+            self.current_fox_frame = 0;
+            self.fox_direction = 1
+            self.next_fox_frame = 0
+
+    def log_message(self, message, level=None):
+        # Вызывается из потоков воркеров, поэтому только кладёт строку в буфер
+        if self.log_buffer.write(message, level):
+            self.ui_state.publish(LOG)
+
+    def flush_log(self):
+        if self.log_text is None: return
+        lines, reset = self.log_buffer.drain()
+        if reset:
+            self.log_text.delete("1.0", "end")
+            text = self.log_buffer.text(self.log_buffer.level)
+            lines = text.split("\n")[-LOG_WIDGET_LINES:] if text else []
+        if lines:
+            self.log_text.insert("end", "\n".join(lines) + "\n")
+        excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - LOG_WIDGET_LINES
+        if excess > 0:
+            self.log_text.delete("1.0", f"{excess + 1}.0")
+        if self.log_visible:
+            self.log_text.see("end")
+
+    def toggle_log_verbose(self):
+        self.log_buffer.set_level(DEBUG if self.log_verbose.get() else INFO)
+        self.flush_log()
+
+    def run(self):
+        self.root.mainloop()
@@ -0,0 +1,379 @@
+import argparse
+import math
+import os
+import platform
+import re
+import sqlite3
+import sys
+import time
+from contextlib import closing
+
+from foxbaker.encode import job_encoder
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.paths import cache_dir
+from foxbaker.probe import probe_media
+from foxbaker.subtitles import load_subtitles
+
+HISTORY_FILE = "history.sqlite3"
+# Raise when the table changes, an older database is started over then
+HISTORY_VERSION = 1
+# Finished jobs kept, the oldest are removed above this
+HISTORY_ROWS = 20000
+# Similar jobs a prediction is made from, and the most recent jobs of an encoder they are picked from
+NEIGHBOURS = 5
+CANDIDATES = 500
+# Jobs are measured on this machine unless they ran on a remote worker, see foxbaker.remote
+MACHINE = platform.node() or "unknown"
+# Quality tiers with a fixed bitrate, their output size follows the duration rather than the source's size
+FIXED_BITRATE_QUALITIES = (1, 2)
+ASS_OVERRIDE_BLOCK_RE = re.compile(r'\{[^}]*\}')
+ASS_TAG_RE = re.compile(r'\\[a-zA-Z]')
+# subtitle_stats() of the files seen lately, per path, size and mtime
+STATS_MEMO_ENTRIES = 256
+
+COLUMNS = ("finished", "machine", "video", "width", "height", "duration", "fps", "frames", "video_codec",
+           "input_bytes", "subtitle_kind", "subtitle_events", "style_complexity", "encoder", "hardware", "quality",
+           "preset", "mode", "outputs", "threads", "wall_seconds", "encode_fps", "output_bytes")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    finished REAL NOT NULL,
+    machine TEXT NOT NULL,
+    video TEXT,
+    width INTEGER,
+    height INTEGER,
+    duration REAL,
+    fps REAL,
+    frames INTEGER,
+    video_codec TEXT,
+    input_bytes INTEGER,
+    subtitle_kind TEXT,
+    subtitle_events INTEGER,
+    style_complexity REAL,
+    encoder TEXT NOT NULL,
+    hardware INTEGER,
+    quality INTEGER,
+    preset TEXT,
+    mode TEXT,
+    outputs INTEGER,
+    threads INTEGER,
+    wall_seconds REAL NOT NULL,
+    encode_fps REAL,
+    output_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_encoder ON jobs (encoder, finished);
+"""
+
+
+# (path, size, mtime_ns) -> subtitle_stats(), a job is predicted when queued and started and recorded when done
+_stats = {}
+
+
+def connect():
+    path = os.environ.get("FOXBAKER_HISTORY_DB") or str(cache_dir() / HISTORY_FILE)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != HISTORY_VERSION:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS jobs")
+            conn.executescript(SCHEMA)
+            conn.execute(f"PRAGMA user_version = {HISTORY_VERSION}")
+    return conn
+
+
+def subtitle_stats(subtitle_path):
+    """
+    (kind, number of lines, override tags per line), the tags are what makes
+    libass slow. Remembered per size and mtime, a file is only parsed again
+    after it changed.
+    """
+    st = os.stat(subtitle_path)
+    memo = (os.path.abspath(subtitle_path), st.st_size, st.st_mtime_ns)
+    if memo in _stats:
+        return _stats[memo]
+    subtitles = load_subtitles(normalize_subtitles(subtitle_path))
+    if subtitles.kind != "ass" or not subtitles.events:
+        stats = subtitles.kind, len(subtitles.events), 0.0
+    else:
+        tags = sum(len(ASS_TAG_RE.findall(block)) for ev in subtitles.events
+                   for block in ASS_OVERRIDE_BLOCK_RE.findall(ev.fields[-1]))
+        stats = subtitles.kind, len(subtitles.events), tags / len(subtitles.events)
+    while len(_stats) >= STATS_MEMO_ENTRIES:
+        _stats.pop(next(iter(_stats)))
+    _stats[memo] = stats
+    return stats
+
+
+def job_mode(job):
+    if job.mux:
+        return "mux"
+    if job.renditions:
+        return "renditions"
+    if job.smart:
+        return "smart"
+    if job.deadline or job.target_speed:
+        return "deadline"
+    return "segmented" if job.segmented else "plain"
+
+
+def _preset(args):
+    return args[args.index("-preset") + 1] if "-preset" in args[:-1] else None
+
+
+def job_features(job, info=None):
+    """The columns of a job that are known before it runs."""
+    info = info or probe_media(job.video_path)
+    kind, events, complexity = subtitle_stats(job.subtitle_path)
+    encoder = job_encoder(job)
+    return {"machine": MACHINE, "video": os.path.basename(job.video_path), "width": info.width,
+            "height": info.height, "duration": info.duration, "fps": info.fps, "frames": info.frame_count,
+            "video_codec": info.video_codec, "input_bytes": os.path.getsize(job.video_path), "subtitle_kind": kind,
+            "subtitle_events": events, "style_complexity": round(complexity, 3),
+            "encoder": "copy" if job.mux else encoder.name, "hardware": int(encoder.hardware and not job.mux),
+            "quality": job.quality, "preset": None if job.mux else _preset(encoder.preset_args),
+            "mode": job_mode(job), "outputs": len(job.renditions) or 1, "threads": job.threads}
+
+
+def record(job, info=None):
+    """
+    Adds a job that finished with job.metrics to the history. Jobs restored
+    from the output cache did not encode anything and are left out.
+    """
+    metrics = job.metrics
+    encodes = [p for p in metrics.processes if p.stage in ("encode", "mux")]
+    if metrics.status != "done" or not encodes:
+        return False
+    row = job_features(job, info)
+    # What really ran, a GPU encoder may have fallen back or a deadline picked other presets
+    command = encodes[-1].command
+    if "-c:v" in command[:-1] and not job.mux:
+        row["encoder"] = command[command.index("-c:v") + 1]
+    row["preset"] = _preset(command) or row["preset"]
+    summary = metrics.summary()
+    # ffprobe does not count the frames of every container, the encode did
+    row["frames"] = row["frames"] or summary["frames"] or None
+    row.update(finished=time.time(), wall_seconds=round(metrics.wall, 3), encode_fps=summary["fps"],
+               output_bytes=summary["output_bytes"])
+    with closing(connect()) as conn, conn:
+        conn.execute(f"INSERT INTO jobs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                     [row.get(name) for name in COLUMNS])
+        conn.execute("DELETE FROM jobs WHERE id <= (SELECT MAX(id) FROM jobs) - ?", (HISTORY_ROWS,))
+    return True
+
+
+def _log_ratio(a, b):
+    return abs(math.log((a or 0) + 1) - math.log((b or 0) + 1))
+
+
+def distance(features, row):
+    """How unlike a past job is, the resolution and the subtitle load weigh most after the settings."""
+    d = _log_ratio((features["width"] or 0) * (features["height"] or 0), (row["width"] or 0) * (row["height"] or 0))
+    d += _log_ratio(features["style_complexity"], row["style_complexity"])
+    d += 0.5 * _log_ratio(features["subtitle_events"] * 60 / max(features["duration"] or 1, 1),
+                          row["subtitle_events"] * 60 / max(row["duration"] or 1, 1))
+    d += 2.0 * (features["machine"] != row["machine"])
+    d += 1.5 * (features["mode"] != row["mode"])
+    d += 1.0 * (features["quality"] != row["quality"])
+    d += 1.0 * (features["preset"] != row["preset"])
+    return d
+
+
+class Prediction:
+    def __init__(self, seconds, output_bytes, samples):
+        self.seconds = seconds
+        # None when no similar job had the same quality tier
+        self.output_bytes = output_bytes
+        self.samples = samples
+
+
+def predict(features, rows):
+    """
+    Wall time and output size of a job from the NEIGHBOURS most similar past
+    jobs with the same encoder. Time is predicted as frames per wall second,
+    the size as bytes per second of video for the fixed-bitrate tiers and as a
+    share of the source size for the others. None without similar jobs.
+    """
+    rows = [row for row in rows if row["frames"] and row["wall_seconds"] > 0]
+    frames = features["frames"] or (features["duration"] or 0) * (features["fps"] or 0)
+    if not rows or not frames:
+        return None
+    nearest = sorted(rows, key=lambda row: distance(features, row))[:NEIGHBOURS]
+    weights = [1 / (0.1 + distance(features, row)) for row in nearest]
+    # Weighted geometric mean, one job that ran twice as fast counts as much as one twice as slow
+    rate = math.exp(sum(w * math.log(row["frames"] / row["wall_seconds"]) for w, row in zip(weights, nearest))
+                    / sum(weights))
+    output_bytes = None
+    same = [(w, row) for w, row in zip(weights, nearest)
+            if row["quality"] == features["quality"] and row["mode"] == features["mode"] and row["output_bytes"]]
+    if same:
+        if features["quality"] in FIXED_BITRATE_QUALITIES and features["mode"] != "mux":
+            ratios = [(w, row["output_bytes"] / row["duration"]) for w, row in same if row["duration"]]
+            scale = features["duration"]
+        else:
+            ratios = [(w, row["output_bytes"] / row["input_bytes"]) for w, row in same if row["input_bytes"]]
+            scale = features["input_bytes"]
+        if ratios and scale:
+            output_bytes = int(scale * sum(w * r for w, r in ratios) / sum(w for w, _ in ratios))
+    return Prediction(frames / rate, output_bytes, len(nearest))
+
+
+def predict_job(job, info=None):
+    """Prediction for a job that has not started yet, None without history of its encoder."""
+    features = job_features(job, info)
+    with closing(connect()) as conn:
+        rows = conn.execute("SELECT * FROM jobs WHERE encoder = ? ORDER BY finished DESC LIMIT ?",
+                            (features["encoder"], CANDIDATES)).fetchall()
+    return predict(features, rows)
+
+
+def format_seconds(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def format_size(size):
+    return f"{size / 1024 / 1024:.0f} MB" if size is not None else "?"
+
+
+def expect_job(job, info=None, log=None):
+    """
+    Sets job.expected_seconds and job.expected_bytes from the history unless
+    they were predicted already. Never raises.
+    """
+    log = log or (lambda message: None)
+    if job.expected_seconds is not None:
+        return
+    try:
+        prediction = predict_job(job, info)
+    except Exception as e:
+        # Only an estimate, a script the history can not read must not stop the job
+        log(f"History: no prediction: {e}")
+        return
+    if prediction is None:
+        return
+    job.expected_seconds = prediction.seconds
+    job.expected_bytes = prediction.output_bytes
+    log(f"History: about {format_seconds(prediction.seconds)} and {format_size(prediction.output_bytes)}, "
+        f"predicted from {prediction.samples} similar jobs")
+
+
+def seed_eta(job, info=None, log=None):
+    """expect_job() and starts job.eta from it, so the ETA is there before the first progress report."""
+    expect_job(job, info, log)
+    job.eta = job.expected_seconds
+
+
+def record_job(job, log=None):
+    """record() for run_job(), failures only end up in the log, the job is done either way. Never raises."""
+    log = log or (lambda message: None)
+    try:
+        record(job)
+    except Exception as e:
+        log(f"History: the job could not be recorded: {e}")
+
+
+def trends(conn, machine=None, encoder=None, days=90, period="week"):
+    """Mean throughput per machine, encoder and week or month, most recent first."""
+    bucket = "%Y-%W" if period == "week" else "%Y-%m"
+    where, params = ["finished >= ?"], [time.time() - days * 86400]
+    if machine:
+        where.append("machine = ?")
+        params.append(machine)
+    if encoder:
+        where.append("encoder = ?")
+        params.append(encoder)
+    return conn.execute(f"""
+        SELECT strftime('{bucket}', finished, 'unixepoch', 'localtime') AS period, machine, encoder,
+               COUNT(*) AS jobs, SUM(frames) / SUM(wall_seconds) AS fps, SUM(duration) / SUM(wall_seconds) AS speed,
+               SUM(width * height * frames) / SUM(wall_seconds) / 1e6 AS mpixels
+        FROM jobs WHERE {' AND '.join(where)}
+        GROUP BY period, machine, encoder ORDER BY period DESC, machine, encoder""", params).fetchall()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="foxbaker.history",
+                                     description="Query the history of finished jobs and predict new ones.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    predict_parser = commands.add_parser("predict", help="predict the time and output size of jobs before they run")
+    predict_parser.add_argument("pairs", nargs="+", metavar="VIDEO SUBTITLE", help="video and subtitle files in pairs")
+    predict_parser.add_argument("-q", "--quality", default="original", help="quality tier, as in `python -m foxbaker`")
+    predict_parser.add_argument("-e", "--encoder", default="software", help="encoder, as in `python -m foxbaker`")
+    predict_parser.add_argument("--format", default="mp4", help="output container")
+    predict_parser.add_argument("--soft", action="store_true", help="mux the subtitles instead of burning them in")
+    predict_parser.add_argument("--jobs", type=int, default=1, help="jobs run side by side")
+    trends_parser = commands.add_parser("trends", help="throughput per machine and encoder over time")
+    trends_parser.add_argument("--machine")
+    trends_parser.add_argument("--encoder", help="ffmpeg encoder name, e.g. libx264 or h264_nvenc")
+    trends_parser.add_argument("--days", type=int, default=90)
+    trends_parser.add_argument("--month", action="store_true", help="group by month instead of week")
+    list_parser = commands.add_parser("list", help="the last finished jobs")
+    list_parser.add_argument("-n", type=int, default=20)
+    commands.add_parser("clear", help="remove the history")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "clear":
+        with closing(connect()) as conn, conn:
+            conn.execute("DELETE FROM jobs")
+        return 0
+    if args.command == "list":
+        with closing(connect()) as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY finished DESC LIMIT ?", (args.n,)).fetchall()
+        for row in rows:
+            # Columns ffprobe could not fill are NULL
+            duration = f"{row['duration']:.0f}s" if row["duration"] is not None else "?s"
+            fps = f"{row['frames'] / row['wall_seconds']:.1f}" if row["frames"] and row["wall_seconds"] else "?"
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(row['finished']))}  {row['machine']}  "
+                  f"{row['encoder']} {row['preset'] or ''} q{row['quality']} {row['mode']}  "
+                  f"{row['width'] or '?'}x{row['height'] or '?'} {duration} {row['subtitle_events']} lines  "
+                  f"{format_seconds(row['wall_seconds'])} {fps} fps  "
+                  f"{format_size(row['output_bytes'])}  {row['video']}")
+        return 0
+    if args.command == "trends":
+        with closing(connect()) as conn:
+            rows = trends(conn, args.machine, args.encoder, args.days, "month" if args.month else "week")
+        print(f"{'period':<8} {'machine':<20} {'encoder':<14} {'jobs':>5} {'fps':>8} {'speed':>7} {'Mpx/s':>8}")
+        for row in rows:
+            print(f"{row['period']:<8} {row['machine']:<20} {row['encoder']:<14} {row['jobs']:>5} "
+                  f"{row['fps'] or 0:>8.1f} {row['speed'] or 0:>6.2f}x {row['mpixels'] or 0:>8.1f}")
+        return 0
+
+    from foxbaker.cli import ENCODERS
+    from foxbaker.encode import QUALITY_NAMES
+    from foxbaker.jobs import Job
+    if len(args.pairs) % 2 or args.quality not in QUALITY_NAMES or args.encoder not in ENCODERS:
+        print("foxbaker.history: expected video and subtitle files in pairs, a quality of "
+              f"{', '.join(QUALITY_NAMES)} and an encoder of {', '.join(ENCODERS)}", file=sys.stderr)
+        return 2
+    hw_enabled, hw_type = ENCODERS[args.encoder]
+    total_seconds = total_bytes = 0
+    unknown = 0
+    for video, subtitle in zip(args.pairs[::2], args.pairs[1::2]):
+        job = Job(video, subtitle, f"out.{args.format}", quality=QUALITY_NAMES.index(args.quality),
+                  hw_enabled=hw_enabled, hw_type=hw_type, mux=args.soft)
+        try:
+            prediction = predict_job(job)
+        except (sqlite3.Error, OSError, RuntimeError, UnicodeError, ValueError) as e:
+            print(f"foxbaker.history: {video}: {e}", file=sys.stderr)
+            return 1
+        if prediction is None:
+            unknown += 1
+            print(f"{video}\tno similar jobs in the history")
+            continue
+        total_seconds += prediction.seconds
+        total_bytes += prediction.output_bytes or 0
+        print(f"{video}\t{format_seconds(prediction.seconds)}\t{format_size(prediction.output_bytes)}\t"
+              f"from {prediction.samples} jobs")
+    if len(args.pairs) > 2:
+        finish = time.strftime("%H:%M", time.localtime(time.time() + total_seconds / max(1, args.jobs)))
+        print(f"total\t{format_seconds(total_seconds / max(1, args.jobs))}\t{format_size(total_bytes)}\t"
+              f"done at about {finish}" + (f", {unknown} jobs not predicted" if unknown else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
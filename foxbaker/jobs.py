@@ -0,0 +1,366 @@
+import itertools
+import os
+import threading
+import time
+from pathlib import Path
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# libx264 stops scaling well somewhere around this many threads per process,
+# so on big machines it is faster to run several encodes side by side.
+SOFTWARE_THREADS_PER_JOB = 8
+# Consumer GPUs limit the number of concurrent encoder sessions.
+HARDWARE_MAX_JOBS = 2
+# Speed reports needed at a concurrency level before it is compared to others.
+TUNE_MIN_SAMPLES = 10
+
+_job_ids = itertools.count(1)
+
+
+def terminate(process):
+    try:
+        process.terminate()
+    except OSError:
+        pass
+
+
+def default_output_name(video_path):
+    return Path(video_path).stem + "s"
+
+
+class Rendition:
+    """One output file of a multi-output job."""
+
+    def __init__(self, output_path, quality=0):
+        self.output_path = output_path
+        self.output_format = os.path.splitext(output_path)[1].lstrip(".")
+        self.quality = quality
+        self.frames_done = 0
+        self.progress = 0.0
+
+    @property
+    def name(self):
+        return os.path.basename(self.output_path)
+
+
+class SubtitleTrack:
+    """One more subtitle file of a soft-subtitle job, muxed as its own track."""
+
+    def __init__(self, path, language=None, title=None):
+        self.path = path
+        # ISO 639-2 code, guessed from the file name when not given, see mux.track_language()
+        self.language = language
+        self.title = title
+
+
+class Job:
+    """One video/subtitle pair with the settings captured when it was queued."""
+
+    def __init__(self, video_path, subtitle_path, output_path, quality=0, hw_enabled=False, hw_type="AMD",
+                 segmented=False, renditions=None, smart=False, deadline=None, target_speed=None, preflight=True,
+                 cache=False, mux=False, subtitle_tracks=None, language=None):
+        self.id = next(_job_ids)
+        self.video_path = video_path
+        self.subtitle_path = subtitle_path
+        self.output_path = output_path
+        self.output_format = os.path.splitext(output_path)[1].lstrip(".")
+        self.quality = quality
+        self.hw_enabled = hw_enabled
+        self.hw_type = hw_type
+        self.segmented = segmented
+        # Re-encode only the GOPs with subtitles and copy the rest, see smartrender.run_smart()
+        self.smart = smart
+        # Unix time the job has to be done by, or the speed it has to keep up, see deadline.run_deadline()
+        self.deadline = deadline
+        self.target_speed = target_speed
+        # Check the settings with a short trial encode first, see preflight.preflight()
+        self.preflight = preflight
+        # Reuse the output of an identical earlier job and keep this one for later, see outputcache.job_key()
+        self.cache = cache
+        # Mux the subtitles as tracks and stream-copy the rest instead of burning them in, see mux.run_mux().
+        # subtitle_path is the first and default track, subtitle_tracks the ones after it
+        self.mux = mux
+        self.subtitle_tracks = list(subtitle_tracks or [])
+        self.language = language
+        # Several outputs rendered from one decode, output_path and quality are those of the first
+        self.renditions = list(renditions or [])
+        if self.renditions:
+            self.output_path = self.renditions[0].output_path
+            self.output_format = self.renditions[0].output_format
+            self.quality = self.renditions[0].quality
+
+        self.status = QUEUED
+        self.progress = 0.0
+        self.speed = 0.0
+        self.fps = None
+        # Seconds, None until the encode rate is known
+        self.eta = None
+        self.threads = 0
+        self.total_duration = 0
+        self.total_frames = 0
+        self.start_time = 0
+        self.end_time = 0
+        self.returncode = None
+        self.error = None
+        # Bitrate of the "auto" quality tier, set by autobitrate.prepare_bitrate()
+        self.auto_bitrate = None
+        # Wall time and output size predicted from earlier jobs, see history.expect_job()
+        self.expected_seconds = None
+        self.expected_bytes = None
+        # Folder with the fonts of the subtitles for libass, set by fonts.prepare_fonts()
+        self.fontsdir = None
+        # foxbaker.metrics.JobMetrics of the last run
+        self.metrics = None
+        self.processes = []
+        self.cancelled = False
+
+    @property
+    def name(self):
+        return os.path.basename(self.output_path)
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def attach(self, process):
+        """Registers a running ffmpeg process so that cancel() can stop it."""
+        self.processes.append(process)
+        if self.cancelled:
+            terminate(process)
+        return process
+
+    def detach(self, process):
+        if process.poll() is None:
+            terminate(process)
+            process.wait()
+        if process in self.processes:
+            self.processes.remove(process)
+
+    def cancel(self):
+        self.cancelled = True
+        for process in list(self.processes):
+            terminate(process)
+
+
+class JobQueue:
+    def __init__(self):
+        self._jobs = []
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs)
+
+    def get(self, job_id):
+        with self._lock:
+            for job in self._jobs:
+                if job.id == job_id:
+                    return job
+        return None
+
+    def add(self, job):
+        with self._lock:
+            self._jobs.append(job)
+        return job
+
+    def remove(self, job_id):
+        with self._lock:
+            job = self.get(job_id)
+            if job is None or job.status == RUNNING:
+                return False
+            self._jobs.remove(job)
+            return True
+
+    def move(self, job_id, offset):
+        with self._lock:
+            job = self.get(job_id)
+            if job is None:
+                return False
+            index = self._jobs.index(job)
+            new_index = max(0, min(len(self._jobs) - 1, index + offset))
+            if new_index == index:
+                return False
+            self._jobs.insert(new_index, self._jobs.pop(index))
+            return True
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self.get(job_id)
+            if job is None or job.finished:
+                return False
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.end_time = time.time()
+            job.cancel()
+            return True
+
+    def cancel_all(self):
+        with self._lock:
+            for job in self._jobs:
+                if not job.finished:
+                    self.cancel(job.id)
+
+    def clear_finished(self):
+        with self._lock:
+            self._jobs = [job for job in self._jobs if not job.finished]
+
+    def next_queued(self):
+        with self._lock:
+            for job in self._jobs:
+                if job.status == QUEUED:
+                    return job
+        return None
+
+    def pending(self):
+        with self._lock:
+            return [job for job in self._jobs if not job.finished]
+
+    def overall_progress(self):
+        with self._lock:
+            jobs = [job for job in self._jobs if job.status != CANCELLED]
+        if not jobs:
+            return 0.0
+        # Jobs that have not been probed yet are weighted like an average known job
+        known = [job.total_duration for job in jobs if job.total_duration > 0]
+        default_weight = sum(known) / len(known) if known else 1.0
+        total = done = 0.0
+        for job in jobs:
+            weight = job.total_duration if job.total_duration > 0 else default_weight
+            total += weight
+            done += weight * (1.0 if job.status in (DONE, FAILED) else job.progress)
+        return min(done / total, 1.0) if total > 0 else 0.0
+
+
+class Scheduler:
+    """
+    Runs queued jobs with as many concurrent encodes as the machine can feed.
+
+    The number of slots starts from the CPU count and is then tuned from the
+    combined `speed=` reported by the running jobs: another slot is only kept
+    if it actually increased the total throughput.
+    """
+
+    def __init__(self, queue, runner, cpu_count=None, max_jobs=None, on_change=None, on_idle=None):
+        self.queue = queue
+        self.runner = runner
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.on_change = on_change
+        self.on_idle = on_idle
+        self.slots = 0
+        self.max_slots = self.cpu_count
+        self._running = set()
+        self._throughput = {}
+        self._samples = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @property
+    def active(self):
+        return self._thread is not None
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                self._cond.notify_all()
+                return
+            self.slots = 0
+            self._throughput = {}
+            self._samples = {}
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def initial_slots(self, job):
+        if self.max_jobs:
+            return max(1, self.max_jobs)
+        if job.hw_enabled:
+            self.max_slots = min(HARDWARE_MAX_JOBS, self.cpu_count)
+            return self.max_slots
+        self.max_slots = self.cpu_count
+        return max(1, self.cpu_count // SOFTWARE_THREADS_PER_JOB)
+
+    def threads_per_job(self):
+        return max(1, self.cpu_count // max(1, self.slots))
+
+    def report_speed(self, job, speed):
+        job.speed = speed
+        with self._cond:
+            running = list(self._running)
+        if running and all(j.speed > 0 for j in running):
+            total = sum(j.speed for j in running)
+            level = len(running)
+            previous = self._throughput.get(level)
+            self._throughput[level] = total if previous is None else previous * 0.8 + total * 0.2
+            self._samples[level] = self._samples.get(level, 0) + 1
+
+    def _tune(self):
+        if self.max_jobs or self._samples.get(self.slots, 0) < TUNE_MIN_SAMPLES:
+            return
+        current = self._throughput[self.slots]
+        lower = self._throughput.get(self.slots - 1)
+        higher = self._throughput.get(self.slots + 1)
+        if lower is not None and current < lower * 0.95:
+            self.slots -= 1
+        elif higher is None and self.slots < self.max_slots and len(self._running) >= self.slots:
+            self.slots += 1
+        elif higher is not None and higher > current * 1.05:
+            self.slots += 1
+
+    def _loop(self):
+        with self._cond:
+            while True:
+                job = self.queue.next_queued()
+                if job is not None and self.slots == 0:
+                    self.slots = self.initial_slots(job)
+                self._tune()
+                while job is not None and len(self._running) < self.slots:
+                    job.threads = self.threads_per_job()
+                    job.status = RUNNING
+                    self._running.add(job)
+                    threading.Thread(target=self._run_job, args=(job,), daemon=True).start()
+                    job = self.queue.next_queued()
+                if job is None and not self._running:
+                    self._thread = None
+                    break
+                self._cond.wait(1.0)
+        if self.on_idle:
+            self.on_idle()
+
+    def _run_job(self, job):
+        job.start_time = time.time()
+        self._notify(job)
+        try:
+            job.returncode = None if job.cancelled else self.runner(job)
+        except Exception as e:
+            job.error = str(e)
+            job.returncode = None
+        job.end_time = time.time()
+        if job.cancelled:
+            job.status = CANCELLED
+        elif job.returncode == 0:
+            job.status = DONE
+            job.progress = 1.0
+        else:
+            job.status = FAILED
+        with self._cond:
+            self._running.discard(job)
+            self._cond.notify_all()
+        self._notify(job)
+
+    def _notify(self, job):
+        if self.on_change:
+            self.on_change(job)
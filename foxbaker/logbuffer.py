@@ -0,0 +1,116 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+LOG_CAPACITY = 10000
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+# When set, the GUI writes a log file for every job into this directory
+LOG_DIR = os.environ.get("FOXBAKER_LOG_DIR")
+
+# Job id and chunk prefixes added by the GUI, by segmented encoding and by the preflight trial
+PREFIX_RE = re.compile(r'^(?:\[\d+\] )?(?:(?:Chunk|Sample) \d+: |Preflight: )?')
+# "frame=123", "out_time_ms=4000000", "progress=continue": the -progress block,
+# "frame=  240 fps= 60 q=28.0 size= ...": the periodic stats line on stderr
+PROGRESS_LINE_RE = re.compile(r'^(?:[a-z0-9_]+=\s*\S*$|(?:frame|size)=\s*\S)')
+ERROR_RE = re.compile(r'\b(error|failed|invalid|not found)\b', re.IGNORECASE)
+WARNING_RE = re.compile(r'\bwarning\b', re.IGNORECASE)
+
+
+def classify(line):
+    """Guesses the level of an ffmpeg output line."""
+    if PROGRESS_LINE_RE.match(PREFIX_RE.sub("", line, count=1)):
+        return DEBUG
+    if ERROR_RE.search(line):
+        return ERROR
+    if WARNING_RE.search(line):
+        return WARNING
+    return INFO
+
+
+class LogBuffer:
+    """
+    Keeps the last `capacity` log lines of every level and collects the ones
+    not shown yet, so a UI can redraw them in one batch at its own pace.
+
+    write() can be called from any thread and is cheap: it only appends to two
+    deques. When more lines arrive between two drain() calls than fit into the
+    buffer, drain() asks the caller to redraw everything from text().
+    """
+
+    def __init__(self, capacity=LOG_CAPACITY, level=INFO):
+        self.level = level
+        self._lines = deque(maxlen=capacity)
+        self._pending = deque(maxlen=capacity)
+        self._overflow = False
+        self._lock = threading.Lock()
+
+    def write(self, message, level=None):
+        """Adds a line, returns True if it is the first one since the last drain()."""
+        if level is None:
+            level = classify(message)
+        entry = (level, message)
+        with self._lock:
+            self._lines.append(entry)
+            if level < self.level:
+                return False
+            first = not self._pending and not self._overflow
+            if len(self._pending) == self._pending.maxlen:
+                self._overflow = True
+            self._pending.append(entry)
+            return first
+
+    def drain(self):
+        """Returns (lines, reset): new visible lines, reset means the view must be rebuilt from text()."""
+        with self._lock:
+            lines = [message for _, message in self._pending]
+            reset = self._overflow
+            self._pending.clear()
+            self._overflow = False
+        return lines, reset
+
+    def set_level(self, level):
+        with self._lock:
+            self.level = level
+            self._pending.clear()
+            self._overflow = True
+
+    def text(self, level=DEBUG):
+        with self._lock:
+            return "\n".join(message for lvl, message in self._lines if lvl >= level)
+
+
+class JobLogFile:
+    """Size-limited log file of a single job, keeps all levels including the -progress lines."""
+
+    def __init__(self, path, max_bytes=LOG_FILE_MAX_BYTES, backups=LOG_FILE_BACKUPS):
+        self.path = path
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8",
+                                            delay=True)
+        self._handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(message)s"))
+
+    def write(self, message, level=None):
+        if level is None:
+            level = classify(message)
+        self._handler.handle(logging.makeLogRecord({"msg": message, "levelno": level,
+                                                    "levelname": logging.getLevelName(level)}))
+
+    def close(self):
+        self._handler.close()
+
+
+def job_log_path(job, directory):
+    """`<output name>_<date>-<time>_<job id>.log` inside `directory`, which is created if needed."""
+    os.makedirs(directory, exist_ok=True)
+    name = f"{Path(job.output_path).stem}_{time.strftime('%Y%m%d-%H%M%S')}_{job.id}.log"
+    return os.path.join(directory, name)
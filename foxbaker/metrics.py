@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from foxbaker.paths import cache_dir
+
+# Where the job reports and the Prometheus text file go, the "metrics" cache directory by default
+METRICS_DIR = os.environ.get("FOXBAKER_METRICS_DIR")
+# Older reports are removed beyond this many
+METRICS_REPORTS = 200
+PROMETHEUS_FILE = "foxbaker.prom"
+# Counters survive restarts, Prometheus would see every restart as a reset otherwise
+TOTALS_FILE = "totals.json"
+DEFAULT_PORT = 9465
+# fps/speed samples of a process are taken at most this often and thinned out beyond MAX_SAMPLES
+SAMPLE_SECONDS = 1.0
+MAX_SAMPLES = 600
+# ru_maxrss is in kilobytes on Linux, in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+_totals_lock = threading.Lock()
+
+
+def metrics_dir():
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        return Path(METRICS_DIR)
+    return cache_dir("metrics")
+
+
+def wait_with_usage(process):
+    """
+    Waits for a Popen and returns (exit code, resource usage of that process).
+    The usage is None where os.wait4 does not exist, i.e. on Windows.
+    """
+    if not hasattr(os, "wait4"):
+        return process.wait(), None
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Already reaped by a poll() from another thread
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage
+
+
+def read_process_io(pid):
+    """(bytes read, bytes written) by a running process, None outside Linux."""
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            values = dict(line.split(":", 1) for line in f)
+        return int(values["rchar"]), int(values["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _option(cmd, *names):
+    for i, arg in enumerate(cmd[:-1]):
+        if arg in names:
+            return cmd[i + 1]
+    return None
+
+
+class ProcessMetrics:
+    """Wall and CPU time, peak memory, I/O and the fps over time of one ffmpeg process."""
+
+    def __init__(self, stage, cmd, job_started):
+        self.stage = stage
+        self.command = cmd
+        self.offset = time.monotonic() - job_started
+        self.started = time.monotonic()
+        self.wall = None
+        self.cpu = None
+        self.peak_rss = None
+        self.io = None
+        self.frames = None
+        self.returncode = None
+        # [seconds since the job started, frame, fps, speed]
+        self.samples = []
+        self._sampled = 0.0
+
+    def progress(self, event, pid):
+        if event.frame is not None:
+            self.frames = event.frame
+        now = time.monotonic()
+        if now - self._sampled < SAMPLE_SECONDS and not event.finished:
+            return
+        self._sampled = now
+        # /proc is gone once the process exited, the last block before that is `progress=end`
+        self.io = read_process_io(pid) or self.io
+        self.samples.append([round(self.offset + now - self.started, 2), event.frame, event.fps, event.speed])
+        if len(self.samples) > MAX_SAMPLES:
+            self.samples = self.samples[::2]
+
+    def finish(self, returncode, usage):
+        self.wall = time.monotonic() - self.started
+        self.returncode = returncode
+        if usage is not None:
+            self.cpu = usage.ru_utime + usage.ru_stime
+            self.peak_rss = usage.ru_maxrss * RSS_UNIT
+
+    def as_dict(self):
+        wall = self.wall if self.wall is not None else time.monotonic() - self.started
+        return {"stage": self.stage, "command": self.command, "video_codec": _option(self.command, "-c:v"),
+                "filter": _option(self.command, "-vf", "-filter_complex"),
+                "threads": _option(self.command, "-threads"), "wall_seconds": round(wall, 3),
+                "cpu_seconds": None if self.cpu is None else round(self.cpu, 3), "peak_rss_bytes": self.peak_rss,
+                "bytes_read": self.io[0] if self.io else None, "bytes_written": self.io[1] if self.io else None,
+                "frames": self.frames, "returncode": self.returncode, "samples": self.samples}
+
+
+class JobMetrics:
+    """
+    Where the time of a job went. Stages are exclusive: while "probe" runs
+    inside "encode", its time only counts for "probe". ffmpeg processes count
+    for the stage that was active when they started.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.wall = None
+        self.stages = {}
+        self.processes = []
+        self.status = None
+        self.error = None
+        self.report_path = None
+        self._stack = []
+        self._lock = threading.Lock()
+
+    def _account(self, now, cpu_now):
+        name, since, cpu_since = self._stack[-1]
+        wall, cpu = self.stages.get(name, (0.0, 0.0))
+        self.stages[name] = (wall + now - since, cpu + cpu_now - cpu_since)
+        self._stack[-1] = (name, now, cpu_now)
+
+    @contextmanager
+    def stage(self, name):
+        with self._lock:
+            if self._stack:
+                self._account(time.monotonic(), time.thread_time())
+            self._stack.append((name, time.monotonic(), time.thread_time()))
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._account(time.monotonic(), time.thread_time())
+                self._stack.pop()
+                if self._stack:
+                    self._stack[-1] = (self._stack[-1][0], time.monotonic(), time.thread_time())
+
+    def start_process(self, cmd):
+        with self._lock:
+            process = ProcessMetrics(self._stack[-1][0] if self._stack else "encode", list(cmd), self.started)
+            self.processes.append(process)
+        return process
+
+    def finish(self, returncode, error=None):
+        self.wall = time.monotonic() - self.started
+        self.error = error
+        if self.job.cancelled:
+            self.status = "cancelled"
+        elif returncode == 0 and error is None:
+            self.status = "done"
+        else:
+            self.status = "failed"
+
+    def stage_times(self):
+        """{stage: (wall seconds, CPU seconds)}, the CPU time of a stage includes its ffmpeg processes."""
+        times = {name: [wall, cpu] for name, (wall, cpu) in self.stages.items()}
+        for process in self.processes:
+            entry = times.setdefault(process.stage, [0.0, 0.0])
+            entry[1] += process.cpu or 0.0
+        return times
+
+    def summary(self):
+        job = self.job
+        encode = [p for p in self.processes if p.stage == "encode"]
+        encode_wall = self.stage_times().get("encode", [0.0])[0]
+        frames = job.total_frames if self.status == "done" and job.total_frames else \
+            sum(p.frames or 0 for p in encode)
+        cpu = [p.cpu for p in self.processes if p.cpu is not None]
+        rss = [p.peak_rss for p in self.processes if p.peak_rss is not None]
+        io = [p.io for p in self.processes if p.io]
+        outputs = [r.output_path for r in job.renditions] or [job.output_path]
+        return {"wall_seconds": round(self.wall or time.monotonic() - self.started, 3),
+                "frames": frames,
+                "fps": round(frames / encode_wall, 2) if frames and encode_wall > 0 else None,
+                "speed": round(job.total_duration / encode_wall, 3)
+                if self.status == "done" and job.total_duration and encode_wall > 0 else None,
+                "cpu_seconds": round(sum(cpu), 3) if cpu else None,
+                "peak_rss_bytes": max(rss) if rss else None,
+                "bytes_read": sum(r for r, _ in io) if io else None,
+                "bytes_written": sum(w for _, w in io) if io else None,
+                "output_bytes": sum(os.path.getsize(p) for p in outputs if os.path.exists(p))}
+
+    def report(self):
+        job = self.job
+        return {"job": {"id": job.id, "video": job.video_path, "subtitle": job.subtitle_path,
+                        "outputs": [r.output_path for r in job.renditions] or [job.output_path],
+                        "quality": job.quality, "hw_enabled": job.hw_enabled, "hw_type": job.hw_type,
+                        "segmented": job.segmented, "smart": job.smart, "threads": job.threads},
+                "status": self.status, "error": self.error,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+                "summary": self.summary(),
+                "stages": [{"name": name, "wall_seconds": round(wall, 3), "cpu_seconds": round(cpu, 3)}
+                           for name, (wall, cpu) in self.stage_times().items()],
+                "processes": [p.as_dict() for p in self.processes]}
+
+    def save(self):
+        """Writes the JSON report and updates the Prometheus file, returns the report path."""
+        directory = metrics_dir()
+        name = f"{Path(self.job.output_path).stem}_{time.strftime('%Y%m%d-%H%M%S')}_{self.job.id}.json"
+        report = self.report()
+        self.report_path = str(directory / name)
+        with open(self.report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        reports = sorted(directory.glob("*_*.json"), key=os.path.getmtime)
+        for old in reports[:-METRICS_REPORTS]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        update_totals(directory, report)
+        return self.report_path
+
+
+@contextmanager
+def stage(job, name):
+    """JobMetrics.stage() for jobs that are measured, does nothing for the others."""
+    metrics = getattr(job, "metrics", None)
+    if metrics is None:
+        yield
+        return
+    with metrics.stage(name):
+        yield
+
+
+def _write_atomic(path, text):
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def update_totals(directory, report):
+    """Adds a finished job to the counters and rewrites the Prometheus text file."""
+    with _totals_lock:
+        try:
+            with open(directory / TOTALS_FILE, "r", encoding="utf-8") as f:
+                totals = json.load(f)
+        except (OSError, ValueError):
+            totals = {}
+        jobs = totals.setdefault("jobs", {})
+        jobs[report["status"]] = jobs.get(report["status"], 0) + 1
+        for entry in report["stages"]:
+            wall, cpu = totals.setdefault("stages", {}).get(entry["name"], [0.0, 0.0])
+            totals["stages"][entry["name"]] = [wall + entry["wall_seconds"], cpu + entry["cpu_seconds"]]
+        summary = report["summary"]
+        for key in ("frames", "bytes_read", "bytes_written", "output_bytes"):
+            totals[key] = totals.get(key, 0) + (summary[key] or 0)
+        totals["last"] = summary
+        totals["last_finished"] = time.time()
+        _write_atomic(directory / TOTALS_FILE, json.dumps(totals))
+        _write_atomic(directory / PROMETHEUS_FILE, prometheus_text(totals))
+
+
+def prometheus_text(totals):
+    lines = []
+
+    def metric(name, kind, help_text, values):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in values:
+            if value is not None:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    metric("foxbaker_jobs_total", "counter", "Finished jobs by status.",
+           [({"status": status}, count) for status, count in sorted(totals.get("jobs", {}).items())])
+    stages = sorted(totals.get("stages", {}).items())
+    metric("foxbaker_stage_seconds_total", "counter", "Wall time spent in each job stage.",
+           [({"stage": name}, round(wall, 3)) for name, (wall, _) in stages])
+    metric("foxbaker_stage_cpu_seconds_total", "counter", "CPU time of each job stage including ffmpeg.",
+           [({"stage": name}, round(cpu, 3)) for name, (_, cpu) in stages])
+    metric("foxbaker_frames_total", "counter", "Frames encoded.", [({}, totals.get("frames", 0))])
+    metric("foxbaker_read_bytes_total", "counter", "Bytes read by ffmpeg.", [({}, totals.get("bytes_read", 0))])
+    metric("foxbaker_written_bytes_total", "counter", "Bytes written by ffmpeg.",
+           [({}, totals.get("bytes_written", 0))])
+    metric("foxbaker_output_bytes_total", "counter", "Size of the finished outputs.",
+           [({}, totals.get("output_bytes", 0))])
+    last = totals.get("last", {})
+    metric("foxbaker_last_job_seconds", "gauge", "Wall time of the last job.", [({}, last.get("wall_seconds"))])
+    metric("foxbaker_last_job_fps", "gauge", "Frames per second of the last job.", [({}, last.get("fps"))])
+    metric("foxbaker_last_job_speed", "gauge", "Speed of the last job relative to real time.",
+           [({}, last.get("speed"))])
+    metric("foxbaker_last_job_peak_rss_bytes", "gauge", "Peak memory of the largest ffmpeg process of the last job.",
+           [({}, last.get("peak_rss_bytes"))])
+    metric("foxbaker_last_job_timestamp_seconds", "gauge", "Unix time the last job finished.",
+           [({}, totals.get("last_finished"))])
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            body = (metrics_dir() / PROMETHEUS_FILE).read_bytes()
+        except OSError:
+            body = b""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="foxbaker.metrics", description="Serve the FOXBaker job metrics.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="serve the Prometheus text file at /metrics")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    commands.add_parser("path", help="print the directory of the reports")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "path":
+        print(metrics_dir())
+        return 0
+    server = ThreadingHTTPServer((args.host, args.port), MetricsHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
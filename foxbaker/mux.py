@@ -0,0 +1,170 @@
+import os
+from pathlib import Path
+
+from foxbaker.encode import audio_codec_args, format_command, probe_job, run_process
+from foxbaker.encoders import FFMPEG
+from foxbaker.fonts import attached_font, check_fonts
+from foxbaker.jobs import SubtitleTrack
+from foxbaker.metrics import stage
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.progress import EtaEstimator, notify_on_change
+from foxbaker.subtitles import load_subtitles
+
+# What each container stores a subtitle format as, "copy" keeps it unchanged. Formats not listed, like AVI,
+# can not carry text subtitles at all
+SUBTITLE_MUX_CODECS = {
+    "mkv": {"ass": "copy", "srt": "copy"},
+    "mp4": {"ass": "mov_text", "srt": "mov_text"},
+    "mov": {"ass": "mov_text", "srt": "mov_text"},
+    "webm": {"ass": "webvtt", "srt": "webvtt"},
+}
+# Video codecs each container can take as a stream copy, formats not listed take anything
+VIDEO_COPY_CODECS = {
+    "mp4": {"h264", "hevc", "av1", "vp9", "mpeg4", "mpeg2video", "mpeg1video", "mjpeg"},
+    "mov": {"h264", "hevc", "mpeg4", "mpeg2video", "mpeg1video", "mjpeg", "prores", "dnxhd"},
+    "webm": {"vp8", "vp9", "av1"},
+}
+# Only Matroska takes attachments, the fonts of the ASS tracks go along there
+FONT_ATTACH_FORMATS = ("mkv",)
+FONT_MIMETYPES = {".otf": "application/vnd.ms-opentype", ".otc": "application/vnd.ms-opentype"}
+FONT_MIMETYPE_DEFAULT = "application/x-truetype-font"
+# Language codes found in subtitle file names, "ep01.ru.ass", and the ISO 639-2 codes containers store
+LANGUAGES = {"ru": "rus", "en": "eng", "ja": "jpn", "uk": "ukr", "be": "bel", "kk": "kaz", "de": "ger", "fr": "fre",
+             "es": "spa", "it": "ita", "pt": "por", "pl": "pol", "cs": "cze", "tr": "tur", "zh": "chi", "ko": "kor",
+             "ar": "ara"}
+
+
+def track_language(path):
+    """ISO 639-2 code from a file name like "ep01.ru.ass" or "ep01.rus.ass", None when it has none."""
+    suffixes = Path(path).suffixes
+    code = suffixes[-2].lstrip(".").lower() if len(suffixes) > 1 else ""
+    if code in LANGUAGES:
+        return LANGUAGES[code]
+    return code if code in LANGUAGES.values() else None
+
+
+def job_tracks(job):
+    """The job's subtitle files as tracks, subtitle_path first."""
+    return [SubtitleTrack(job.subtitle_path, job.language)] + job.subtitle_tracks
+
+
+class MuxReport:
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+        # [(normalized path, subtitle kind, language, title)] in track order
+        self.tracks = []
+        # Font files to attach, those already attached to the source are copied with it
+        self.fonts = []
+
+
+def check_mux(job, info, log=None):
+    """
+    Checks that the output container can carry the job's video, audio and
+    subtitle tracks without re-encoding the video, and finds the fonts of the
+    ASS tracks for Matroska outputs. Errors mean the mux can not be done.
+    """
+    log = log or (lambda message: None)
+    report = MuxReport()
+    output_format = job.output_format.lower()
+    codecs = SUBTITLE_MUX_CODECS.get(output_format)
+    if codecs is None:
+        report.errors.append(f"{output_format or 'The output'} can not carry soft subtitles, "
+                             f"use {', '.join(SUBTITLE_MUX_CODECS)}")
+        return report
+    allowed = VIDEO_COPY_CODECS.get(output_format)
+    if info and allowed is not None and info.video_codec not in allowed:
+        report.errors.append(f"{info.video_codec} video can not be copied into {output_format}, "
+                             "burn the subtitles in or pick another format")
+    fonts = {}
+    for track in job_tracks(job):
+        name = os.path.basename(track.path)
+        try:
+            with stage(job, "normalize"):
+                path = normalize_subtitles(track.path)
+            subtitles = load_subtitles(path)
+        except (OSError, UnicodeError) as e:
+            report.errors.append(f"{name} can not be read: {e}")
+            continue
+        if not subtitles.events:
+            report.warnings.append(f"{name} contains no subtitle lines")
+        codec = codecs[subtitles.kind]
+        if subtitles.kind == "ass" and codec != "copy":
+            report.warnings.append(f"{name}: {output_format} stores subtitles as {codec}, "
+                                   "the ASS styles, positions and fonts are lost")
+        report.tracks.append((path, subtitles.kind, track.language or track_language(track.path), track.title))
+        if subtitles.kind == "ass" and output_format in FONT_ATTACH_FORMATS:
+            try:
+                with stage(job, "fonts"):
+                    found = check_fonts(job.video_path, path, info, origin_path=track.path)
+            except (OSError, RuntimeError) as e:
+                log(f"Fonts of {name} could not be looked up, they are not attached: {e}")
+                continue
+            if found.missing:
+                report.warnings.append(f"{name}: fonts not found, players fall back to others: "
+                                       f"{', '.join(found.missing)}")
+            for files in found.resolved.values():
+                fonts.update((font, None) for font in files if not attached_font(font))
+    report.fonts = list(fonts)
+    return report
+
+
+def build_mux_command(job, info, report):
+    """Stream-copies the video, copies or converts the audio and adds every track of `report`."""
+    output_format = job.output_format.lower()
+    cmd = [FFMPEG, "-nostdin", "-nostats", "-i", job.video_path]
+    for path, _, _, _ in report.tracks:
+        cmd.extend(["-i", path])
+    cmd.extend(["-map", "0:V", "-map", "0:a?"])
+    for i in range(len(report.tracks)):
+        cmd.extend(["-map", f"{i + 1}:0"])
+    if output_format in FONT_ATTACH_FORMATS:
+        cmd.extend(["-map", "0:t?"])
+    cmd.extend(["-c:v", "copy"])
+    cmd.extend(audio_codec_args(output_format, info.audio_codecs if info else None))
+    codecs = SUBTITLE_MUX_CODECS[output_format]
+    for i, (_, kind, language, title) in enumerate(report.tracks):
+        cmd.extend([f"-c:s:{i}", codecs[kind], f"-disposition:s:{i}", "default" if i == 0 else "0"])
+        cmd.extend([f"-metadata:s:s:{i}", f"language={language or 'und'}"])
+        if title:
+            cmd.extend([f"-metadata:s:s:{i}", f"title={title}"])
+    attached = len(info.attachments) if info else 0
+    for i, path in enumerate(report.fonts, attached):
+        mimetype = FONT_MIMETYPES.get(os.path.splitext(path)[1].lower(), FONT_MIMETYPE_DEFAULT)
+        cmd.extend(["-attach", path, f"-metadata:s:t:{i}", f"mimetype={mimetype}"])
+    cmd.extend(["-progress", "pipe:1", "-y", job.output_path])
+    return cmd
+
+
+def run_mux(job, on_log=None, on_progress=None, on_speed=None):
+    """
+    Muxes the job's subtitle files as tracks next to the copied video and
+    audio, in seconds of disk I/O instead of a full encode. The first track
+    is marked default. Raises RuntimeError when the container can not carry
+    them, see check_mux().
+    """
+    log = on_log or (lambda message: None)
+    notify = notify_on_change(on_progress)
+    eta = EtaEstimator(expected=job.expected_seconds)
+    info = probe_job(job)
+    report = check_mux(job, info, log)
+    for warning in report.warnings:
+        log(f"Mux: {warning}")
+    if report.errors:
+        raise RuntimeError("Soft subtitles can not be muxed: " + "; ".join(report.errors))
+    if report.fonts:
+        log(f"Mux: attaching {len(report.fonts)} font files")
+    cmd = build_mux_command(job, info, report)
+    log("Command: " + format_command(cmd))
+
+    def on_event(event):
+        if event.speed is not None:
+            job.speed = event.speed
+            if on_speed: on_speed(job, event.speed)
+        if event.out_time is not None and job.total_duration > 0:
+            job.progress = min(event.out_time / job.total_duration, 1.0)
+            job.eta = eta.update(event.out_time, job.total_duration)
+        notify(job)
+
+    with stage(job, "mux"):
+        return run_process(job, cmd, on_log=log, on_event=on_event)
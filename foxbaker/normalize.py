@@ -0,0 +1,176 @@
+import codecs
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from foxbaker.paths import cache_dir
+from foxbaker.subtitles import EMPTY_SRT
+
+CHUNK_BYTES = 1024 * 1024
+SAMPLE_BYTES = 64 * 1024
+SUBTITLE_CACHE_BYTES = 256 * 1024 * 1024
+
+BOMS = [(codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"), (codecs.BOM_UTF8, "utf-8-sig"),
+        (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")]
+# Single-byte encodings subtitles are found in, in order of preference on a tie
+CYRILLIC_ENCODINGS = ["cp1251", "koi8-r", "cp866"]
+WESTERN_ENCODING = "cp1252"
+
+_evict_lock = threading.Lock()
+
+
+def _bom_encoding(head):
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    return None
+
+
+def _score(sample, encoding):
+    """Share of the non-ASCII characters that are lowercase letters, natural text is mostly lowercase."""
+    text = sample.decode(encoding, errors="replace")
+    high = [c for c in text if ord(c) > 127]
+    if not high:
+        return 0.0
+    return sum(1 for c in high if c.isalpha() and c.islower()) / len(high)
+
+
+def guess_legacy_encoding(sample):
+    """
+    Picks the single-byte encoding a non-UTF-8 sample most likely uses.
+
+    In Cyrillic text nearly every letter is a non-ASCII byte, so those bytes
+    come in runs, while Western accents sit alone between ASCII letters. The
+    Cyrillic code pages map the same bytes to different letters, but only the
+    right one turns running text into mostly lowercase words.
+    """
+    high = [i for i, b in enumerate(sample) if b > 127]
+    if not high:
+        return WESTERN_ENCODING
+    positions = set(high)
+    in_runs = sum(1 for i in high if i - 1 in positions or i + 1 in positions)
+    if in_runs / len(high) < 0.5:
+        return WESTERN_ENCODING
+    scores = [(_score(sample, encoding), -i, encoding) for i, encoding in enumerate(CYRILLIC_ENCODINGS)]
+    return max(scores)[2]
+
+
+def _scan(path):
+    """
+    Hashes the file in chunks and checks that it is valid UTF-8 at the same time.
+
+    Returns (sha256 hex digest, encoding) where encoding is None for clean
+    UTF-8 and otherwise the BOM or legacy encoding to transcode from, guessed
+    from SAMPLE_BYTES around the first invalid byte.
+    """
+    digest = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    encoding = None
+    with open(path, "rb") as f:
+        first = True
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            if first:
+                # A UTF-8 BOM is fine for libass, the rest still has to be checked
+                encoding = _bom_encoding(chunk)
+                if encoding == "utf-8-sig":
+                    encoding = None
+                first = False
+            digest.update(chunk)
+            if encoding is None:
+                try:
+                    decoder.decode(chunk, final=not chunk)
+                except UnicodeDecodeError as e:
+                    start = max(0, e.start - SAMPLE_BYTES // 2)
+                    encoding = guess_legacy_encoding(e.object[start:start + SAMPLE_BYTES])
+            if not chunk:
+                break
+    return digest.hexdigest(), encoding
+
+
+def _filter_safe(path):
+    # The subtitles filter argument is quoted with ', a path containing one needs a copy
+    return "'" not in str(path)
+
+
+def _srt_without_cues(path, encoding):
+    if Path(path).suffix.lower() != ".srt":
+        return False
+    # Decoded, the arrow of a UTF-16 file is not the bytes b"-->"
+    with open(path, "r", encoding=encoding or "utf-8", errors="replace") as f:
+        tail = ""
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            if not chunk:
+                return True
+            if "-->" in tail + chunk:
+                return False
+            tail = chunk[-2:]
+
+
+def transcode(src, dst, encoding):
+    """Re-encodes `src` to UTF-8 without loading it whole, line endings are kept as they are."""
+    with open(src, "r", encoding=encoding, errors="replace", newline="") as fin, \
+            open(dst, "w", encoding="utf-8", newline="") as fout:
+        while True:
+            data = fin.read(CHUNK_BYTES)
+            if not data:
+                break
+            fout.write(data)
+
+
+def evict(directory, max_bytes=SUBTITLE_CACHE_BYTES, keep=None):
+    """Removes the least recently used files except `keep` until the directory fits into `max_bytes`."""
+    with _evict_lock:
+        entries = []
+        total = 0
+        for entry in os.scandir(directory):
+            if entry.is_file():
+                stat = entry.stat()
+                total += stat.st_size
+                if entry.path != str(keep):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def normalize_subtitles(path):
+    """
+    Returns the path of a UTF-8 version of a subtitle file.
+
+    Clean UTF-8 files are used in place. Everything else is transcoded once
+    into the subtitle cache, keyed by a hash of the content, so queuing the
+    same file again costs one read and no write. An .srt without any cue,
+    which ffmpeg can not open, becomes one that draws nothing. The returned
+    file must not be deleted by the caller.
+    """
+    digest, encoding = _scan(path)
+    empty = _srt_without_cues(path, encoding)
+    if encoding is None and _filter_safe(path) and not empty:
+        return str(path)
+
+    directory = cache_dir("subtitles")
+    cached = directory / f"{digest}{Path(path).suffix.lower()}"
+    if cached.exists():
+        os.utime(cached)
+        return str(cached)
+    tmp = cached.with_name(f"{cached.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        if empty:
+            with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+                f.write(EMPTY_SRT)
+        else:
+            transcode(path, tmp, encoding or "utf-8")
+        os.replace(tmp, cached)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    evict(directory, keep=cached)
+    return str(cached)
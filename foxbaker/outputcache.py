@@ -0,0 +1,339 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, outputs are hardlinked or copied there
+    fcntl = None
+
+from foxbaker.encode import BITRATE_OPTIONS, build_command, job_encoder, probe_job
+from foxbaker.encoders import FFMPEG, capabilities
+from foxbaker.filtergraph import escape_filter_path
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.paths import cache_dir
+
+# Size limit of the cache, 0 turns it off
+OUTPUT_CACHE_MB = int(os.environ.get("FOXBAKER_OUTPUT_CACHE_MB") or 20480)
+INDEX_FILE = "index.json"
+# Raise when the key changes, older entries are not found then
+KEY_VERSION = 1
+# The video is identified by its size and these many blocks spread over the file
+SAMPLE_BLOCKS = 16
+SAMPLE_BLOCK_SIZE = 64 * 1024
+# Thread counts change the speed, not the picture, a job keeps its key on another machine
+THREAD_OPTIONS = ("-threads", "-filter_threads", "-filter_complex_threads")
+THREAD_FILTER_OPTION = re.compile(r":threads=\d+")
+# linux/fs.h, shares the blocks of a file on btrfs, XFS and other copy-on-write file systems
+FICLONE = 0x40049409
+
+_lock = threading.Lock()
+# (path, size, mtime_ns) -> fingerprint, so a file is only sampled again after it changed
+_fingerprints = {}
+# Devices of output folders the cache could not link from, reported once
+_unlinkable = set()
+
+
+def sampled_digest(path):
+    """Hash of the size and SAMPLE_BLOCKS evenly spread blocks, the whole file when it is small."""
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= SAMPLE_BLOCKS * SAMPLE_BLOCK_SIZE:
+            digest.update(f.read())
+        else:
+            step = (size - SAMPLE_BLOCK_SIZE) // (SAMPLE_BLOCKS - 1)
+            for i in range(SAMPLE_BLOCKS):
+                f.seek(i * step)
+                digest.update(f.read(SAMPLE_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def video_fingerprint(path):
+    """sampled_digest() of the video, remembered per size and mtime. Copies of a file get the same one."""
+    st = os.stat(path)
+    memo = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo not in _fingerprints:
+        _fingerprints[memo] = sampled_digest(path)
+    return _fingerprints[memo]
+
+
+def _file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def planned_command(job, subtitle_path):
+    """The ffmpeg command the job's output is made with, see encode._run_job()."""
+    info = probe_job(job)
+    if job.renditions:
+        from foxbaker.renditions import build_renditions_command
+        bitrate_needed = any(BITRATE_OPTIONS.get(r.quality, 0) == 0 for r in job.renditions)
+        return build_renditions_command(job, subtitle_path, info.bitrate if info and bitrate_needed else None)
+    original_bitrate = info.bitrate if info and BITRATE_OPTIONS.get(job.quality, 0) == 0 else None
+    return build_command(job, subtitle_path, original_bitrate)
+
+
+def job_key(job):
+    """
+    Cache key of the job's outputs, None when they can not be cached. It
+    covers the video content, the normalized subtitles, the planned command
+    with the paths taken out, the encoding mode and the ffmpeg build.
+    """
+    if not OUTPUT_CACHE_MB or job.deadline or job.target_speed:
+        # Deadline jobs pick their presets by the clock, the same job gives another file every time
+        return None
+    try:
+        subtitle_path = normalize_subtitles(job.subtitle_path)
+        cmd = planned_command(job, subtitle_path)
+        parts = [KEY_VERSION, video_fingerprint(job.video_path), _file_digest(subtitle_path)]
+    except (OSError, UnicodeError):
+        return None
+    outputs = [r.output_path for r in job.renditions] or [job.output_path]
+    replacements = [(escape_filter_path(subtitle_path), "<subtitle>"), (subtitle_path, "<subtitle>"),
+                    (job.video_path, "<video>")] + [(path, f"<output{i}>") for i, path in enumerate(outputs)]
+    command = []
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg in THREAD_OPTIONS:
+            next(args, None)
+            continue
+        for old, new in replacements:
+            arg = arg.replace(old, new)
+        command.append(THREAD_FILTER_OPTION.sub("", arg))
+    # Chunked and smart encodes give other files than the planned single command
+    mode = "renditions" if job.renditions else "smart" if job.smart else "segmented" if job.segmented else "plain"
+    parts.extend([mode, command, job_encoder(job).name, capabilities(FFMPEG)["version"]])
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def _load_index(directory):
+    try:
+        with open(directory / INDEX_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(directory, index):
+    path = directory / INDEX_FILE
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _reflink(src, dst):
+    if fcntl is None or not hasattr(fcntl, "ioctl"):
+        raise OSError("reflinks are not supported here")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def place(src, dst, link=True, copy=True):
+    """
+    Puts a copy of src at dst the cheapest way the file systems allow:
+    a reflink, when `link` is set a hardlink, and when `copy` is set a real
+    copy. Returns the way that worked, raises OSError when none did.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        _reflink(src, dst)
+        return "reflink"
+    except OSError:
+        pass
+    try:
+        if link:
+            os.link(src, dst)
+            return "hardlink"
+    except OSError:
+        pass
+    if not copy:
+        raise OSError("the cache folder is on another file system, the output would have to be copied")
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return "copy"
+
+
+def unshare_output(path):
+    """
+    Removes an output that is hardlinked to a cache entry before it is
+    encoded again, ffmpeg would otherwise overwrite the entry through the link.
+    """
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_entry(directory, entry):
+    for name in entry["files"]:
+        try:
+            os.remove(directory / name)
+        except OSError:
+            pass
+
+
+def restore(key, job, log):
+    """Puts the cached outputs of `key` at the job's output paths, returns False on a miss."""
+    directory = cache_dir("outputs")
+    with _lock:
+        index = _load_index(directory)
+        entry = index.get(key)
+        if entry is None:
+            return False
+        files = [directory / name for name in entry["files"]]
+        # A hardlinked output that was overwritten in place changed the entry too
+        try:
+            intact = [sampled_digest(path) for path in files] == entry["digests"]
+        except OSError:
+            intact = False
+        if not intact:
+            log("Output cache: the cached file was changed or removed, encoding again")
+            _remove_entry(directory, index.pop(key))
+            _save_index(directory, index)
+            return False
+        outputs = [r.output_path for r in job.renditions] or [job.output_path]
+        try:
+            # Never hardlinked, outputs restored from one entry would all be the same file
+            methods = [place(src, dst, link=False) for src, dst in zip(files, outputs)]
+        except OSError as e:
+            log(f"Output cache: could not place the cached output: {e}")
+            return False
+        entry["last_used"] = time.time()
+        entry["hits"] = entry.get("hits", 0) + 1
+        _save_index(directory, index)
+    log(f"Output cache: same video, subtitles and command as before, output created by {', '.join(methods)}")
+    return True
+
+
+def store(key, job, log, limit_mb=None):
+    """Adds the job's finished outputs under `key` and evicts the least recently used entries above the limit."""
+    limit = (OUTPUT_CACHE_MB if limit_mb is None else limit_mb) * 1024 * 1024
+    outputs = [r.output_path for r in job.renditions] or [job.output_path]
+    try:
+        size = sum(os.path.getsize(path) for path in outputs)
+    except OSError:
+        return
+    if not key or size > limit:
+        return
+    directory = cache_dir("outputs")
+    names = [f"{key}_{i}{os.path.splitext(path)[1]}" for i, path in enumerate(outputs)]
+    try:
+        # Writing every output a second time costs more than the rare hit saves
+        methods = [place(src, directory / name, copy=False) for src, name in zip(outputs, names)]
+        digests = [sampled_digest(directory / name) for name in names]
+    except OSError as e:
+        for name in names:
+            try:
+                os.remove(directory / name)
+            except OSError:
+                pass
+        try:
+            device = os.stat(outputs[0]).st_dev
+        except OSError:
+            device = None
+        if device not in _unlinkable:
+            _unlinkable.add(device)
+            log(f"Output cache: off for outputs in {os.path.dirname(os.path.abspath(outputs[0]))}, {e}")
+        return
+    with _lock:
+        index = _load_index(directory)
+        index.pop(key, None)
+        index[key] = {"files": names, "outputs": outputs, "digests": digests, "bytes": size,
+                      "created": time.time(), "last_used": time.time(), "hits": 0}
+        evict(directory, index, limit)
+        _save_index(directory, index)
+    log(f"Output cache: stored by {', '.join(methods)}")
+
+
+def owned_bytes(directory, entry):
+    """Bytes only the cache holds, files still hardlinked to an output take no space of their own."""
+    size = 0
+    for name in entry["files"]:
+        try:
+            st = os.stat(directory / name)
+        except OSError:
+            continue
+        if st.st_nlink == 1:
+            size += st.st_size
+    return size
+
+
+def evict(directory, index, limit):
+    """
+    Drops the least recently used entries of `index` until the bytes the
+    cache holds alone fit into `limit`. Entries still hardlinked to their
+    outputs free nothing and are kept.
+    """
+    owned = {key: owned_bytes(directory, entry) for key, entry in index.items()}
+    total = sum(owned.values())
+    for key in sorted(index, key=lambda k: index[k]["last_used"]):
+        if total <= limit:
+            break
+        if not owned[key]:
+            continue
+        _remove_entry(directory, index.pop(key))
+        total -= owned[key]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="foxbaker.outputcache", description="Inspect or clear the output cache.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("info", help="print the location, size and limit of the cache")
+    commands.add_parser("list", help="print every entry, the most recently used first")
+    commands.add_parser("clear", help="remove every entry")
+    trim = commands.add_parser("trim", help="evict the least recently used entries down to a size")
+    trim.add_argument("max_mb", type=int)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    directory = cache_dir("outputs")
+    with _lock:
+        index = _load_index(directory)
+        if args.command == "info":
+            total = sum(owned_bytes(directory, entry) for entry in index.values())
+            print(json.dumps({"directory": str(directory), "entries": len(index),
+                              "megabytes": round(total / (1024 * 1024), 1), "limit_megabytes": OUTPUT_CACHE_MB}))
+        elif args.command == "list":
+            for key, entry in sorted(index.items(), key=lambda item: -item[1]["last_used"]):
+                print(json.dumps({"key": key[:16], "outputs": entry["outputs"],
+                                  "megabytes": round(entry["bytes"] / (1024 * 1024), 1), "hits": entry["hits"],
+                                  "last_used": time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"]))},
+                                 ensure_ascii=False))
+        elif args.command == "clear":
+            for entry in index.values():
+                _remove_entry(directory, entry)
+            _save_index(directory, {})
+        else:
+            evict(directory, index, args.max_mb * 1024 * 1024)
+            _save_index(directory, index)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
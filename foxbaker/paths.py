@@ -0,0 +1,20 @@
+import os
+from pathlib import Path
+
+
+def cache_dir(name=None):
+    """
+    Per-user directory for FOXBaker caches, created on first use.
+
+    FOXBAKER_CACHE_DIR overrides the location, e.g. to share it between
+    render nodes or to keep it on a faster disk.
+    """
+    base = os.environ.get("FOXBAKER_CACHE_DIR")
+    if not base:
+        if os.name == 'nt':
+            base = os.path.join(os.environ.get("LOCALAPPDATA") or os.path.expanduser("~"), "FOXBaker", "cache")
+        else:
+            base = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "foxbaker")
+    path = Path(base) / name if name else Path(base)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+from foxbaker.encode import (AUDIO_COPY_CODECS, audio_codec_args, audio_copy_possible, build_command, format_command,
+                             job_encoder, probe_job, run_process)
+from foxbaker.encoders import FFMPEG, HW_INIT_ERROR_RE, capabilities
+from foxbaker.logbuffer import DEBUG, ERROR, classify
+from foxbaker.metrics import stage
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.paths import cache_dir
+from foxbaker.subtitles import load_subtitles
+
+PREFLIGHT_CACHE_FILE = "preflight.json"
+PREFLIGHT_CACHE_ENTRIES = 500
+# Raise when the checks change, passes recorded by older checks are not trusted then
+PREFLIGHT_VERSION = 1
+TRIAL_SECONDS = 2
+ASS_STYLE_RE = re.compile(r'^\s*Style\s*:\s*([^,]*),', re.IGNORECASE)
+ASS_FORMAT_RE = re.compile(r'^\s*Format\s*:(.*)$', re.IGNORECASE)
+
+_lock = threading.Lock()
+
+
+class PreflightReport:
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+        # First line of a trial that failed because the GPU encoder could not be set up
+        self.init_error = None
+        self.cached = False
+
+    @property
+    def ok(self):
+        return not self.errors and not self.init_error
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+def settings_key(job, encoder):
+    """Hash of everything a preflight result depends on: both inputs, the output settings, encoder and ffmpeg."""
+    outputs = [(r.output_format, r.quality) for r in job.renditions] or [(job.output_format, job.quality)]
+    data = [PREFLIGHT_VERSION, _file_key(job.video_path), _file_key(job.subtitle_path), outputs, encoder.name,
+            capabilities(FFMPEG)["version"]]
+    return hashlib.sha1(json.dumps(data).encode("utf-8")).hexdigest()
+
+
+def _load_cache():
+    try:
+        with open(cache_dir() / PREFLIGHT_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    path = cache_dir() / PREFLIGHT_CACHE_FILE
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def remember_pass(key, warnings):
+    with _lock:
+        cache = _load_cache()
+        cache.pop(key, None)
+        cache[key] = {"warnings": warnings}
+        while len(cache) > PREFLIGHT_CACHE_ENTRIES:
+            cache.pop(next(iter(cache)))
+        _save_cache(cache)
+
+
+def check_containers(job, info, report, log):
+    """Output formats against the compatibility matrix, picks an audio conversion where copying is impossible."""
+    audio = info.audio_codecs if info else None
+    for output_format in sorted({r.output_format for r in job.renditions} or {job.output_format}):
+        if not output_format:
+            report.errors.append("The output file has no extension, the container format is unknown")
+            continue
+        if audio and output_format in AUDIO_COPY_CODECS and not audio_copy_possible(output_format, audio):
+            args = audio_codec_args(output_format, audio)
+            log(f"Preflight: {', '.join(audio)} audio can not be copied into {output_format}, "
+                f"converting with {' '.join(args[1:])}")
+
+
+def _ass_style_index(lines):
+    """Position of the Style field in the Dialogue lines, from the Format line of [Events]."""
+    section = None
+    for line in lines:
+        stripped = line.strip().lower()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            section = stripped
+        elif section == "[events]":
+            m = ASS_FORMAT_RE.match(line)
+            if m:
+                names = [name.strip().lower() for name in m.group(1).split(",")]
+                return names.index("style") if "style" in names else None
+    return 3
+
+
+def check_subtitles(subtitle_path, info, report):
+    try:
+        subtitles = load_subtitles(subtitle_path)
+        with open(subtitle_path, "r", encoding="utf-8-sig", errors="replace") as f:
+            lines = f.read().splitlines()
+    except OSError as e:
+        report.errors.append(f"Subtitle file can not be read: {e}")
+        return None
+    # normalize_subtitles() turns an .srt without cues into one invisible cue
+    if not any(ev.fields is not None or "".join(ev.text).strip("\u200b \t") for ev in subtitles.events):
+        report.warnings.append("The subtitle file contains no subtitle lines, the video is encoded without any")
+        return subtitles
+    if subtitles.kind == "ass":
+        dialogues = sum(1 for line in lines if line.lstrip().lower().startswith("dialogue:"))
+        if dialogues > len(subtitles.events):
+            report.warnings.append(f"{dialogues - len(subtitles.events)} Dialogue lines have invalid times "
+                                   "and will not be shown")
+        styles = {m.group(1).strip() for m in map(ASS_STYLE_RE.match, lines) if m}
+        style_index = _ass_style_index(lines)
+        used = {ev.fields[style_index].strip().lstrip("*") for ev in subtitles.events
+                if style_index is not None and len(ev.fields) > style_index}
+        missing = sorted(name for name in used - styles if name.lower() != "default")
+        if missing:
+            report.warnings.append(f"Styles used but not defined, libass falls back to Default: {', '.join(missing)}")
+    if info and info.duration and subtitles.events[0].start >= info.duration:
+        report.warnings.append("All subtitle lines start after the end of the video")
+    return subtitles
+
+
+def trial_encode(job, subtitle_path, subtitles, info, encoder, report, log):
+    """
+    Encodes TRIAL_SECONDS with the job's real filter graph, encoder and audio
+    settings into the null muxer, starting at the first subtitle line so
+    libass loads its fonts and actually draws.
+    """
+    start = 0.0
+    if subtitles and subtitles.events and info and info.duration:
+        start = max(0.0, min(subtitles.events[0].start, info.duration - TRIAL_SECONDS))
+    # -copyts keeps the source timestamps, so the subtitles filter draws the lines of that moment
+    input_args = ["-hide_banner", "-copyts", "-ss", f"{start:.3f}", "-t", str(TRIAL_SECONDS)]
+    original_bitrate = info.bitrate if info else None
+    if job.renditions:
+        from foxbaker.renditions import build_renditions_command
+        cmd = build_renditions_command(job, subtitle_path, original_bitrate, input_args=input_args, null_output=True)
+    else:
+        cmd = build_command(job, subtitle_path, original_bitrate, input_args=input_args, output=["-f", "null", "-"])
+    log("Preflight trial: " + format_command(cmd))
+    lines = []
+
+    def on_log(line):
+        if line.strip():
+            lines.append(line)
+        log(f"Preflight: {line}")
+
+    rc = run_process(job, cmd, on_log=on_log)
+    if rc == 0 or job.cancelled:
+        return
+    init_errors = [line for line in lines if HW_INIT_ERROR_RE.search(line)]
+    if encoder.hardware and init_errors:
+        report.init_error = init_errors[0]
+        return
+    messages = [line for line in lines if classify(line) > DEBUG]
+    errors = [line for line in messages if classify(line) == ERROR]
+    reason = errors[0] if errors else messages[-1] if messages else f"exit code {rc}"
+    report.errors.append(f"Trial encode failed: {reason}")
+
+
+def preflight(job, log=None):
+    """
+    Checks a job before the real encode: container and codec compatibility,
+    the subtitle file and a short trial encode. Passes are remembered per
+    input files and settings, so a re-queued job skips the checks. Raises
+    FileNotFoundError when ffmpeg is missing, like the encode would.
+    """
+    log = log or (lambda message: None)
+    report = PreflightReport()
+    encoder = job_encoder(job)
+    try:
+        key = settings_key(job, encoder)
+    except OSError as e:
+        report.errors.append(str(e))
+        return report
+    with _lock:
+        cached = _load_cache().get(key)
+    if cached is not None:
+        report.cached = True
+        report.warnings = cached.get("warnings", [])
+        log("Preflight: passed before with the same files and settings")
+        return report
+
+    info = probe_job(job)
+    if info is None:
+        report.errors.append("The video file can not be read")
+        return report
+    check_containers(job, info, report, log)
+    try:
+        with stage(job, "normalize"):
+            subtitle_path = normalize_subtitles(job.subtitle_path)
+    except (OSError, UnicodeError) as e:
+        report.errors.append(f"Subtitle file can not be read: {e}")
+        return report
+    subtitles = check_subtitles(subtitle_path, info, report)
+    for warning in report.warnings:
+        log(f"Preflight warning: {warning}")
+    if report.errors:
+        return report
+    trial_encode(job, subtitle_path, subtitles, info, encoder, report, log)
+    if report.ok and not job.cancelled:
+        remember_pass(key, report.warnings)
+        log("Preflight: passed")
+    return report
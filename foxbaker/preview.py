@@ -0,0 +1,219 @@
+import argparse
+import bisect
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from foxbaker.encoders import FFMPEG
+from foxbaker.filtergraph import subtitles_filter
+from foxbaker.fonts import check_fonts, prepare_fontsdir
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.paths import cache_dir
+from foxbaker.probe import probe_media
+from foxbaker.subtitles import format_ass_time, load_subtitles, parse_ass_time
+
+# Length of a preview and how much of it comes before the chosen moment
+PREVIEW_SECONDS = 4.0
+PREVIEW_LEAD = 0.5
+# Previews are rendered this high, the subtitles are laid out for the source size all the same
+PREVIEW_HEIGHT = 360
+PREVIEW_FRAMES = 6
+# Rendered previews kept in the cache, the oldest are removed above this
+PREVIEWS_KEPT = 50
+ASS_OVERRIDE_RE = re.compile(r'\{[^}]*\}')
+
+CREATION_FLAGS = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+
+
+def line_text(event):
+    """The text of a subtitle line without ASS override tags, on one line."""
+    if event.fields is not None:
+        text = ASS_OVERRIDE_RE.sub("", event.fields[-1])
+        return re.sub(r'\s+', " ", text.replace("\\N", " ").replace("\\n", " ").replace("\\h", " ")).strip()
+    return " ".join(line.strip() for line in event.text)
+
+
+class Timeline:
+    """The subtitle lines sorted by start time, for finding the line at or after a moment."""
+
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda ev: ev.start)
+        self.starts = [ev.start for ev in self.events]
+
+    def __len__(self):
+        return len(self.events)
+
+    def line_at(self, seconds):
+        """Index of the line shown at `seconds`, or of the next one to start, None after the last."""
+        i = bisect.bisect_right(self.starts, seconds)
+        for j in range(i - 1, -1, -1):
+            if self.events[j].end > seconds:
+                return j
+            # Lines are sorted by start, an earlier one may still be shown, but only up to a few back
+            if i - j > 8:
+                break
+        return i if i < len(self.events) else None
+
+    def next_line(self, index):
+        return min(index + 1, len(self.events) - 1) if index is not None else 0
+
+    def previous_line(self, index):
+        return max(index - 1, 0) if index is not None else 0
+
+
+def parse_time(value):
+    """Seconds from "83.5", "1:23.5" or "0:01:23.50"."""
+    value = value.strip()
+    if value.count(":") == 1:
+        value = "0:" + value
+    if ":" in value:
+        return parse_ass_time(value)
+    return float(value)
+
+
+class Previewer:
+    """
+    Renders short previews of one video/subtitle pair with the real subtitle
+    filter. The subtitle timeline, the fonts and the source size are looked
+    up once, so going on to the next line only costs the ffmpeg run itself.
+    Raises RuntimeError when the video can not be read.
+    """
+
+    def __init__(self, video_path, subtitle_path):
+        self.video_path = video_path
+        self.subtitle_path = subtitle_path
+        self.normalized = normalize_subtitles(subtitle_path)
+        self.timeline = Timeline(load_subtitles(self.normalized).events)
+        self.info = probe_media(video_path)
+        self.source = (self.info.width, self.info.height) if self.info.width and self.info.height else None
+        fonts = check_fonts(video_path, self.normalized, self.info, origin_path=subtitle_path)
+        self.missing_fonts = fonts.missing
+        self.fontsdir = None
+        if fonts.resolved:
+            self.fontsdir = str(prepare_fontsdir([path for files in fonts.resolved.values() for path in files]))
+
+    def window(self, at, seconds=PREVIEW_SECONDS):
+        """(start, length) of the preview around `at`, kept inside the video."""
+        start = max(0.0, at - PREVIEW_LEAD)
+        if self.info.duration:
+            start = max(0.0, min(start, self.info.duration - seconds))
+            seconds = min(seconds, self.info.duration - start)
+        return start, seconds
+
+    def command(self, at, output, seconds=PREVIEW_SECONDS, frames=None):
+        """
+        ffmpeg command for the preview: a downscaled ultrafast clip, or with
+        `frames` that many PNG frames spread over the window.
+
+        The input-side -ss jumps to the keyframe before the window and only
+        decodes from there. The frames then start at 0, setpts moves them back
+        to the source time so libass draws the lines of that moment.
+        """
+        start, seconds = self.window(at, seconds)
+        vf = f"setpts=PTS+{start:.3f}/TB,scale=-2:{PREVIEW_HEIGHT}:flags=fast_bilinear,"
+        vf += subtitles_filter(self.normalized, self.source, self.fontsdir) + ",setpts=PTS-STARTPTS"
+        cmd = [FFMPEG, "-nostdin", "-hide_banner", "-v", "error", "-ss", f"{start:.3f}", "-t", f"{seconds:.3f}",
+               "-i", self.video_path, "-map", "0:V:0"]
+        if frames:
+            cmd.extend(["-vf", vf + f",fps={frames / seconds:.6f}", "-frames:v", str(frames), "-y", output])
+            return cmd
+        cmd.extend(["-map", "0:a:0?", "-vf", vf, "-c:v", "libx264", "-preset", "ultrafast", "-crf", "28",
+                    "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "96k", "-movflags", "+faststart", "-y", output])
+        return cmd
+
+    def render(self, at, seconds=PREVIEW_SECONDS, frames=None):
+        """
+        Renders the preview around `at` into the cache and returns the clip's
+        path, or the list of PNG paths when `frames` is given. Raises
+        RuntimeError when ffmpeg fails and FileNotFoundError when it is missing.
+        """
+        directory = cache_dir("previews")
+        name = f"{Path(self.video_path).stem}_{int(at * 1000)}"
+        if frames:
+            output_dir = Path(tempfile.mkdtemp(prefix=name + "_", dir=directory))
+            output = str(output_dir / "%02d.png")
+        else:
+            output = str(directory / f"{name}.mp4")
+        result = subprocess.run(self.command(at, output, seconds, frames), capture_output=True, text=True,
+                                encoding="utf-8", errors="replace", creationflags=CREATION_FLAGS)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.strip() or result.returncode}")
+        _trim(directory)
+        if frames:
+            return sorted(str(path) for path in output_dir.glob("*.png"))
+        return output
+
+    def render_line(self, index, seconds=PREVIEW_SECONDS, frames=None):
+        return self.render(self.timeline.events[index].start, seconds, frames)
+
+
+def _trim(directory):
+    try:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.stat().st_mtime)
+    except OSError:
+        return
+    for entry in entries[:-PREVIEWS_KEPT]:
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="foxbaker.preview",
+                                     description="Render a few seconds of a video with its subtitles burned in.")
+    parser.add_argument("video")
+    parser.add_argument("subtitles")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--at", metavar="TIME", help="moment to preview, e.g. 83.5, 1:23.5 or 0:01:23.50")
+    where.add_argument("--line", type=int, metavar="N", help="subtitle line to preview, counted from 1 by start time")
+    parser.add_argument("--seconds", type=float, default=PREVIEW_SECONDS, help="length of the preview")
+    parser.add_argument("--frames", type=int, metavar="N", help="write N PNG frames instead of a clip")
+    parser.add_argument("--lines", action="store_true", help="list the subtitle lines first")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    started = time.monotonic()
+    try:
+        previewer = Previewer(args.video, args.subtitles)
+    except (OSError, RuntimeError, UnicodeError) as e:
+        print(f"foxbaker.preview: {e}", file=sys.stderr)
+        return 1
+    if args.lines:
+        for number, event in enumerate(previewer.timeline.events, 1):
+            print(f"{number}\t{format_ass_time(event.start)}\t{line_text(event)}")
+    if args.line is not None:
+        if not 1 <= args.line <= len(previewer.timeline):
+            print(f"foxbaker.preview: there are {len(previewer.timeline)} subtitle lines", file=sys.stderr)
+            return 1
+        at = previewer.timeline.events[args.line - 1].start
+    else:
+        at = parse_time(args.at)
+    indexed = time.monotonic()
+    try:
+        result = previewer.render(at, args.seconds, args.frames)
+    except (OSError, RuntimeError) as e:
+        print(f"foxbaker.preview: {e}", file=sys.stderr)
+        return 1
+    line = previewer.timeline.line_at(at)
+    print(json.dumps({"at": round(at, 3), "line": line + 1 if line is not None else None,
+                      "text": line_text(previewer.timeline.events[line]) if line is not None else None,
+                      "output": result, "missing_fonts": previewer.missing_fonts,
+                      "index_seconds": round(indexed - started, 3),
+                      "render_seconds": round(time.monotonic() - indexed, 3)}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
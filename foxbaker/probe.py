@@ -0,0 +1,248 @@
+import json
+import os
+import statistics
+import subprocess
+import threading
+from fractions import Fraction
+
+from foxbaker.paths import cache_dir
+
+FFPROBE = os.environ.get("FOXBAKER_FFPROBE", "ffprobe")
+
+MEDIA_CACHE_FILE = "media.json"
+MEDIA_CACHE_ENTRIES = 500
+# How much of the file is read to estimate the keyframe interval
+KEYFRAME_SCAN_SECONDS = 15
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _number(value, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MediaInfo:
+    """The parts of `ffprobe -show_format -show_streams` FOXBaker works with."""
+
+    FIELDS = ("path", "duration", "start_time", "bit_rate", "format_name", "video_codec", "width", "height",
+              "pix_fmt", "frame_rate", "video_bitrate", "frame_count", "keyframe_interval", "audio_codecs",
+              "subtitle_streams", "attachments")
+
+    def __init__(self, path, **fields):
+        self.path = path
+        self.duration = 0.0
+        self.start_time = 0.0
+        self.bit_rate = None
+        self.format_name = None
+        self.video_codec = None
+        self.width = None
+        self.height = None
+        self.pix_fmt = None
+        # "num/den" string as ffprobe prints it, ffmpeg accepts it for -r as is
+        self.frame_rate = None
+        self.video_bitrate = None
+        self.frame_count = None
+        self.keyframe_interval = None
+        self.audio_codecs = []
+        # [{"index", "codec", "language", "title"}]
+        self.subtitle_streams = []
+        # [{"filename", "mimetype"}], fonts embedded in .mkv files end up here
+        self.attachments = []
+        for name, value in fields.items():
+            if name in self.FIELDS:
+                setattr(self, name, value)
+
+    @property
+    def fps(self):
+        try:
+            return float(Fraction(self.frame_rate))
+        except (TypeError, ValueError, ZeroDivisionError):
+            return None
+
+    @property
+    def bitrate(self):
+        """Video bitrate, or the overall one for containers that do not store it per stream."""
+        return self.video_bitrate or self.bit_rate
+
+    @property
+    def audio_codec(self):
+        return self.audio_codecs[0] if self.audio_codecs else None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    @classmethod
+    def from_ffprobe(cls, path, data):
+        fmt = data.get("format", {})
+        info = cls(path)
+        info.duration = _number(fmt.get("duration")) or 0.0
+        info.start_time = _number(fmt.get("start_time")) or 0.0
+        info.bit_rate = _number(fmt.get("bit_rate"), int)
+        info.format_name = fmt.get("format_name")
+
+        video_index = None
+        for stream in data.get("streams", []):
+            kind = stream.get("codec_type")
+            tags = stream.get("tags", {})
+            disposition = stream.get("disposition", {})
+            if kind == "video" and video_index is None and not disposition.get("attached_pic"):
+                video_index = stream.get("index")
+                info.video_codec = stream.get("codec_name")
+                info.width = stream.get("width")
+                info.height = stream.get("height")
+                info.pix_fmt = stream.get("pix_fmt")
+                for key in ("r_frame_rate", "avg_frame_rate"):
+                    if stream.get(key) not in (None, "0/0"):
+                        info.frame_rate = stream[key]
+                        break
+                info.video_bitrate = _number(stream.get("bit_rate"), int)
+                info.frame_count = _number(stream.get("nb_frames"), int) or _number(tags.get("NUMBER_OF_FRAMES"), int)
+                if not info.duration:
+                    info.duration = _number(stream.get("duration")) or 0.0
+            elif kind == "audio":
+                info.audio_codecs.append(stream.get("codec_name"))
+            elif kind == "subtitle":
+                info.subtitle_streams.append({"index": stream.get("index"), "codec": stream.get("codec_name"),
+                                              "language": tags.get("language"), "title": tags.get("title")})
+            elif kind == "attachment":
+                info.attachments.append({"filename": tags.get("filename"), "mimetype": tags.get("mimetype")})
+
+        if not info.frame_count and info.fps and info.duration:
+            info.frame_count = int(round(info.duration * info.fps))
+        keyframes = [float(p["pts_time"]) for p in data.get("packets", [])
+                     if p.get("stream_index") == video_index and "K" in p.get("flags", "")
+                     and _number(p.get("pts_time")) is not None]
+        keyframes.sort()
+        if len(keyframes) >= 2:
+            info.keyframe_interval = statistics.median(b - a for a, b in zip(keyframes, keyframes[1:]))
+        return info
+
+
+def _cache_key(path):
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def _load_cache():
+    global _cache
+    if _cache is None:
+        try:
+            with open(cache_dir() / MEDIA_CACHE_FILE, "r", encoding="utf-8") as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _save_cache():
+    path = cache_dir() / MEDIA_CACHE_FILE
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_cache, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def probe_media(path, use_cache=True):
+    """
+    Inspects a media file with a single ffprobe call and returns a MediaInfo.
+
+    Results are kept on disk keyed by path, size and modification time, so a
+    file is only probed again after it changed. Raises RuntimeError when the
+    file can not be read and FileNotFoundError when ffprobe is missing. Blocks
+    for as long as ffprobe runs, do not call it from the Tk thread.
+    """
+    if not os.path.isfile(path):
+        raise RuntimeError(f"File not found: {path}")
+    key = _cache_key(path)
+    if use_cache:
+        with _cache_lock:
+            cached = _load_cache().get(key)
+        if cached is not None:
+            return MediaInfo.from_dict(cached)
+
+    cmd = [FFPROBE, "-v", "error", "-print_format", "json", "-show_format", "-show_streams",
+           "-show_entries", "packet=stream_index,pts_time,flags", "-read_intervals", f"%+{KEYFRAME_SCAN_SECONDS}",
+           path]
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr.strip() or result.returncode}")
+    try:
+        info = MediaInfo.from_ffprobe(path, json.loads(result.stdout))
+    except ValueError:
+        raise RuntimeError("ffprobe returned invalid JSON")
+
+    if use_cache:
+        with _cache_lock:
+            cache = _load_cache()
+            cache.pop(key, None)
+            cache[key] = info.to_dict()
+            while len(cache) > MEDIA_CACHE_ENTRIES:
+                cache.pop(next(iter(cache)))
+            _save_cache()
+    return info
+
+
+def get_video_duration(video_path):
+    try:
+        return probe_media(video_path).duration
+    except (OSError, RuntimeError):
+        return 0
+
+
+def get_video_bitrate(video_path):
+    try:
+        return probe_media(video_path).bitrate
+    except (OSError, RuntimeError):
+        return None
+
+
+def get_start_time(video_path):
+    cmd = [FFPROBE, "-v", "quiet", "-show_entries", "format=start_time", "-of", "default=noprint_wrappers=1:nokey=1",
+           video_path]
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return 0.0
+
+
+def get_keyframes(video_path):
+    """
+    Lists the first video stream's packets without decoding them.
+
+    Returns (keyframes, frame_times, start_time) where the times are in seconds
+    on the timeline ffmpeg uses for output, i.e. relative to the file start time.
+    """
+    cmd = [FFPROBE, "-v", "error", "-select_streams", "V:0", "-show_entries",
+           "packet=pts_time,flags:format=start_time", "-of", "csv=print_section=1", video_path]
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr.strip() or result.returncode}")
+
+    start_time = 0.0
+    keyframes, frame_times = [], []
+    for line in result.stdout.splitlines():
+        section, _, values = line.partition(",")
+        values = values.split(",")
+        if section == "packet" and len(values) >= 2 and values[0] not in ("", "N/A"):
+            pts = float(values[0])
+            frame_times.append(pts)
+            if "K" in values[1]:
+                keyframes.append(pts)
+        elif section == "format" and values[0] not in ("", "N/A"):
+            start_time = float(values[0])
+
+    frame_times.sort()
+    keyframes.sort()
+    return [t - start_time for t in keyframes], [t - start_time for t in frame_times], start_time
@@ -0,0 +1,126 @@
+import threading
+import time
+
+# Weight of the newest rate sample in the ETA, lower is smoother but slower to follow real changes
+ETA_SMOOTHING = 0.15
+# Rate samples closer together than this are merged, ffmpeg reports every 0.5 s
+ETA_MIN_INTERVAL = 1.0
+
+
+def _number(value, cast=float):
+    try:
+        return cast(value.strip().rstrip("x"))
+    except (AttributeError, ValueError):
+        return None
+
+
+class ProgressEvent:
+    """One block of `-progress` output, fields ffmpeg reports as N/A are None."""
+
+    __slots__ = ("frame", "fps", "bitrate", "total_size", "out_time", "speed", "finished")
+
+    def __init__(self, values):
+        self.frame = _number(values.get("frame"), int)
+        self.fps = _number(values.get("fps"))
+        # kbit/s
+        self.bitrate = _number(values.get("bitrate", "").replace("kbits/s", ""))
+        self.total_size = _number(values.get("total_size"), int)
+        # out_time_us is the correct field, out_time_ms has the same value for historical reasons
+        out_time = _number(values.get("out_time_us") or values.get("out_time_ms"), int)
+        self.out_time = out_time / 1000000.0 if out_time is not None and out_time >= 0 else None
+        self.speed = _number(values.get("speed"))
+        self.finished = values.get("progress") == "end"
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def read_progress(stream, on_line=None):
+    """
+    Yields a ProgressEvent for every key=value block ffmpeg writes with
+    `-progress pipe:1`, the raw lines are passed to on_line(line) if given.
+    """
+    values = {}
+    for line in iter(stream.readline, ''):
+        if on_line: on_line(line.rstrip("\r\n"))
+        key, sep, value = line.partition("=")
+        if not sep:
+            continue
+        key = key.strip()
+        values[key] = value.strip()
+        if key == "progress":
+            yield ProgressEvent(values)
+            values = {}
+
+
+def pump_lines(stream, callback):
+    """Passes every line of `stream` to `callback` from a daemon thread, returns the thread."""
+
+    def pump():
+        for line in iter(stream.readline, ''):
+            callback(line.rstrip("\r\n"))
+
+    thread = threading.Thread(target=pump, daemon=True)
+    thread.start()
+    return thread
+
+
+def progress_state(job):
+    """What the UI shows of a job's progress: tenths of a percent and whole seconds of ETA."""
+    return int(job.progress * 1000), None if job.eta is None else int(job.eta)
+
+
+def notify_on_change(callback, key=progress_state):
+    """Wraps callback(job) so that it only runs when key(job) differs from the previous call."""
+    last = [None]
+
+    def notify(job):
+        state = key(job)
+        if callback and state != last[0]:
+            last[0] = state
+            callback(job)
+
+    return notify
+
+
+class EtaEstimator:
+    """
+    Remaining time from an exponentially smoothed processing rate.
+
+    `done` and `total` can be in any unit, frames for a single encode or a
+    0..1 fraction for a whole queue. The rate is measured over intervals of
+    at least ETA_MIN_INTERVAL, so the estimate does not jump with every scene
+    that is a little harder to encode. Until the rate is measured, the
+    remaining share of `expected` seconds is returned, e.g. the time
+    foxbaker.history predicted for the job.
+    """
+
+    def __init__(self, smoothing=ETA_SMOOTHING, min_interval=ETA_MIN_INTERVAL, expected=None):
+        self.smoothing = smoothing
+        self.min_interval = min_interval
+        self.expected = expected
+        self.reset()
+
+    def reset(self):
+        self.rate = None
+        self._last = None
+
+    def update(self, done, total, now=None):
+        now = time.monotonic() if now is None else now
+        if self._last is None or done < self._last[1]:
+            self._last = (now, done)
+        else:
+            last_time, last_done = self._last
+            elapsed = now - last_time
+            if elapsed >= self.min_interval:
+                rate = (done - last_done) / elapsed
+                self.rate = rate if self.rate is None else self.smoothing * rate + (1 - self.smoothing) * self.rate
+                self._last = (now, done)
+        return self.remaining(done, total)
+
+    def remaining(self, done, total):
+        if not total:
+            return None
+        if not self.rate or self.rate <= 0:
+            return self.expected * max(0.0, 1 - done / total) if self.expected else None
+        return max(0.0, (total - done) / self.rate)
@@ -0,0 +1,561 @@
+import argparse
+import hmac
+import http.client
+import ipaddress
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from foxbaker.encode import run_job
+from foxbaker.fonts import attached_font, check_fonts
+from foxbaker.jobs import FINISHED_STATES, QUEUED, Job, JobQueue, Rendition, Scheduler
+from foxbaker.normalize import normalize_subtitles
+
+# "host:port,host:port" of the workers the GUI and the CLI send their jobs to
+WORKERS = [w.strip() for w in os.environ.get("FOXBAKER_WORKERS", "").split(",") if w.strip()]
+# Shared secret, workers started with a token only accept requests that carry it
+TOKEN = os.environ.get("FOXBAKER_WORKER_TOKEN")
+TOKEN_HEADER = "X-FOXBaker-Token"
+DEFAULT_PORT = 8765
+CHUNK_SIZE = 1024 * 1024
+# The worker sends a ping this often while nothing else happens, so a dead worker is noticed
+HEARTBEAT_SECONDS = 2
+STREAM_TIMEOUT = 30
+STATUS_TIMEOUT = 3
+# A worker that did not answer is skipped this long
+WORKER_RETRY_SECONDS = 60
+# Finished jobs whose outputs were never fetched are removed after this long
+JOB_KEEP_SECONDS = 3600
+# Jobs a controller keeps in flight per worker, the second one uploads while the first encodes
+JOBS_PER_WORKER = 2
+# Events a worker keeps per job for its controller, a stream that falls further behind skips log lines
+EVENTS_KEPT = 1000
+# Folder next to the uploaded subtitle file the controller's fonts go to, fonts.project_font_dirs() searches it
+FONTS_FOLDER = "fonts"
+
+
+class WorkerLost(Exception):
+    """The worker stopped answering, the job can be run on another one."""
+
+
+def job_settings(job):
+    """Everything Job() was created with except the paths, sent to the worker with the files."""
+    return {"output_name": os.path.basename(job.output_path), "quality": job.quality,
+            "hw_enabled": job.hw_enabled, "hw_type": job.hw_type, "segmented": job.segmented, "smart": job.smart,
+            "deadline": job.deadline, "target_speed": job.target_speed, "preflight": job.preflight,
+            "cache": job.cache, "renditions": [[r.name, r.quality] for r in job.renditions]}
+
+
+def job_from_settings(settings, video_path, subtitle_path, work_dir):
+    renditions = [Rendition(os.path.join(work_dir, f"{i}_{os.path.basename(name)}"), quality)
+                  for i, (name, quality) in enumerate(settings["renditions"])]
+    output_path = os.path.join(work_dir, "out_" + os.path.basename(settings["output_name"]))
+    return Job(video_path, subtitle_path, output_path, quality=settings["quality"],
+               hw_enabled=settings["hw_enabled"], hw_type=settings["hw_type"], segmented=settings["segmented"],
+               renditions=renditions, smart=settings["smart"], deadline=settings["deadline"],
+               target_speed=settings["target_speed"], preflight=settings["preflight"],
+               cache=settings.get("cache", False))
+
+
+class RemoteJob:
+    """A job on the worker with the events recorded for the controller."""
+
+    def __init__(self, settings, work_dir):
+        self.id = uuid.uuid4().hex
+        self.settings = settings
+        self.work_dir = work_dir
+        self.job = None
+        # The last EVENTS_KEPT events, `added` counts all of them so streams know where they are
+        self.events = deque(maxlen=EVENTS_KEPT)
+        self.added = 0
+        self.finished_at = None
+        self.cond = threading.Condition()
+
+    def add_event(self, event, **fields):
+        with self.cond:
+            self.events.append({"event": event, **fields})
+            self.added += 1
+            self.cond.notify_all()
+
+    def events_after(self, sent):
+        """The events after the first `sent` still kept and the count to continue from. Call with cond held."""
+        skip = max(0, len(self.events) - (self.added - sent))
+        return list(self.events)[skip:], self.added
+
+    def outputs(self):
+        job = self.job
+        return [r.output_path for r in job.renditions] or [job.output_path]
+
+
+class WorkerServer(ThreadingHTTPServer):
+    """
+    Runs the jobs sent by controllers with the same job code and scheduler
+    as the GUI. Each job lives in its own temporary directory until the
+    controller fetched the outputs and deleted it.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, token=None, max_jobs=None):
+        super().__init__(address, WorkerHandler)
+        self.token = token
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = JobQueue()
+        self.scheduler = Scheduler(self.queue, self.run, max_jobs=max_jobs, on_change=self.on_change)
+        self.remote_jobs = {}
+
+    def run(self, job):
+        remote = self.remote_jobs[job.id]
+
+        def on_progress(job):
+            remote.add_event("progress", progress=round(job.progress, 4), speed=job.speed, fps=job.fps, eta=job.eta,
+                             outputs=[round(r.progress, 4) for r in job.renditions])
+
+        def on_speed(job, speed):
+            self.scheduler.report_speed(job, speed)
+
+        return run_job(job, on_log=lambda line: remote.add_event("log", line=line), on_progress=on_progress,
+                       on_speed=on_speed)
+
+    def on_change(self, job):
+        if job.status not in FINISHED_STATES:
+            return
+        remote = self.remote_jobs.pop(job.id, None)
+        if remote is None:
+            # delete() gave up waiting for the job and removed it already
+            return
+        remote.finished_at = time.time()
+        remote.add_event("done", status=job.status, returncode=job.returncode, error=job.error)
+        self.queue.clear_finished()
+
+    def create(self, settings):
+        self.expire()
+        remote = RemoteJob(settings, tempfile.mkdtemp(prefix="foxbaker_worker_"))
+        with self.lock:
+            self.jobs[remote.id] = remote
+        return remote
+
+    def start_job(self, remote, video_name, subtitle_name):
+        remote.job = job_from_settings(remote.settings, os.path.join(remote.work_dir, video_name),
+                                       os.path.join(remote.work_dir, subtitle_name), remote.work_dir)
+        self.remote_jobs[remote.job.id] = remote
+        self.queue.add(remote.job)
+        self.scheduler.start()
+
+    def delete(self, remote):
+        with self.lock:
+            self.jobs.pop(remote.id, None)
+        if remote.job is not None and remote.finished_at is None:
+            self.queue.cancel(remote.job.id)
+            # The work directory goes once ffmpeg let go of the files. A job cancelled in the queue never started
+            with remote.cond:
+                remote.cond.wait_for(lambda: remote.finished_at is not None or not remote.job.start_time, timeout=30)
+            self.remote_jobs.pop(remote.job.id, None)
+        shutil.rmtree(remote.work_dir, ignore_errors=True)
+
+    def expire(self):
+        with self.lock:
+            old = [r for r in self.jobs.values() if r.finished_at and time.time() - r.finished_at > JOB_KEEP_SECONDS]
+        for remote in old:
+            self.delete(remote)
+
+    def status(self):
+        # Jobs still uploading count as well, they are about to be queued
+        with self.lock:
+            jobs = sum(1 for remote in self.jobs.values() if remote.finished_at is None)
+        queued = sum(1 for job in self.queue.pending() if job.status == QUEUED)
+        return {"jobs": jobs, "queued": queued,
+                "cpus": self.scheduler.cpu_count, "slots": self.scheduler.slots}
+
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    """
+    GET /status, POST /jobs with the settings, PUT /jobs/<id>/files/<name>
+    with the video and the subtitle file, PUT /jobs/<id>/fonts/<name> with
+    the fonts the controller resolved, POST /jobs/<id>/start, then
+    GET /jobs/<id>/events for a JSON line per event until "done",
+    GET /jobs/<id>/outputs/<n> for the results and DELETE /jobs/<id>.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, code=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code, message):
+        self._send_json({"error": message}, code)
+
+    def _route(self):
+        """(remote job or None, remaining path parts), None when the request was answered with an error."""
+        if self.server.token and not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), self.server.token):
+            self._error(401, "Invalid worker token")
+            return None
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if len(parts) >= 2 and parts[0] == "jobs":
+            with self.server.lock:
+                remote = self.server.jobs.get(parts[1])
+            if remote is None:
+                self._error(404, "Unknown job")
+                return None
+            return remote, parts[2:]
+        return None, parts
+
+    def do_GET(self):
+        route = self._route()
+        if route is None:
+            return
+        remote, parts = route
+        if remote is None and parts == ["status"]:
+            self._send_json(self.server.status())
+        elif remote is not None and parts == ["events"]:
+            self._stream_events(remote)
+        elif remote is not None and len(parts) == 2 and parts[0] == "outputs" and parts[1].isdigit():
+            outputs = remote.outputs() if remote.job else []
+            index = int(parts[1])
+            if index >= len(outputs) or not os.path.isfile(outputs[index]):
+                self._error(404, "No such output")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.path.getsize(outputs[index])))
+            self.end_headers()
+            with open(outputs[index], "rb") as f:
+                shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+        else:
+            self._error(404, "Not found")
+
+    def _stream_events(self, remote):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        sent = 0
+        try:
+            while True:
+                with remote.cond:
+                    remote.cond.wait_for(lambda: remote.added > sent, timeout=HEARTBEAT_SECONDS)
+                    events, sent = remote.events_after(sent)
+                for event in events or [{"event": "ping"}]:
+                    self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+                self.wfile.flush()
+                if events and events[-1]["event"] == "done":
+                    return
+        except OSError:
+            # The controller is gone, nobody will fetch the result
+            self.server.delete(remote)
+
+    def do_POST(self):
+        route = self._route()
+        if route is None:
+            return
+        remote, parts = route
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            self._error(400, "Invalid JSON")
+            return
+        if remote is None and parts == ["jobs"] and "settings" in body:
+            remote = self.server.create(body["settings"])
+            self._send_json({"id": remote.id}, 201)
+        elif remote is not None and parts == ["start"]:
+            names = [os.path.basename(body.get(key) or "") for key in ("video", "subtitle")]
+            if not all(names) or not all(os.path.isfile(os.path.join(remote.work_dir, n)) for n in names):
+                self._error(400, "Upload the video and the subtitle file first")
+                return
+            self.server.start_job(remote, *names)
+            self._send_json({"id": remote.id})
+        else:
+            self._error(404, "Not found")
+
+    def do_PUT(self):
+        route = self._route()
+        if route is None:
+            return
+        remote, parts = route
+        if remote is None or len(parts) != 2 or parts[0] not in ("files", "fonts"):
+            self._error(404, "Not found")
+            return
+        directory = remote.work_dir if parts[0] == "files" else os.path.join(remote.work_dir, FONTS_FOLDER)
+        os.makedirs(directory, exist_ok=True)
+        left = int(self.headers.get("Content-Length", 0))
+        with open(os.path.join(directory, os.path.basename(parts[1])), "wb") as f:
+            while left > 0:
+                data = self.rfile.read(min(CHUNK_SIZE, left))
+                if not data:
+                    break
+                f.write(data)
+                left -= len(data)
+        if left:
+            self._error(400, "Upload incomplete")
+            return
+        self._send_json({})
+
+    def do_DELETE(self):
+        route = self._route()
+        if route is None:
+            return
+        remote, parts = route
+        if remote is None or parts:
+            self._error(404, "Not found")
+            return
+        self.server.delete(remote)
+        self._send_json({})
+
+
+class WorkerPool:
+    """The workers a controller sends its jobs to, see run_remote()."""
+
+    def __init__(self, addresses, token=None):
+        self.addresses = [a if "://" in a else "http://" + a for a in addresses]
+        self.token = token if token is not None else TOKEN
+        self._down = {}
+        # Jobs picked for a worker that it has not registered yet
+        self._assigned = {}
+        self._lock = threading.Lock()
+        # Jobs starting at the same time must see each other's choice
+        self._pick_lock = threading.Lock()
+
+    def request(self, address, method, path, data=None, headers=None, timeout=STREAM_TIMEOUT):
+        headers = dict(headers or {})
+        if isinstance(data, dict):
+            data = json.dumps(data).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        request = urllib.request.Request(address + path, data=data, headers=headers, method=method)
+        try:
+            return urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error")
+            except ValueError:
+                message = None
+            raise RuntimeError(f"{address}: {message or e}")
+        except (OSError, http.client.HTTPException) as e:
+            raise WorkerLost(f"{address}: {e}")
+
+    def status(self, address):
+        with self.request(address, "GET", "/status", timeout=STATUS_TIMEOUT) as response:
+            return json.loads(response.read())
+
+    def mark_down(self, address):
+        with self._lock:
+            self._down[address] = time.monotonic()
+
+    def pick(self, exclude=()):
+        """
+        Address of the least loaded worker: running and queued jobs per CPU,
+        counting the jobs other threads just picked it for. Raises
+        RuntimeError when no worker answers.
+        """
+        with self._pick_lock:
+            return self._pick(exclude)
+
+    def _pick(self, exclude):
+        best = None
+        errors = []
+        for address in self.addresses:
+            with self._lock:
+                down = self._down.get(address)
+            if address in exclude or (down is not None and time.monotonic() - down < WORKER_RETRY_SECONDS):
+                continue
+            try:
+                status = self.status(address)
+            except (WorkerLost, RuntimeError, ValueError) as e:
+                errors.append(str(e))
+                self.mark_down(address)
+                continue
+            with self._lock:
+                load = (status["jobs"] + self._assigned.get(address, 0)) / max(1, status["cpus"])
+            if best is None or load < best[0]:
+                best = (load, address)
+        if best is None:
+            raise RuntimeError("No worker available" + (": " + "; ".join(errors) if errors else ""))
+        with self._lock:
+            self._assigned[best[1]] = self._assigned.get(best[1], 0) + 1
+        return best[1]
+
+    def release(self, address):
+        with self._lock:
+            self._assigned[address] = max(0, self._assigned.get(address, 0) - 1)
+
+
+def job_fonts(job, log):
+    """
+    The font files the job's script resolves to here. The worker has neither
+    the folders next to the subtitle file nor FOXBAKER_FONT_DIRS, so they go
+    along with the job. Fonts attached to the video travel inside it.
+    """
+    try:
+        report = check_fonts(job.video_path, normalize_subtitles(job.subtitle_path), origin_path=job.subtitle_path)
+    except (OSError, RuntimeError, UnicodeError) as e:
+        log(f"Fonts could not be resolved, the worker looks them up itself: {e}")
+        return []
+    return sorted({path for files in report.resolved.values() for path in files if not attached_font(path)})
+
+
+def _upload(pool, address, job_id, path, folder="files", name=None):
+    with open(path, "rb") as f:
+        pool.request(address, "PUT", f"/jobs/{job_id}/{folder}/{name or os.path.basename(path)}", data=f,
+                     headers={"Content-Length": str(os.path.getsize(path))}).close()
+
+
+def _download(pool, address, job_id, index, path):
+    tmp = f"{path}.{os.getpid()}.download"
+    try:
+        with pool.request(address, "GET", f"/jobs/{job_id}/outputs/{index}") as response, open(tmp, "wb") as f:
+            shutil.copyfileobj(response, f, CHUNK_SIZE)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _run_on(pool, address, job, fonts, log, on_progress, on_speed):
+    try:
+        with pool.request(address, "POST", "/jobs", {"settings": job_settings(job)}) as response:
+            job_id = json.loads(response.read())["id"]
+    finally:
+        pool.release(address)
+    try:
+        _upload(pool, address, job_id, job.video_path)
+        _upload(pool, address, job_id, job.subtitle_path)
+        # Numbered, families from different folders may use the same file names
+        for i, path in enumerate(fonts):
+            _upload(pool, address, job_id, path, FONTS_FOLDER, f"{i:03d}_{os.path.basename(path)}")
+        pool.request(address, "POST", f"/jobs/{job_id}/start",
+                     {"video": os.path.basename(job.video_path),
+                      "subtitle": os.path.basename(job.subtitle_path)}).close()
+        done = None
+        with pool.request(address, "GET", f"/jobs/{job_id}/events") as response:
+            for line in response:
+                if job.cancelled:
+                    return -1
+                event = json.loads(line)
+                if event["event"] == "log":
+                    log(event["line"])
+                elif event["event"] == "progress":
+                    job.progress, job.fps, job.eta = event["progress"], event["fps"], event["eta"]
+                    for rendition, progress in zip(job.renditions, event["outputs"]):
+                        rendition.progress = progress
+                    if event["speed"]:
+                        job.speed = event["speed"]
+                        if on_speed: on_speed(job, event["speed"])
+                    if on_progress: on_progress(job)
+                elif event["event"] == "done":
+                    done = event
+                    break
+        if done is None:
+            raise WorkerLost(f"{address}: the event stream ended before the job finished")
+        if done["error"]:
+            raise RuntimeError(f"{address}: {done['error']}")
+        if done["returncode"] == 0:
+            for index, output in enumerate([r.output_path for r in job.renditions] or [job.output_path]):
+                _download(pool, address, job_id, index, output)
+        return done["returncode"]
+    except (ValueError, KeyError) as e:
+        raise WorkerLost(f"{address}: invalid answer: {e}")
+    finally:
+        try:
+            pool.request(address, "DELETE", f"/jobs/{job_id}", timeout=STATUS_TIMEOUT).close()
+        except (WorkerLost, RuntimeError):
+            pass
+
+
+def run_remote(job, pool, on_log=None, on_progress=None, on_speed=None):
+    """
+    run_job() on the least loaded worker of `pool`: the video and the subtitle
+    file are uploaded, progress and the ffmpeg output come back as they happen
+    and the outputs are downloaded to the job's output paths. When a worker
+    stops answering, the job starts over on another one. Raises RuntimeError
+    when no worker is left or the job failed on the worker with an exception.
+    Soft-subtitle jobs run here, uploading the video takes longer than the mux.
+    """
+    if job.mux:
+        return run_job(job, on_log=on_log, on_progress=on_progress, on_speed=on_speed)
+    log = on_log or (lambda message: None)
+    fonts = job_fonts(job, log)
+    if fonts:
+        log(f"Fonts: uploading {len(fonts)} font files with the job")
+    tried = set()
+    while True:
+        address = pool.pick(exclude=tried)
+        log(f"Encoding on worker {address}")
+        try:
+            return _run_on(pool, address, job, fonts, log, on_progress, on_speed)
+        except WorkerLost as e:
+            if job.cancelled:
+                return -1
+            log(f"Worker lost, trying another one: {e}")
+            pool.mark_down(address)
+            tried.add(address)
+            job.progress = 0.0
+            job.eta = None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="foxbaker.remote", description="Encode FOXBaker jobs for other machines.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run a worker")
+    serve.add_argument("--host", default="127.0.0.1",
+                       help="address to listen on, other machines can only connect when this is not a loopback "
+                            "address, which needs --token")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("-j", "--jobs", type=int, default=0,
+                       help="encodes at the same time, 0 tunes it from the measured throughput")
+    serve.add_argument("--token", default=TOKEN, help="only accept requests with this token, "
+                                                      "defaults to FOXBAKER_WORKER_TOKEN")
+    status = commands.add_parser("status", help="print the load of workers")
+    status.add_argument("workers", nargs="*", default=WORKERS, metavar="HOST:PORT")
+    return parser
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "status":
+        pool = WorkerPool(args.workers)
+        for address in pool.addresses:
+            try:
+                print(json.dumps({"worker": address, **pool.status(address)}))
+            except (WorkerLost, RuntimeError, ValueError) as e:
+                print(json.dumps({"worker": address, "error": str(e)}))
+        return 0
+    # Anyone who can reach the worker can run ffmpeg on it
+    if not args.token and not is_loopback(args.host):
+        print(f"foxbaker.remote: listening on {args.host} needs --token or FOXBAKER_WORKER_TOKEN", file=sys.stderr)
+        return 2
+    server = WorkerServer((args.host, args.port), token=args.token, max_jobs=args.jobs or None)
+    print(json.dumps({"event": "listening", "host": args.host, "port": server.server_address[1]}), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.queue.cancel_all()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+
+from foxbaker.encode import (BITRATE_OPTIONS, FFMPEG, audio_codec_args, format_command, job_encoder, probe_job,
+                             run_process, source_audio_codecs, video_codec_args)
+from foxbaker.encoders import encoder_pix_fmts
+from foxbaker.filtergraph import filter_thread_args, plan_split, source_pix_fmt, source_size
+from foxbaker.metrics import stage
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.progress import EtaEstimator, notify_on_change, progress_state
+
+
+class _StatsTail:
+    """Follows the file one output's -stats_enc_post writes, one line per encoded frame."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._rest = ""
+
+    def frames(self):
+        """Number of frames encoded so far, None if nothing new was written."""
+        if self._file is None:
+            if not os.path.exists(self.path):
+                return None
+            self._file = open(self.path, "r", encoding="utf-8", errors="replace")
+        data = self._rest + self._file.read()
+        lines = data.split("\n")
+        self._rest = lines.pop()
+        for line in reversed(lines):
+            if line.strip().isdigit():
+                return int(line) + 1
+        return None
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def plan_renditions(job, subtitle_path):
+    return plan_split([rendition.quality for rendition in job.renditions], subtitle_path,
+                      source_size(job.video_path), job.threads, job.fontsdir, source_pix_fmt(job.video_path),
+                      [encoder_pix_fmts(job_encoder(job, r.output_format).name) for r in job.renditions])
+
+
+def build_renditions_command(job, subtitle_path, original_bitrate=None, stats_paths=None, input_args=(),
+                             null_output=False):
+    """
+    One ffmpeg that burns the subtitles and `split`s the frames into one
+    encoder per rendition. Every output gets its own scaling, codec and
+    bitrate from the same tables a single encode uses, plan_renditions()
+    decides whether the subtitles are rendered once or once per output size.
+    With `null_output` nothing is written, for trial encodes.
+    """
+    count = len(job.renditions)
+    graph = plan_renditions(job, subtitle_path).graph
+    # Every encoder gets its share of the threads, the filter graph is shared
+    threads = max(1, job.threads // count) if job.threads else None
+
+    cmd = [FFMPEG, "-nostdin", "-nostats"]
+    cmd.extend(filter_thread_args(job.threads, complex_graph=True))
+    cmd.extend(input_args)
+    cmd.extend(["-i", job.video_path, "-filter_complex", ";".join(graph), "-progress", "pipe:1"])
+    for i, rendition in enumerate(job.renditions):
+        cmd.extend(["-map", f"[v{i}]", "-map", "0:a:0?"])
+        cmd.extend(video_codec_args(job, original_bitrate, threads=threads, quality=rendition.quality,
+                                    output_format=rendition.output_format))
+        cmd.extend(audio_codec_args(rendition.output_format, source_audio_codecs(job.video_path)))
+        if stats_paths:
+            cmd.extend(["-stats_enc_post", stats_paths[i], "-stats_enc_post_fmt", "{n}"])
+        cmd.extend(["-f", "null", "-"] if null_output else ["-y", rendition.output_path])
+    return cmd
+
+
+def run_renditions(job, on_log=None, on_progress=None, on_speed=None):
+    """
+    Encodes all of job.renditions in a single ffmpeg process and returns its
+    exit code. Each rendition's progress comes from the encoder statistics of
+    its own output, job.progress follows the slowest one.
+    """
+    log = on_log or (lambda message: None)
+    notify = notify_on_change(on_progress, key=lambda job: progress_state(job) + tuple(
+        int(rendition.progress * 1000) for rendition in job.renditions))
+    eta = EtaEstimator(expected=job.expected_seconds)
+    if job.segmented:
+        log("Segmented encoding is not used for multi-output jobs")
+
+    work_dir = tempfile.mkdtemp(prefix="foxbaker_multi_")
+    tails = []
+    try:
+        info = probe_job(job)
+        original_bitrate = None
+        if info and any(BITRATE_OPTIONS.get(r.quality, 0) == 0 for r in job.renditions):
+            original_bitrate = info.bitrate
+
+        with stage(job, "normalize"):
+            subtitle_path = normalize_subtitles(job.subtitle_path)
+        stats_paths = [os.path.join(work_dir, f"output_{i}.txt") for i in range(len(job.renditions))]
+        tails = [_StatsTail(path) for path in stats_paths]
+        cmd = build_renditions_command(job, subtitle_path, original_bitrate, stats_paths)
+        log("Filter graph: " + plan_renditions(job, subtitle_path).describe())
+        log("Command: " + format_command(cmd))
+
+        def on_event(event):
+            job.fps = event.fps
+            if event.speed is not None:
+                job.speed = event.speed
+                if on_speed: on_speed(job, event.speed)
+            for rendition, tail in zip(job.renditions, tails):
+                frames = tail.frames()
+                if frames is not None:
+                    rendition.frames_done = frames
+                if job.total_frames:
+                    rendition.progress = min(rendition.frames_done / job.total_frames, 1.0)
+                elif event.out_time is not None and job.total_duration > 0:
+                    rendition.progress = min(event.out_time / job.total_duration, 1.0)
+            job.progress = min(rendition.progress for rendition in job.renditions)
+            job.eta = eta.update(job.progress, 1.0)
+            notify(job)
+
+        rc = run_process(job, cmd, on_log=log, on_event=on_event)
+        if rc == 0:
+            for rendition in job.renditions:
+                rendition.progress = 1.0
+        return rc
+    finally:
+        for tail in tails:
+            tail.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
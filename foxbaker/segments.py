@@ -0,0 +1,244 @@
+import bisect
+import os
+import shutil
+import tempfile
+import threading
+from fractions import Fraction
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from foxbaker.encode import (BITRATE_OPTIONS, FFMPEG, audio_codec_args, build_video_filter, filter_thread_args,
+                             format_command, plan_video_filter, probe_job, run_process, source_audio_codecs,
+                             video_codec_args)
+from foxbaker.jobs import HARDWARE_MAX_JOBS, terminate
+from foxbaker.metrics import stage
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.probe import get_keyframes, get_start_time
+from foxbaker.progress import EtaEstimator, notify_on_change
+from foxbaker.subtitles import load_subtitles
+
+# Shorter chunks cost more in seeking and encoder warm-up than they win in balance
+MIN_CHUNK_SECONDS = 20
+THREADS_PER_CHUNK = 4
+CHUNKS_PER_WORKER = 3
+# Containers for which ffmpeg converts the output to constant frame rate by default
+CFR_FORMATS = ("mp4", "mov")
+
+
+class Chunk:
+    def __init__(self, index, start, end, frames):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.frames = frames
+        self.frames_done = 0
+        self.fps = None
+        self.speed = 0.0
+        self.path = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+def plan_chunks(keyframes, frame_times, count):
+    """Splits the frame list at the keyframes nearest to `count` equal parts."""
+    first, last = frame_times[0], frame_times[-1]
+    frame_duration = (last - first) / max(1, len(frame_times) - 1)
+    end_time = last + frame_duration
+    boundaries = [first]
+    for i in range(1, count):
+        target = first + (end_time - first) * i / count
+        pos = bisect.bisect_left(keyframes, target)
+        candidates = keyframes[max(0, pos - 1):pos + 1]
+        if not candidates:
+            continue
+        kf = min(candidates, key=lambda t: abs(t - target))
+        if kf - boundaries[-1] >= MIN_CHUNK_SECONDS / 2 and end_time - kf >= MIN_CHUNK_SECONDS / 2:
+            boundaries.append(kf)
+    boundaries.append(end_time)
+
+    chunks = []
+    for i in range(len(boundaries) - 1):
+        start, end = boundaries[i], boundaries[i + 1]
+        frames = bisect.bisect_left(frame_times, end) - bisect.bisect_left(frame_times, start)
+        chunks.append(Chunk(i, start, end, frames))
+    return chunks, frame_duration
+
+
+def _concat_entry(path):
+    return "file '" + Path(path).as_posix().replace("'", "'\\''") + "'"
+
+
+def chunk_command(job, chunk, sub_path, offset, codec_args, frame_duration, start_time, frame_rate, last,
+                  threads=None):
+    """
+    ffmpeg command that encodes one chunk with its own subtitle window, see
+    SubtitleFile.write_window() for `offset`.
+
+    Later chunks keep the source timestamps (-copyts), so the frames leave the
+    graph on the same timeline as in a single pass and ffmpeg's frame rate
+    conversion makes the same decisions. For constant frame rate outputs
+    -copyts also selects the "vscfr" mode, which does not duplicate frames to
+    fill the time before the first one.
+    """
+    # Seek a little before the keyframe so rounding of the printed timestamp can not drop it
+    seek = max(0.0, chunk.start - frame_duration / 2) if chunk.index else 0.0
+    input_offset = start_time if chunk.index else 0.0
+    threads = threads or job.threads
+    vf = build_video_filter(job, sub_path, threads)
+    if offset:
+        vf += f",setpts=PTS+{offset:.6f}/TB"
+    if abs(input_offset + offset) > 1e-6:
+        vf = f"setpts=PTS{-(input_offset + offset):+.6f}/TB," + vf
+    if not last:
+        vf += f",trim=end={chunk.end - frame_duration / 2:.6f}"
+
+    cmd = [FFMPEG, "-nostdin", "-nostats"]
+    cmd.extend(filter_thread_args(threads))
+    if chunk.index:
+        cmd.extend(["-copyts", "-ss", f"{seek:.6f}"])
+    if not last:
+        cmd.extend(["-t", f"{chunk.end - seek + 1:.6f}"])
+    cmd.extend(["-i", job.video_path, "-map", "0:V:0", "-vf", vf])
+    cmd.extend(codec_args)
+    if chunk.index and frame_rate:
+        # setpts drops the frame rate, without it the encoder would assume 25 fps
+        cmd.extend(["-r", frame_rate])
+    cmd.extend(["-an", "-sn"])
+    cmd.extend(["-progress", "pipe:1", "-y", chunk.path])
+    return cmd
+
+
+def concat_chunks(job, chunks, work_dir, frame_rate, log):
+    """Joins the chunk files into job.output_path with the source audio, returns ffmpeg's exit code."""
+    # The concat demuxer starts every file where the previous one ended, give it the exact
+    # positions instead so rounding in the chunk durations can not accumulate. Thanks to
+    # -copyts every chunk already starts where a single pass would put its first frame, only
+    # constant frame rate outputs need the start moved onto their frame grid.
+    positions = [get_start_time(chunk.path) for chunk in chunks]
+    if job.output_format in CFR_FORMATS and frame_rate:
+        fps = Fraction(frame_rate)
+        positions = [float(round(position * fps) / fps) for position in positions]
+    list_path = os.path.join(work_dir, "chunks.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.write("ffconcat version 1.0\n")
+        for i, chunk in enumerate(chunks):
+            f.write(_concat_entry(chunk.path) + "\n")
+            if i + 1 < len(chunks):
+                f.write(f"duration {positions[i + 1] - positions[i]:.6f}\n")
+
+    cmd = [FFMPEG, "-nostdin", "-nostats"]
+    if positions[0] > 0:
+        # Keep the original video delay relative to the audio
+        cmd.extend(["-itsoffset", f"{positions[0]:.6f}"])
+    cmd.extend(["-f", "concat", "-safe", "0", "-i", list_path, "-i", job.video_path,
+                "-map", "0:v", "-map", "1:a:0?", "-c:v", "copy"])
+    cmd.extend(audio_codec_args(job.output_format, source_audio_codecs(job.video_path)))
+    cmd.extend(["-y", job.output_path])
+    log("Concat: " + format_command(cmd))
+    with stage(job, "concat"):
+        return run_process(job, cmd, on_log=log)
+
+
+def run_segmented(job, on_log=None, on_progress=None, on_speed=None):
+    """
+    Encodes keyframe-aligned chunks of the video in parallel processes and
+    joins them without re-encoding, audio is stream-copied once from the source.
+
+    Every chunk gets its own subtitle file containing only the events visible
+    in it, so each ffmpeg only parses and renders its part of the script.
+    """
+    log = on_log or (lambda message: None)
+    notify = notify_on_change(on_progress)
+    eta = EtaEstimator(expected=job.expected_seconds)
+    info = probe_job(job)
+    frame_rate = info.frame_rate if info else None
+
+    keyframes, frame_times, start_time = get_keyframes(job.video_path)
+    if not frame_times or not keyframes:
+        raise RuntimeError("Could not read the keyframe list of the video")
+
+    total_threads = job.threads or os.cpu_count() or 1
+    workers = max(1, total_threads // THREADS_PER_CHUNK)
+    if job.hw_enabled:
+        workers = min(workers, HARDWARE_MAX_JOBS)
+    span = frame_times[-1] - frame_times[0]
+    count = max(1, min(workers * CHUNKS_PER_WORKER, int(span // MIN_CHUNK_SECONDS)))
+    chunks, frame_duration = plan_chunks(keyframes, frame_times, count)
+    workers = min(workers, len(chunks))
+    threads = max(1, total_threads // workers)
+    log(f"Segmented encode: {len(chunks)} chunks, {workers} parallel processes, {threads} threads each")
+
+    original_bitrate = None
+    if info and BITRATE_OPTIONS.get(job.quality, 0) == 0:
+        original_bitrate = info.bitrate
+    job.total_frames = len(frame_times)
+
+    work_dir = tempfile.mkdtemp(prefix="foxbaker_seg_")
+    lock = threading.Lock()
+    failed = threading.Event()
+    try:
+        with stage(job, "normalize"):
+            subtitle_path = normalize_subtitles(job.subtitle_path)
+        log("Filter graph: " + plan_video_filter(job, subtitle_path, threads).describe())
+        subtitles = load_subtitles(subtitle_path)
+        suffix = Path(subtitle_path).suffix or ".ass"
+
+        def report():
+            frames_done = sum(min(chunk.frames_done, chunk.frames) for chunk in chunks)
+            job.progress = min(frames_done / job.total_frames, 1.0)
+            job.eta = eta.update(frames_done, job.total_frames)
+            job.speed = sum(chunk.speed for chunk in chunks)
+            job.fps = sum(chunk.fps or 0 for chunk in chunks)
+            notify(job)
+            if on_speed and job.speed > 0: on_speed(job, job.speed)
+
+        def encode_chunk(chunk):
+            if failed.is_set() or job.cancelled:
+                return None
+            sub_path = os.path.join(work_dir, f"chunk_{chunk.index:04d}{suffix}")
+            offset = subtitles.write_window(sub_path, chunk.start, chunk.end)
+            chunk.path = os.path.join(work_dir, f"chunk_{chunk.index:04d}.{job.output_format or 'mp4'}")
+            cmd = chunk_command(job, chunk, sub_path, offset, video_codec_args(job, original_bitrate, threads=threads),
+                                frame_duration, start_time, frame_rate, last=chunk.index == len(chunks) - 1,
+                                threads=threads)
+            log(f"Chunk {chunk.index}: " + format_command(cmd))
+
+            def on_event(event):
+                if failed.is_set():
+                    for process in list(job.processes):
+                        terminate(process)
+                with lock:
+                    if event.speed is not None:
+                        chunk.speed = event.speed
+                    chunk.fps = event.fps
+                    if event.frame is not None:
+                        chunk.frames_done = event.frame
+                    report()
+
+            rc = run_process(job, cmd, on_log=lambda line: log(f"Chunk {chunk.index}: {line}"), on_event=on_event)
+            with lock:
+                chunk.speed = 0.0
+                chunk.fps = None
+                if rc == 0:
+                    chunk.frames_done = chunk.frames
+                    report()
+            if rc != 0:
+                failed.set()
+                for process in list(job.processes):
+                    terminate(process)
+            return rc
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(encode_chunk, chunks))
+
+        if job.cancelled:
+            return -1
+        for rc in results:
+            if rc is None or rc != 0:
+                log("Segmented encode failed, see chunk output above")
+                return rc if rc else 1
+        return concat_chunks(job, chunks, work_dir, frame_rate, log)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,310 @@
+import bisect
+import itertools
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from foxbaker.encode import FFMPEG, format_command, probe_job, run_process
+from foxbaker.jobs import terminate
+from foxbaker.metrics import stage
+from foxbaker.normalize import normalize_subtitles
+from foxbaker.probe import FFPROBE, get_keyframes
+from foxbaker.progress import EtaEstimator, notify_on_change
+from foxbaker.segments import THREADS_PER_CHUNK, Chunk, chunk_command, concat_chunks
+from foxbaker.subtitles import load_subtitles
+
+# Above this share of re-encoded frames a normal encode is about as fast and has no seams
+SMART_MAX_ENCODED_SHARE = 0.6
+# x264 writes its settings as text into an SEI message of the first frame
+X264_SEI_SCAN_BYTES = 4 * 1024 * 1024
+X264_SEI_RE = re.compile(rb'x264 - core \d+[^\0]*? - options: ([^\0]*)')
+# SEI names that x264 spells differently as options, the rest only differ in _ and -
+X264_OPTION_NAMES = {"mixed_ref": "mixed-refs", "me_range": "merange", "keyint_min": "min-keyint",
+                     "ip_ratio": "ipratio", "pb_ratio": "pbratio", "decimate": "dct-decimate"}
+# Bookkeeping and threading entries of the SEI that are not options or do not change the stream
+X264_SKIP = {"analyse", "deadzone", "threads", "lookahead_threads", "sliced_threads", "rc", "cqm", "interlaced"}
+PROFILES = {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high"}
+# Override blocks and line breaks, what is left of an ASS line is drawn on screen
+ASS_HIDDEN_RE = re.compile(r'\{[^}]*\}|\\[Nnh]')
+
+
+def x264_options(path):
+    """The `name=value` settings x264 stored in the file, None for other encoders."""
+    with open(path, "rb") as f:
+        m = X264_SEI_RE.search(f.read(X264_SEI_SCAN_BYTES))
+    if not m:
+        return None
+    options = {}
+    for item in m.group(1).decode("ascii", errors="replace").split():
+        name, sep, value = item.partition("=")
+        if sep:
+            options[name] = value
+    return options
+
+
+def _stream_info(path):
+    cmd = [FFPROBE, "-v", "error", "-select_streams", "V:0", "-show_entries",
+           "stream=codec_name,profile,level,pix_fmt,field_order", "-of", "default=noprint_wrappers=1", path]
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    return dict(line.partition("=")[::2] for line in result.stdout.splitlines())
+
+
+def matched_codec_args(job, threads=None):
+    """
+    libx264 arguments that reproduce the source's H.264 parameter sets, so
+    re-encoded parts can be joined with stream-copied ones. Returns None when
+    the source can not be matched: another encoder, interlacing, custom
+    quantizer matrices or a job that scales the video.
+    """
+    if job.quality != 0 or job.output_format == "webm":
+        return None
+    stream = _stream_info(job.video_path)
+    profile = PROFILES.get(stream.get("profile"))
+    if stream.get("codec_name") != "h264" or stream.get("pix_fmt") != "yuv420p" or not profile:
+        return None
+    if stream.get("field_order") not in (None, "", "progressive", "unknown"):
+        return None
+    options = x264_options(job.video_path)
+    if not options or options.get("cqm") != "0" or options.get("interlaced") != "0" \
+            or options.get("open_gop") != "0":
+        return None
+
+    params = []
+    for name, value in options.items():
+        if name in X264_SKIP:
+            continue
+        if name == "deblock":
+            enabled, _, strength = value.partition(":")
+            params.append("no-deblock=1" if enabled == "0" else "deblock=" + strength.replace(":", ","))
+        elif name == "aq":
+            mode, _, strength = value.partition(":")
+            params.extend([f"aq-mode={mode}", f"aq-strength={strength or '1.0'}"])
+        elif name == "chroma_qp_offset":
+            # The SEI has the offset after x264 lowered it for psy optimizations, it would be lowered again
+            offset = int(value)
+            if options.get("psy") == "1":
+                psy_rd, _, psy_trellis = options.get("psy_rd", "0:0").partition(":")
+                if float(psy_rd or 0) > 0 and int(options.get("subme", 0)) >= 6:
+                    offset += 1 if float(psy_rd) < 0.25 else 2
+                if float(psy_trellis or 0) > 0 and options.get("trellis", "0") != "0":
+                    offset += 1 if float(psy_trellis) < 0.25 else 2
+            params.append(f"chroma-qp-offset={offset}")
+        else:
+            params.append(f"{X264_OPTION_NAMES.get(name, name)}={value.replace(':', ',')}")
+
+    level = int(stream.get("level") or 0)
+    args = ["-c:v", "libx264", "-profile:v", profile]
+    if level > 0:
+        args.extend(["-level", f"{level / 10:.1f}"])
+    args.extend(["-pix_fmt", "yuv420p"])
+    threads = job.threads if threads is None else threads
+    if threads:
+        args.extend(["-threads", str(threads)])
+    args.extend(["-x264-params", ":".join(params)])
+    return args
+
+
+def _extradata_hash(path):
+    cmd = [FFPROBE, "-v", "error", "-select_streams", "V:0", "-show_entries", "stream=extradata_hash",
+           "-show_data_hash", "MD5", "-of", "csv=p=0", path]
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def parameters_match(job, codec_args, work_dir, log):
+    """Encodes one frame with `codec_args` and compares its parameter sets with the source's."""
+    trial = os.path.join(work_dir, f"trial.{job.output_format or 'mp4'}")
+    cmd = [FFMPEG, "-nostdin", "-nostats", "-v", "error", "-i", job.video_path, "-map", "0:V:0", "-frames:v", "1"]
+    cmd.extend(codec_args)
+    cmd.extend(["-an", "-sn", "-y", trial])
+    log("Trial: " + format_command(cmd))
+    if run_process(job, cmd, on_log=log) != 0:
+        return False
+    expected = _extradata_hash(job.video_path)
+    return expected is not None and expected == _extradata_hash(trial)
+
+
+def subtitle_intervals(subtitles):
+    """Merged (start, end) spans in which at least one line draws something."""
+    spans = []
+    for ev in subtitles.events:
+        text = ev.fields[-1] if subtitles.kind == "ass" else "".join(ev.text)
+        if ev.end > ev.start and ASS_HIDDEN_RE.sub("", text).strip():
+            spans.append((ev.start, ev.end))
+    spans.sort()
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def plan_ranges(keyframes, frame_times, intervals):
+    """
+    Splits the video at keyframes into alternating ranges to copy and to
+    re-encode. A GOP is re-encoded when any subtitle is visible in it.
+    Returns ([(start, end, encode, frames)], frame_duration).
+    """
+    frame_duration = (frame_times[-1] - frame_times[0]) / max(1, len(frame_times) - 1)
+    end_time = frame_times[-1] + frame_duration
+    starts = [kf for kf in keyframes if kf < end_time]
+    if not starts or starts[0] > frame_times[0]:
+        starts.insert(0, frame_times[0])
+    bounds = starts + [end_time]
+    ranges = []
+    for start, end in zip(bounds, bounds[1:]):
+        # Half a frame of margin, a line that ends exactly on the keyframe is not visible behind it
+        encode = any(s < end - frame_duration / 2 and e > start + frame_duration / 2 for s, e in intervals)
+        if ranges and ranges[-1][2] == encode:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end, encode])
+    return [(start, end, encode, bisect.bisect_left(frame_times, end) - bisect.bisect_left(frame_times, start))
+            for start, end, encode in ranges], frame_duration
+
+
+def copy_ranges(job, ranges, work_dir, log):
+    """Cuts the source at the range borders in one stream-copy pass, returns the piece paths."""
+    ext = job.output_format or "mp4"
+    pattern = os.path.join(work_dir, f"copy_%04d.{ext}")
+    cmd = [FFMPEG, "-nostdin", "-nostats", "-i", job.video_path, "-map", "0:V:0", "-c", "copy", "-an", "-sn"]
+    if len(ranges) > 1:
+        # Frame numbers instead of times, the muxer sees the timestamps after copying shifted them. With
+        # closed GOPs a keyframe's position in decoding order is its position in the list of frames.
+        frames = list(itertools.accumulate(frames for *_, frames in ranges))[:-1]
+        cmd.extend(["-segment_frames", ",".join(str(n) for n in frames)])
+    # Keep the B-frame delay as negative decoding timestamps, shifting them would move the pieces off the timeline
+    cmd.extend(["-avoid_negative_ts", "disabled", "-f", "segment", "-segment_format", "matroska" if ext == "mkv" else ext, "-reset_timestamps", "0",
+                "-y", pattern])
+    log("Copy: " + format_command(cmd))
+    if run_process(job, cmd, on_log=log) != 0:
+        return None
+    paths = [pattern % i for i in range(len(ranges))]
+    return paths if all(os.path.exists(path) for path in paths) else None
+
+
+def run_smart(job, on_log=None, on_progress=None, on_speed=None):
+    """
+    Re-encodes only the GOPs that show subtitles and stream-copies the rest.
+
+    The re-encoded parts use the source's own x264 settings, checked on a
+    one-frame trial encode, so all parts share one set of parameter sets and
+    are joined without touching them again. Returns None without producing
+    anything when the source can not be matched or most of it would need
+    re-encoding anyway, the caller then encodes the job normally.
+    """
+    log = on_log or (lambda message: None)
+    notify = notify_on_change(on_progress)
+    eta = EtaEstimator(expected=job.expected_seconds)
+    info = probe_job(job)
+    frame_rate = info.frame_rate if info else None
+
+    total_threads = job.threads or os.cpu_count() or 1
+    workers = max(1, total_threads // THREADS_PER_CHUNK)
+    threads = max(1, total_threads // workers)
+    codec_args = matched_codec_args(job, threads=threads)
+    if codec_args is None:
+        log("Smart render: the video can not be matched, encoding all of it")
+        return None
+
+    keyframes, frame_times, start_time = get_keyframes(job.video_path)
+    if not frame_times or not keyframes:
+        log("Smart render: could not read the keyframe list, encoding all of it")
+        return None
+    with stage(job, "normalize"):
+        subtitle_path = normalize_subtitles(job.subtitle_path)
+    subtitles = load_subtitles(subtitle_path)
+    ranges, frame_duration = plan_ranges(keyframes, frame_times, subtitle_intervals(subtitles))
+    encoded_frames = sum(frames for _, _, encode, frames in ranges if encode)
+    if encoded_frames > len(frame_times) * SMART_MAX_ENCODED_SHARE:
+        log(f"Smart render: subtitles are visible in {encoded_frames} of {len(frame_times)} frames, "
+            "encoding all of it")
+        return None
+
+    work_dir = tempfile.mkdtemp(prefix="foxbaker_smart_")
+    try:
+        if not parameters_match(job, codec_args, work_dir, log):
+            log("Smart render: the encoder settings do not reproduce the source stream, encoding all of it")
+            return None
+        if job.cancelled:
+            return -1
+        paths = copy_ranges(job, ranges, work_dir, log)
+        if paths is None:
+            log("Smart render: cutting the source failed, encoding all of it")
+            return None
+
+        chunks = []
+        for index, ((start, end, encode, frames), path) in enumerate(zip(ranges, paths)):
+            chunk = Chunk(index, start, end, frames)
+            chunk.path = path
+            chunks.append(chunk)
+        encoded = [chunk for chunk, (_, _, encode, _) in zip(chunks, ranges) if encode]
+        workers = max(1, min(workers, len(encoded)))
+        job.total_frames = encoded_frames
+        log(f"Smart render: re-encoding {encoded_frames} of {len(frame_times)} frames in {len(encoded)} parts, "
+            "copying the rest")
+
+        suffix = Path(subtitle_path).suffix or ".ass"
+        lock = threading.Lock()
+        failed = threading.Event()
+
+        def report():
+            frames_done = sum(min(chunk.frames_done, chunk.frames) for chunk in encoded)
+            job.progress = min(frames_done / job.total_frames, 1.0) if job.total_frames else 1.0
+            job.eta = eta.update(frames_done, job.total_frames)
+            job.speed = sum(chunk.speed for chunk in encoded)
+            job.fps = sum(chunk.fps or 0 for chunk in encoded)
+            notify(job)
+            if on_speed and job.speed > 0: on_speed(job, job.speed)
+
+        def encode_chunk(chunk):
+            if failed.is_set() or job.cancelled:
+                return None
+            sub_path = os.path.join(work_dir, f"chunk_{chunk.index:04d}{suffix}")
+            offset = subtitles.write_window(sub_path, chunk.start, chunk.end)
+            chunk.path = os.path.join(work_dir, f"chunk_{chunk.index:04d}.{job.output_format or 'mp4'}")
+            cmd = chunk_command(job, chunk, sub_path, offset, codec_args, frame_duration, start_time, frame_rate,
+                                last=chunk is chunks[-1])
+            log(f"Chunk {chunk.index}: " + format_command(cmd))
+
+            def on_event(event):
+                with lock:
+                    if event.speed is not None:
+                        chunk.speed = event.speed
+                    chunk.fps = event.fps
+                    if event.frame is not None:
+                        chunk.frames_done = event.frame
+                    report()
+
+            rc = run_process(job, cmd, on_log=lambda line: log(f"Chunk {chunk.index}: {line}"), on_event=on_event)
+            with lock:
+                chunk.speed = 0.0
+                chunk.fps = None
+                if rc == 0:
+                    chunk.frames_done = chunk.frames
+                    report()
+            if rc != 0:
+                failed.set()
+                for process in list(job.processes):
+                    terminate(process)
+            return rc
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(encode_chunk, encoded))
+
+        if job.cancelled:
+            return -1
+        for rc in results:
+            if rc is None or rc != 0:
+                log("Smart render failed, see chunk output above")
+                return rc if rc else 1
+        return concat_chunks(job, chunks, work_dir, frame_rate, log)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,51 @@
+import os
+import sys
+
+SPRITE_WIDTH = 24
+SPRITE_HEIGHT = 20
+IDLE_FRAMES = 9
+RUN_FRAMES = 8
+ATLAS_FILE = "sprites.png"
+# Rows of the atlas, the mirrored run frames are baked in so nothing is flipped at runtime
+IDLE_ROW = 0
+RUN_ROW = 1
+RUN_FLIPPED_ROW = 2
+
+
+def build_atlas(source_dir=".", output=ATLAS_FILE):
+    """
+    Packs idle/foxidle*.png and run/foxrun*.png, already scaled to the size
+    the window shows them at, into a single PNG. Needs Pillow, which the GUI
+    itself does not: run `python -m foxbaker.sprites` after changing a frame.
+    """
+    from PIL import Image
+
+    def frames(folder, prefix, count):
+        for i in range(1, count + 1):
+            img = Image.open(os.path.join(source_dir, folder, f"{prefix}{i}.png")).convert("RGBA")
+            yield img.resize((SPRITE_WIDTH, SPRITE_HEIGHT), Image.Resampling.NEAREST)
+
+    atlas = Image.new("RGBA", (SPRITE_WIDTH * max(IDLE_FRAMES, RUN_FRAMES), SPRITE_HEIGHT * 3), (0, 0, 0, 0))
+    for i, img in enumerate(frames("idle", "foxidle", IDLE_FRAMES)):
+        atlas.paste(img, (i * SPRITE_WIDTH, IDLE_ROW * SPRITE_HEIGHT))
+    for i, img in enumerate(frames("run", "foxrun", RUN_FRAMES)):
+        atlas.paste(img, (i * SPRITE_WIDTH, RUN_ROW * SPRITE_HEIGHT))
+        atlas.paste(img.transpose(Image.Transpose.FLIP_LEFT_RIGHT), (i * SPRITE_WIDTH, RUN_FLIPPED_ROW * SPRITE_HEIGHT))
+    atlas.save(output, optimize=True)
+    return output
+
+
+def cut_frames(atlas, row, count):
+    """Copies `count` frames of one atlas row into their own Tk images, no decoding or scaling involved."""
+    import tkinter as tk
+    frames = []
+    for i in range(count):
+        frame = tk.PhotoImage(width=SPRITE_WIDTH, height=SPRITE_HEIGHT)
+        x, y = i * SPRITE_WIDTH, row * SPRITE_HEIGHT
+        frame.tk.call(frame, "copy", atlas, "-from", x, y, x + SPRITE_WIDTH, y + SPRITE_HEIGHT)
+        frames.append(frame)
+    return frames
+
+
+if __name__ == "__main__":
+    print(build_atlas(*sys.argv[1:]))
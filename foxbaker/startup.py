@@ -0,0 +1,22 @@
+import time
+
+
+class StartupProfile:
+    """Wall time of the startup steps, printed by `main.py --profile-startup`."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.steps = []
+
+    def mark(self, name):
+        """Ends the step `name` that began at the previous mark."""
+        now = time.perf_counter()
+        self.steps.append((name, now - self._last))
+        self._last = now
+
+    def report(self):
+        width = max(len(name) for name, _ in self.steps) if self.steps else 0
+        lines = [f"{name:<{width}}  {seconds * 1000:8.1f} ms" for name, seconds in self.steps]
+        lines.append(f"{'total':<{width}}  {(self._last - self.started) * 1000:8.1f} ms")
+        return "\n".join(lines)
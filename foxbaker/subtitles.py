@@ -0,0 +1,168 @@
+import math
+import re
+from pathlib import Path
+
+ASS_TIME_RE = re.compile(r'(\d+):(\d{1,2}):(\d{1,2})(?:[.,](\d+))?')
+# ffmpeg can not open an .srt without cues, a zero-width space for a millisecond draws nothing
+EMPTY_SRT = "1\n00:00:00,000 --> 00:00:00,001\n\u200b\n\n"
+SRT_TIMING_RE = re.compile(r'(\d+):(\d{1,2}):(\d{1,2})[,.](\d+)\s*-->\s*(\d+):(\d{1,2}):(\d{1,2})[,.](\d+)(.*)')
+
+
+def _seconds(h, m, s, frac):
+    return int(h) * 3600 + int(m) * 60 + int(s) + (int(frac) / 10 ** len(frac) if frac else 0)
+
+
+def parse_ass_time(value):
+    m = ASS_TIME_RE.match(value.strip())
+    if not m:
+        raise ValueError(f"Invalid ASS time: {value!r}")
+    return _seconds(*m.groups())
+
+
+def format_ass_time(seconds):
+    cs = max(0, int(round(seconds * 100)))
+    return f"{cs // 360000}:{cs // 6000 % 60:02d}:{cs // 100 % 60:02d}.{cs % 100:02d}"
+
+
+def format_srt_time(seconds):
+    ms = max(0, int(round(seconds * 1000)))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+class SubtitleEvent:
+    __slots__ = ("start", "end", "fields", "text")
+
+    def __init__(self, start, end, fields=None, text=None):
+        self.start = start
+        self.end = end
+        # ASS: the comma separated Dialogue fields, SRT: the text lines
+        self.fields = fields
+        self.text = text
+
+
+class SubtitleFile:
+    """
+    A parsed .ass/.ssa or .srt file that can write time windows of itself.
+
+    Only the parts needed for re-timing are parsed; everything else in an ASS
+    file (styles, fonts, graphics, comments) is kept verbatim.
+    """
+
+    def __init__(self, kind, events, header=None, footer=None, start_index=1, end_index=2):
+        self.kind = kind
+        self.events = events
+        self.header = header or []
+        self.footer = footer or []
+        self.start_index = start_index
+        self.end_index = end_index
+
+    @property
+    def precision(self):
+        return 100 if self.kind == "ass" else 1000
+
+    def events_between(self, start, end):
+        return [ev for ev in self.events if ev.end > start and ev.start < end]
+
+    def write_window(self, path, start, end):
+        """
+        Writes the events visible in [start, end) shifted back by an offset and
+        returns that offset.
+
+        Events that straddle a window border are selected, not cut: they keep
+        their full length so that \\t, \\fad, \\move and karaoke timings, which
+        are relative to the event start and end, render exactly as in a single
+        pass. The offset therefore may be smaller than `start` when an event
+        began before the window, and the caller shifts the frame timestamps by
+        the difference.
+        """
+        events = self.events_between(start, end)
+        offset = min([start] + [ev.start for ev in events])
+        offset = math.floor(max(0.0, offset) * self.precision) / self.precision
+        with open(path, "w", encoding="utf-8", newline="\n") as f:
+            if self.kind == "ass":
+                self._write_ass(f, events, offset)
+            else:
+                self._write_srt(f, events, offset)
+        return offset
+
+    def _write_ass(self, f, events, offset):
+        for line in self.header:
+            f.write(line + "\n")
+        for ev in events:
+            fields = list(ev.fields)
+            fields[self.start_index] = format_ass_time(ev.start - offset)
+            fields[self.end_index] = format_ass_time(ev.end - offset)
+            f.write("Dialogue: " + ",".join(fields) + "\n")
+        for line in self.footer:
+            f.write(line + "\n")
+
+    def _write_srt(self, f, events, offset):
+        if not events:
+            f.write(EMPTY_SRT)
+            return
+        for number, ev in enumerate(events, 1):
+            f.write(f"{number}\n{format_srt_time(ev.start - offset)} --> {format_srt_time(ev.end - offset)}\n")
+            f.write("\n".join(ev.text) + "\n\n")
+
+
+def load_subtitles(path):
+    """Parses a UTF-8 subtitle file, use normalize_subtitles() for files in other encodings first."""
+    with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+        lines = f.read().splitlines()
+    if Path(path).suffix.lower() == ".srt" or not any(line.strip().lower() == "[events]" for line in lines):
+        return _parse_srt(lines)
+    return _parse_ass(lines)
+
+
+def _parse_ass(lines):
+    header, footer, events = [], [], []
+    fields_format = ["layer", "start", "end", "style", "name", "marginl", "marginr", "marginv", "effect", "text"]
+    section = None
+    target = header
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            if section == "[events]":
+                target = footer
+            section = stripped.lower()
+            target.append(line)
+            continue
+        if section == "[events]":
+            kind, _, value = line.partition(":")
+            kind = kind.strip().lower()
+            if kind == "format":
+                fields_format = [name.strip().lower() for name in value.split(",")]
+                target.append(line)
+                continue
+            if kind == "dialogue":
+                fields = value.lstrip().split(",", len(fields_format) - 1)
+                try:
+                    start = parse_ass_time(fields[fields_format.index("start")])
+                    end = parse_ass_time(fields[fields_format.index("end")])
+                except (ValueError, IndexError):
+                    continue
+                events.append(SubtitleEvent(start, end, fields=fields))
+                continue
+            if kind == "comment":
+                # Comment events are never rendered
+                continue
+        target.append(line)
+    return SubtitleFile("ass", events, header, footer, fields_format.index("start"), fields_format.index("end"))
+
+
+def _parse_srt(lines):
+    events = []
+    i = 0
+    while i < len(lines):
+        m = SRT_TIMING_RE.match(lines[i].strip())
+        i += 1
+        if not m:
+            continue
+        g = m.groups()
+        text = []
+        while i < len(lines) and lines[i].strip():
+            text.append(lines[i])
+            i += 1
+        events.append(SubtitleEvent(_seconds(*g[0:4]), _seconds(*g[4:8]), text=text))
+    events.sort(key=lambda ev: ev.start)
+    return SubtitleFile("srt", events)
@@ -0,0 +1,39 @@
+import threading
+
+# What changed since the last tick
+QUEUE = "queue"
+PROGRESS = "progress"
+LOG = "log"
+FINISHED = "finished"
+
+
+class UiState:
+    """
+    Changes published by the worker threads for the Tk thread.
+
+    publish() only sets flags under a lock, it never touches Tk. The window
+    picks everything up at once with take() on its next tick, so a burst of
+    progress events between two frames costs a single redraw, and nothing is
+    redrawn at all while the window is minimized.
+    """
+
+    def __init__(self):
+        self._changes = set()
+        self._status = None
+        self._lock = threading.Lock()
+
+    def publish(self, *changes):
+        with self._lock:
+            self._changes.update(changes)
+
+    def set_status(self, status_key):
+        """Only the latest status is shown, earlier ones are dropped."""
+        with self._lock:
+            self._status = status_key
+
+    def take(self):
+        """Returns (changes, status_key) and clears them, status_key is None when unchanged."""
+        with self._lock:
+            changes, self._changes = self._changes, set()
+            status, self._status = self._status, None
+        return changes, status
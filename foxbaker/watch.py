@@ -0,0 +1,352 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+from foxbaker.cli import ENCODERS, EXIT_INTERRUPTED, EXIT_OK, EXIT_USAGE, emit
+from foxbaker.encode import QUALITY_NAMES, run_job
+from foxbaker.jobs import CANCELLED, DONE, FAILED, Job, JobQueue, Scheduler, default_output_name
+from foxbaker.logbuffer import LOG_DIR, JobLogFile, classify, job_log_path
+from foxbaker.remote import JOBS_PER_WORKER, WORKERS, WorkerPool, run_remote
+
+# The same extensions the file dialogs of the GUI offer
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+# A video with both gets the .ass file
+SUBTITLE_EXTENSIONS = (".ass", ".srt")
+STATE_FILE = ".foxbaker-watch.json"
+POLL_SECONDS = 5
+# Files count as complete once their size and mtime stayed the same this long
+SETTLE_SECONDS = 30
+# Some network shares do not update the directory mtime, everything is listed again this often
+RESCAN_SECONDS = 600
+
+
+def _stat_key(st):
+    return [st.st_size, st.st_mtime_ns]
+
+
+class FileState:
+    """What the watcher last saw of a file and since when it has not changed."""
+
+    def __init__(self, st, now):
+        self.key = _stat_key(st)
+        self.mtime = st.st_mtime
+        self.changed = now
+        self.checks = 1
+
+    def update(self, st, now):
+        key = _stat_key(st)
+        if key != self.key:
+            self.key = key
+            self.mtime = st.st_mtime
+            self.changed = now
+            self.checks = 1
+        else:
+            self.checks += 1
+
+    def stable(self, now, settle):
+        """
+        Unchanged for `settle` seconds. A file seen for the first time is
+        trusted after a second look when its mtime is already older than that,
+        so a restarted watcher does not wait again for files that are long complete.
+        """
+        if self.checks < 2:
+            return False
+        return now - self.changed >= settle or time.time() - self.mtime >= settle
+
+
+class WatchState:
+    """
+    Pairs that were handled, saved in the output directory so a restarted
+    watcher skips them. A pair is handled again only when the video or the
+    subtitle file was replaced, failures included.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.pairs = json.load(f)
+        except (OSError, ValueError):
+            self.pairs = {}
+
+    def handled(self, video_path, video_key, subtitle_key):
+        entry = self.pairs.get(video_path)
+        return entry is not None and entry["video"] == video_key and entry["subtitle"] == subtitle_key
+
+    def record(self, job, output_path, video_key, subtitle_key, status, error=None):
+        with self._lock:
+            self.pairs[job.video_path] = {"video": video_key, "subtitle": subtitle_key, "status": status,
+                                          "subtitle_path": job.subtitle_path, "output": output_path,
+                                          "finished": time.time(), "error": error}
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self.pairs, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                emit("error", message=f"Watch state could not be saved: {e}")
+
+
+class Watcher:
+    """
+    Finds video/subtitle pairs with the same stem in the watched directories
+    and queues them once both files stopped growing.
+
+    Only what changed is looked at again: a directory is listed when its mtime
+    changed, and only files that are not yet complete are stat'ed on every
+    poll, so thousands of handled files cost nothing.
+    """
+
+    def __init__(self, input_dirs, settle=SETTLE_SECONDS):
+        self.input_dirs = [os.path.abspath(d) for d in input_dirs]
+        self.settle = settle
+        self._dir_mtimes = {}
+        self._listed = 0.0
+        # Video and subtitle files of each directory by stem
+        self._entries = {d: {} for d in self.input_dirs}
+        self._files = {}
+
+    def _list(self, directory):
+        entries = {}
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    if ext in VIDEO_EXTENSIONS or ext in SUBTITLE_EXTENSIONS:
+                        if entry.is_file():
+                            entries.setdefault(Path(entry.name).stem, []).append(entry.path)
+        except OSError as e:
+            emit("error", message=f"Could not list {directory}: {e}")
+            return
+        self._entries[directory] = entries
+        present = {path for paths in entries.values() for path in paths}
+        for path in [p for p in self._files if os.path.dirname(p) == directory and p not in present]:
+            del self._files[path]
+
+    def _refresh_dirs(self, now):
+        rescan = now - self._listed >= RESCAN_SECONDS
+        if rescan:
+            self._listed = now
+            # Files replaced in place do not touch the directory, their stat is taken again as well
+            self._files = {}
+        for directory in self.input_dirs:
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            if rescan or self._dir_mtimes.get(directory) != mtime:
+                self._dir_mtimes[directory] = mtime
+                self._list(directory)
+
+    def _check(self, path, now):
+        """FileState of `path`, stat'ed again unless it is already known to be complete."""
+        state = self._files.get(path)
+        if state is not None and state.stable(now, self.settle):
+            return state
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._files.pop(path, None)
+            return None
+        if state is None:
+            state = self._files[path] = FileState(st, now)
+        else:
+            state.update(st, now)
+        return state
+
+    def forget(self, *paths):
+        """Stat the files again on the next poll, e.g. after a job that used them finished."""
+        for path in paths:
+            self._files.pop(path, None)
+
+    def settling(self):
+        """True while a file of a pair is still being written."""
+        now = time.monotonic()
+        return any(not state.stable(now, self.settle) for state in self._files.values())
+
+    def ready_pairs(self, skip):
+        """
+        (video, video key, subtitle, subtitle key) of every complete pair.
+        `skip(video_path, video_key, subtitle_key)` filters out pairs that are
+        queued or already handled.
+        """
+        now = time.monotonic()
+        self._refresh_dirs(now)
+        pairs = []
+        for entries in self._entries.values():
+            for paths in entries.values():
+                videos = [p for p in paths if os.path.splitext(p)[1].lower() in VIDEO_EXTENSIONS]
+                subtitles = sorted((p for p in paths if os.path.splitext(p)[1].lower() in SUBTITLE_EXTENSIONS),
+                                   key=lambda p: SUBTITLE_EXTENSIONS.index(os.path.splitext(p)[1].lower()))
+                if not videos or not subtitles:
+                    continue
+                subtitle = self._check(subtitles[0], now)
+                for video_path in videos:
+                    video = self._check(video_path, now)
+                    if not video or not subtitle or not video.stable(now, self.settle) \
+                            or not subtitle.stable(now, self.settle):
+                        continue
+                    if not skip(video_path, video.key, subtitle.key):
+                        pairs.append((video_path, video.key, subtitles[0], subtitle.key))
+        return pairs
+
+
+def partial_path(output_path):
+    """Jobs encode to `<name>.partial.<ext>` and are renamed when done, so nothing picks up half a file."""
+    base, ext = os.path.splitext(output_path)
+    return f"{base}.partial{ext}"
+
+
+def move_inputs(paths, directory):
+    os.makedirs(directory, exist_ok=True)
+    for path in paths:
+        shutil.move(path, os.path.join(directory, os.path.basename(path)))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="foxbaker.watch",
+                                     description="Watch directories for video/subtitle pairs with the same name "
+                                                 "and burn the subtitles in as they arrive.")
+    parser.add_argument("inputs", nargs="+", metavar="DIR", help="directories to watch")
+    parser.add_argument("-o", "--output-dir", required=True, help="directory for the finished videos")
+    parser.add_argument("--format", default="mp4", choices=["mp4", "mkv", "mov", "webm"], help="output container")
+    parser.add_argument("-q", "--quality", choices=QUALITY_NAMES, default=QUALITY_NAMES[0])
+    parser.add_argument("-e", "--encoder", choices=list(ENCODERS), default="software")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="encodes at the same time, 0 tunes it from the measured throughput")
+    parser.add_argument("--segmented", action="store_true")
+    parser.add_argument("--smart", action="store_true")
+    parser.add_argument("--no-preflight", action="store_true")
+    parser.add_argument("--move-to", metavar="DIR",
+                        help="move the video and subtitle file here once the output is done, otherwise they are "
+                             "only marked as done in the state file")
+    parser.add_argument("--state", help=f"state file, defaults to {STATE_FILE} in the output directory")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS,
+                        help="seconds a file must stay unchanged before it counts as complete")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="seconds between two looks at the directories")
+    parser.add_argument("--once", action="store_true",
+                        help="exit when every complete pair is done instead of watching on")
+    parser.add_argument("--worker", action="append", metavar="HOST:PORT",
+                        help="encode on remote workers instead of this machine, can be repeated; "
+                             "defaults to FOXBAKER_WORKERS")
+    parser.add_argument("-v", "--verbose", action="store_true", help="copy ffmpeg output to stderr")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    for directory in args.inputs + [args.output_dir]:
+        if not os.path.isdir(directory):
+            emit("error", message=f"Directory not found: {directory}")
+            return EXIT_USAGE
+    output_dir = os.path.abspath(args.output_dir)
+    state = WatchState(args.state or os.path.join(output_dir, STATE_FILE))
+    watcher = Watcher(args.inputs, args.settle)
+    hw_enabled, hw_type = ENCODERS[args.encoder]
+    queue = JobQueue()
+    workers = args.worker or WORKERS
+    pool = WorkerPool(workers) if workers else None
+    # video path -> (video key, subtitle key, output path) of the pairs in the queue
+    queued = {}
+    queued_lock = threading.Lock()
+
+    def runner(job):
+        log_file = None
+        if LOG_DIR:
+            try:
+                log_file = JobLogFile(job_log_path(job, LOG_DIR))
+            except OSError as e:
+                emit("error", message=f"Log file error: {e}")
+
+        def on_log(line):
+            if not line:
+                return
+            if args.verbose:
+                sys.stderr.write(f"[{job.id}] {line}\n")
+            if log_file:
+                log_file.write(line, classify(line))
+
+        try:
+            if pool:
+                return run_remote(job, pool, on_log=on_log, on_speed=scheduler.report_speed)
+            return run_job(job, on_log=on_log, on_speed=scheduler.report_speed)
+        finally:
+            if log_file: log_file.close()
+
+    def on_change(job):
+        with queued_lock:
+            video_key, subtitle_key, final_path = queued[job.video_path]
+        if not job.finished:
+            emit("start", id=job.id, input=job.video_path, subtitle=job.subtitle_path, output=final_path)
+            return
+        if job.status == DONE:
+            try:
+                os.replace(job.output_path, final_path)
+            except OSError as e:
+                job.status, job.error = FAILED, str(e)
+        if job.status != DONE and os.path.exists(job.output_path):
+            os.remove(job.output_path)
+        if job.status == DONE:
+            emit("done", id=job.id, output=final_path, size=os.path.getsize(final_path),
+                 elapsed=round(job.end_time - job.start_time, 2))
+            if args.move_to:
+                try:
+                    move_inputs([job.video_path, job.subtitle_path], args.move_to)
+                except OSError as e:
+                    emit("error", id=job.id, input=job.video_path, message=f"Could not move the inputs: {e}")
+        elif job.status == FAILED:
+            error = job.error or f"ffmpeg exited with code {job.returncode}"
+            emit("error", id=job.id, input=job.video_path, message=error)
+        # Cancelled jobs are not recorded, the pair is encoded again after a restart
+        if job.status != CANCELLED:
+            state.record(job, final_path, video_key, subtitle_key, job.status, job.error)
+        watcher.forget(job.video_path, job.subtitle_path)
+        with queued_lock:
+            del queued[job.video_path]
+
+    max_jobs = args.jobs or (len(pool.addresses) * JOBS_PER_WORKER if pool else None)
+    scheduler = Scheduler(queue, runner, max_jobs=max_jobs, on_change=on_change)
+
+    def skip(video_path, video_key, subtitle_key):
+        with queued_lock:
+            if video_path in queued:
+                return True
+        return state.handled(video_path, video_key, subtitle_key)
+
+    emit("watch", inputs=watcher.input_dirs, output_dir=output_dir, state=state.path)
+    try:
+        while True:
+            for video_path, video_key, subtitle_path, subtitle_key in watcher.ready_pairs(skip):
+                output_path = os.path.join(output_dir, f"{default_output_name(video_path)}.{args.format}")
+                job = Job(video_path, subtitle_path, partial_path(output_path),
+                          quality=QUALITY_NAMES.index(args.quality), hw_enabled=hw_enabled, hw_type=hw_type,
+                          segmented=args.segmented, smart=args.smart, preflight=not args.no_preflight)
+                with queued_lock:
+                    queued[video_path] = (video_key, subtitle_key, output_path)
+                queue.add(job)
+                emit("queued", id=job.id, input=video_path, subtitle=subtitle_path, output=output_path)
+                scheduler.start()
+            queue.clear_finished()
+            with queued_lock:
+                busy = bool(queued)
+            if args.once and not busy and not watcher.settling():
+                return EXIT_OK
+            time.sleep(args.poll)
+    except KeyboardInterrupt:
+        queue.cancel_all()
+        # Give the jobs a moment to stop ffmpeg and remove their partial outputs
+        stop_by = time.monotonic() + 10
+        while queued and time.monotonic() < stop_by:
+            time.sleep(0.1)
+        emit("cancelled")
+        return EXIT_INTERRUPTED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
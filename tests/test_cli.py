@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from foxbaker import cli
+from foxbaker.encoders import FFMPEG
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBTITLES = "1\n00:00:00,000 --> 00:00:01,000\nHello\n\n"
+FAILING_FFMPEG = "#!{python}\nimport sys\nsys.stderr.write('stub failure\\n')\nsys.exit(1)\n"
+
+
+class HeadlessTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.video = self.path("in.mp4")
+        with open(self.video, "wb") as f:
+            f.write(b"not a video")
+        self.subtitles = self.path("in.srt")
+        with open(self.subtitles, "w", encoding="utf-8") as f:
+            f.write(SUBTITLES)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def run_cli(self, *args, **env):
+        env = dict(os.environ, FOXBAKER_CACHE_DIR=self.path("cache"),
+                   FOXBAKER_HISTORY_DB=self.path("history.sqlite3"), **env)
+        env.pop("FOXBAKER_WORKERS", None)
+        result = subprocess.run([sys.executable, os.path.join(ROOT, "main.py"), "--headless", *args],
+                                capture_output=True, text=True, env=env, timeout=120)
+        return result.returncode, [json.loads(line) for line in result.stdout.splitlines()]
+
+    def test_usage_errors(self):
+        cases = [
+            (["-i", self.path("missing.mp4"), "-s", self.subtitles], "Input video not found"),
+            (["-i", self.video, "-s", self.path("missing.srt")], "Subtitle file not found"),
+            (["-i", self.video, "-s", self.subtitles, "-o", self.path("missing/out.mp4")],
+             "Output directory not found"),
+            (["-i", self.video, "-s", self.subtitles, "--finish-by", "soon"], "Invalid --finish-by"),
+            (["-i", self.video, "-s", self.subtitles, "--soft", "--rendition", "low:x.mp4"], "--rendition needs"),
+        ]
+        for args, message in cases:
+            with self.subTest(message):
+                rc, events = self.run_cli(*args)
+                self.assertEqual(rc, cli.EXIT_USAGE)
+                self.assertEqual(events[-1]["event"], "error")
+                self.assertTrue(events[-1]["message"].startswith(message), events[-1]["message"])
+
+    def test_ffmpeg_not_found(self):
+        rc, events = self.run_cli("-i", self.video, "-s", self.subtitles, "--no-preflight",
+                                  FOXBAKER_FFMPEG=self.path("missing-ffmpeg"))
+
+        self.assertEqual(rc, cli.EXIT_FFMPEG_NOT_FOUND)
+        self.assertEqual([event["event"] for event in events], ["start", "error"])
+
+    def test_ffmpeg_fails(self):
+        ffmpeg = self.path("ffmpeg")
+        with open(ffmpeg, "w") as f:
+            f.write(FAILING_FFMPEG.format(python=sys.executable))
+        os.chmod(ffmpeg, os.stat(ffmpeg).st_mode | stat.S_IEXEC)
+
+        rc, events = self.run_cli("-i", self.video, "-s", self.subtitles, "--no-preflight", FOXBAKER_FFMPEG=ffmpeg)
+
+        self.assertEqual(rc, cli.EXIT_FAILED)
+        self.assertEqual(events[-1], {"event": "error", "message": "ffmpeg exited with code 1", "returncode": 1})
+
+    @unittest.skipUnless(shutil.which(FFMPEG), "needs ffmpeg")
+    def test_done(self):
+        subprocess.run([FFMPEG, "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=s=160x120:r=10:d=1",
+                        "-pix_fmt", "yuv420p", self.video], check=True)
+
+        rc, events = self.run_cli("-i", self.video, "-s", self.subtitles, "-o", self.path("out.mp4"))
+
+        self.assertEqual(rc, cli.EXIT_OK)
+        self.assertEqual(events[0]["event"], "start")
+        self.assertEqual(events[-1]["event"], "done")
+        self.assertEqual(events[-1]["size"], os.path.getsize(self.path("out.mp4")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from foxbaker import encoders
+
+# Answers the calls foxbaker.encoders makes, the NVENC test encode fails like it does without the driver.
+# Every call is appended to $STUB_CALLS
+STUB_FFMPEG = """#!{python}
+import os
+import sys
+
+args = sys.argv[1:]
+with open(os.environ["STUB_CALLS"], "a") as f:
+    f.write(" ".join(args) + "\\n")
+if "-version" in args:
+    print("ffmpeg version " + os.environ.get("STUB_VERSION", "6.1-stub"))
+elif "-encoders" in args:
+    print("Encoders:")
+    print(" V..... = Video")
+    print(" ------")
+    for name in ("libx264", "libx265", "h264_nvenc", "h264_amf", "libvpx-vp9"):
+        print(" V....D " + name + "             stub encoder")
+    print(" A....D aac                  AAC")
+elif "-hwaccels" in args:
+    print("Hardware acceleration methods:")
+    print("cuda")
+elif "-c:v" in args and args[args.index("-c:v") + 1] == "h264_nvenc":
+    sys.stderr.write("[h264_nvenc] Cannot load libnvidia-encode.so.1\\n")
+    sys.exit(1)
+"""
+
+
+class StubFfmpegTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.ffmpeg = os.path.join(self.root, "ffmpeg")
+        with open(self.ffmpeg, "w") as f:
+            f.write(STUB_FFMPEG.format(python=sys.executable))
+        os.chmod(self.ffmpeg, os.stat(self.ffmpeg).st_mode | stat.S_IEXEC)
+        self.calls = os.path.join(self.root, "calls")
+        patcher = mock.patch.dict(os.environ, {"FOXBAKER_CACHE_DIR": os.path.join(self.root, "cache"),
+                                               "STUB_CALLS": self.calls})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for name in ("_capabilities", "_failed", "_pix_fmts"):
+            patcher = mock.patch.object(encoders, name, {})
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def encodes_run(self):
+        """Test encodes run so far."""
+        if not os.path.exists(self.calls):
+            return 0
+        with open(self.calls) as f:
+            return sum(1 for line in f if "-c:v" in line.split())
+
+    def test_probe_capabilities(self):
+        caps = encoders.probe_capabilities(self.ffmpeg)
+
+        self.assertEqual(caps["version"], "ffmpeg version 6.1-stub")
+        self.assertEqual(caps["hwaccels"], ["cuda"])
+        self.assertIsNone(caps["encoders"]["libx264"])
+        self.assertIsNone(caps["encoders"]["h264_amf"])
+        self.assertIn("libnvidia-encode", caps["encoders"]["h264_nvenc"])
+        self.assertEqual(caps["encoders"]["h264_qsv"], "not in this build")
+        self.assertEqual(caps["encoders"]["libsvtav1"], "not in this build")
+
+    def test_capabilities_are_cached_per_binary_and_version(self):
+        encoders.capabilities(self.ffmpeg)
+        probed = self.encodes_run()
+        self.assertGreater(probed, 0)
+
+        # A restart reads the disk cache, a symlink resolves to the same binary
+        link = os.path.join(self.root, "ffmpeg-link")
+        os.symlink(self.ffmpeg, link)
+        encoders._capabilities.clear()
+        encoders.capabilities(link)
+        self.assertEqual(self.encodes_run(), probed)
+        self.assertEqual(encoders._cache_key(link, "v"), encoders._cache_key(self.ffmpeg, "v"))
+
+        # Another ffmpeg version is probed again
+        encoders._capabilities.clear()
+        with mock.patch.dict(os.environ, {"STUB_VERSION": "7.0-stub"}):
+            encoders.capabilities(self.ffmpeg)
+        self.assertEqual(self.encodes_run(), 2 * probed)
+
+    def test_select_encoder_prefers_the_vendor(self):
+        self.assertEqual(encoders.select_encoder("h264", hardware=True, vendor="AMD", ffmpeg=self.ffmpeg).name,
+                         "h264_amf")
+
+    def test_select_encoder_falls_back_past_failed_encoders(self):
+        # NVENC failed its test encode, the next working GPU encoder is used
+        self.assertEqual(encoders.select_encoder("h264", hardware=True, vendor="NVIDIA", ffmpeg=self.ffmpeg).name,
+                         "h264_amf")
+        self.assertEqual(encoders.select_encoder("h264", ffmpeg=self.ffmpeg).name, "libx264")
+
+    def test_mark_failed(self):
+        encoders.mark_failed("h264_amf", "out of encode sessions")
+
+        self.assertFalse(encoders.available("h264_amf", self.ffmpeg))
+        self.assertEqual(encoders.select_encoder("h264", hardware=True, vendor="AMD", ffmpeg=self.ffmpeg).name,
+                         "libx264")
+
+    def test_nothing_working_returns_the_first_software_encoder(self):
+        self.assertEqual(encoders.select_encoder("av1", ffmpeg=self.ffmpeg).name, "libsvtav1")
+
+
+if __name__ == "__main__":
+    unittest.main()
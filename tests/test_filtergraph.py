@@ -0,0 +1,43 @@
+import unittest
+
+from foxbaker.filtergraph import closest_pix_fmt, pixel_format_filter, plan_chain
+
+# What `ffmpeg -h encoder=libx264` lists
+LIBX264 = ["yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p", "nv12", "nv16", "nv21",
+           "yuv420p10le", "yuv422p10le", "yuv444p10le", "nv20le", "gray", "gray10le"]
+NVENC = ["yuv420p", "nv12", "p010le", "yuv444p", "p016le", "yuv444p16le", "bgr0", "rgb0", "cuda"]
+
+
+class PixelFormatTest(unittest.TestCase):
+    def test_accepted_source_is_not_converted(self):
+        self.assertIsNone(pixel_format_filter("yuv420p", LIBX264))
+        self.assertIsNone(pixel_format_filter("yuv444p10le", LIBX264))
+
+    def test_unknown_formats_are_left_to_ffmpeg(self):
+        self.assertIsNone(pixel_format_filter(None, LIBX264))
+        self.assertIsNone(pixel_format_filter("rgb24", []))
+
+    def test_chroma_subsampling_is_kept(self):
+        self.assertEqual(closest_pix_fmt("rgb24", LIBX264), "yuv444p")
+        self.assertEqual(closest_pix_fmt("gbrp", LIBX264), "yuv444p")
+        self.assertEqual(closest_pix_fmt("yuv422p12le", LIBX264), "yuv422p10le")
+        self.assertEqual(closest_pix_fmt("p010le", LIBX264), "yuv420p10le")
+
+    def test_bit_depth_is_not_lowered_when_the_encoder_has_more(self):
+        self.assertEqual(closest_pix_fmt("yuv420p12le", NVENC), "p016le")
+        self.assertEqual(closest_pix_fmt("rgb48le", NVENC), "yuv444p16le")
+
+    def test_gpu_frames_are_not_picked(self):
+        self.assertEqual(closest_pix_fmt("pal8", NVENC), "yuv420p")
+
+    def test_conversion_shares_the_downscale(self):
+        plan = plan_chain(2, "sub.ass", (3840, 2160), pix_fmt="rgb24", encoder_pix_fmts=LIBX264)
+        self.assertTrue(plan.graph.startswith("scale=1280:720:flags=bicubic,format=yuv444p,subtitles="))
+
+    def test_no_conversion_in_the_graph_for_accepted_sources(self):
+        plan = plan_chain(0, "sub.ass", (1920, 1080), pix_fmt="yuv420p", encoder_pix_fmts=LIBX264)
+        self.assertEqual(plan.graph, "subtitles='sub.ass'")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from foxbaker import fonts
+from foxbaker.normalize import normalize_subtitles
+
+FAMILY = "Foxbaker Test Sans"
+
+SCRIPT = """[Script Info]
+ScriptType: v4.00+
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,{family},48,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,0,2,20,20,20,204
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+Dialogue: 0,0:00:01.00,0:00:03.00,Default,,0,0,0,,Привет, мир
+"""
+
+
+def sfnt_with_family(family):
+    """The smallest file font_names() reads: an sfnt header and a name table with the family name."""
+    string = family.encode("utf-16-be")
+    name = struct.pack(">HHH", 0, 1, 18) + struct.pack(">HHHHHH", 3, 1, 0x409, 1, len(string), 0) + string
+    header = struct.pack(">IHHHH", 0x00010000, 1, 16, 0, 0)
+    return header + struct.pack(">4sIII", b"name", 0, 12 + 16, len(name)) + name
+
+
+class CheckFontsTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        patcher = mock.patch.dict(os.environ, {"FOXBAKER_CACHE_DIR": os.path.join(self.root, "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, fonts, "_index", None)
+        fonts._index = None
+        self.project = os.path.join(self.root, "project")
+        os.makedirs(os.path.join(self.project, "fonts"))
+        self.font = os.path.join(self.project, "fonts", "TestSans.ttf")
+        with open(self.font, "wb") as f:
+            f.write(sfnt_with_family(FAMILY))
+
+    def test_cp1251_script_finds_project_fonts(self):
+        subtitle = os.path.join(self.project, "episode.ass")
+        with open(subtitle, "w", encoding="cp1251") as f:
+            f.write(SCRIPT.format(family=FAMILY))
+        normalized = normalize_subtitles(subtitle)
+        # The transcoded copy lives in the cache, away from ./fonts
+        self.assertNotEqual(os.path.dirname(os.path.abspath(normalized)), self.project)
+
+        report = fonts.check_fonts(None, normalized, origin_path=subtitle)
+
+        self.assertEqual(report.missing, [])
+        self.assertEqual(report.resolved, {FAMILY: [self.font]})
+
+
+if __name__ == "__main__":
+    unittest.main()
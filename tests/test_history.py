@@ -0,0 +1,98 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from foxbaker import history
+from foxbaker.jobs import Job
+
+# A Format line without Start, load_subtitles() raises ValueError for it
+MALFORMED_SCRIPT = """[Script Info]
+ScriptType: v4.00+
+
+[Events]
+Format: Layer, End, Style, Text
+Dialogue: 0,0:00:03.00,Default,Hello
+"""
+
+
+class HistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        patcher = mock.patch.dict(os.environ, {"FOXBAKER_CACHE_DIR": os.path.join(self.root, "cache"),
+                                               "FOXBAKER_HISTORY_DB": os.path.join(self.root, "history.sqlite3")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(history._stats.clear)
+        history._stats.clear()
+        self.video = os.path.join(self.root, "in.mp4")
+        with open(self.video, "wb") as f:
+            f.write(b"video")
+        self.info = SimpleNamespace(width=1920, height=1080, duration=60.0, fps=24.0, frame_count=None,
+                                    video_codec="h264")
+
+    def write_subtitles(self, text, name="in.ass"):
+        path = os.path.join(self.root, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+
+class MalformedScriptTest(HistoryTestCase):
+    def test_prediction_logs_instead_of_raising(self):
+        job = Job(self.video, self.write_subtitles(MALFORMED_SCRIPT), os.path.join(self.root, "out.mp4"))
+        messages = []
+
+        history.seed_eta(job, self.info, messages.append)
+
+        self.assertIsNone(job.eta)
+        self.assertTrue(messages[0].startswith("History: no prediction"))
+
+    def test_recording_a_finished_job_logs_instead_of_raising(self):
+        job = Job(self.video, self.write_subtitles(MALFORMED_SCRIPT), os.path.join(self.root, "out.mp4"))
+        job.metrics = SimpleNamespace(status="done", processes=[SimpleNamespace(stage="encode", command=["ffmpeg"])])
+        messages = []
+
+        history.record_job(job, messages.append)
+
+        self.assertTrue(messages[0].startswith("History: the job could not be recorded"))
+
+
+class SubtitleStatsTest(HistoryTestCase):
+    def test_parsed_once_until_the_file_changes(self):
+        path = self.write_subtitles("1\n00:00:00,000 --> 00:00:01,000\nHello\n\n", "in.srt")
+        with mock.patch.object(history, "load_subtitles", wraps=history.load_subtitles) as load:
+            first = history.subtitle_stats(path)
+            self.assertEqual(history.subtitle_stats(path), first)
+            self.assertEqual(load.call_count, 1)
+
+            self.write_subtitles("1\n00:00:00,000 --> 00:00:01,000\nHello\n\n"
+                                 "2\n00:00:01,000 --> 00:00:02,000\nAgain\n\n", "in.srt")
+            os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+            self.assertEqual(history.subtitle_stats(path), ("srt", 2, 0.0))
+            self.assertEqual(load.call_count, 2)
+
+
+class ListTest(HistoryTestCase):
+    def test_rows_without_frames_or_duration(self):
+        row = dict.fromkeys(history.COLUMNS)
+        row.update(finished=1.0, machine="here", encoder="libx264", wall_seconds=10.0, video="in.mp4")
+        with contextlib.closing(history.connect()) as conn, conn:
+            conn.execute(f"INSERT INTO jobs ({', '.join(history.COLUMNS)}) "
+                         f"VALUES ({', '.join('?' * len(history.COLUMNS))})", [row[name] for name in history.COLUMNS])
+        out = io.StringIO()
+
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(history.main(["list"]), 0)
+
+        self.assertIn("?x? ?s", out.getvalue())
+        self.assertIn("? fps", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import threading
+import unittest
+
+from foxbaker.jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, TUNE_MIN_SAMPLES, Job, JobQueue, Scheduler
+
+
+def make_queue(count):
+    queue = JobQueue()
+    for i in range(count):
+        queue.add(Job(f"in{i}.mp4", f"in{i}.srt", f"out{i}.mp4"))
+    return queue
+
+
+class JobQueueTest(unittest.TestCase):
+    def test_move_and_remove(self):
+        queue = make_queue(3)
+        first, second, third = queue.jobs()
+
+        self.assertTrue(queue.move(third.id, -5))
+        self.assertEqual(queue.jobs(), [third, first, second])
+        self.assertFalse(queue.move(third.id, -1))
+
+        second.status = RUNNING
+        self.assertFalse(queue.remove(second.id))
+        self.assertTrue(queue.remove(first.id))
+        self.assertEqual(queue.jobs(), [third, second])
+
+    def test_cancelled_jobs_are_skipped(self):
+        queue = make_queue(2)
+        first, second = queue.jobs()
+
+        self.assertTrue(queue.cancel(first.id))
+
+        self.assertEqual(first.status, CANCELLED)
+        self.assertIs(queue.next_queued(), second)
+        self.assertEqual(queue.pending(), [second])
+
+    def test_overall_progress(self):
+        queue = make_queue(3)
+        first, second, third = queue.jobs()
+        first.total_duration, first.status = 30, DONE
+        second.total_duration, second.progress = 10, 0.5
+        # Not probed yet, weighted like the average of the others
+        third.status = QUEUED
+
+        self.assertAlmostEqual(queue.overall_progress(), 35 / 60)
+
+
+class SchedulerTest(unittest.TestCase):
+    def run_queue(self, queue, runner, **options):
+        idle = threading.Event()
+        scheduler = Scheduler(queue, runner, on_idle=idle.set, **options)
+        scheduler.start()
+        self.assertTrue(idle.wait(10))
+        return scheduler
+
+    def test_runs_every_job_within_the_slots(self):
+        queue = make_queue(6)
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def runner(job):
+            with lock:
+                running.append(job)
+                peak.append(len(running))
+            threading.Event().wait(0.05)
+            with lock:
+                running.remove(job)
+            return 0
+
+        self.run_queue(queue, runner, cpu_count=16, max_jobs=2)
+
+        self.assertEqual([job.status for job in queue.jobs()], [DONE] * 6)
+        self.assertEqual(max(peak), 2)
+        self.assertEqual({job.threads for job in queue.jobs()}, {8})
+
+    def test_failures(self):
+        queue = make_queue(3)
+        first, second, third = queue.jobs()
+
+        def runner(job):
+            if job is first:
+                return 1
+            if job is second:
+                raise RuntimeError("no such file")
+            return 0
+
+        self.run_queue(queue, runner, cpu_count=1)
+
+        self.assertEqual([job.status for job in queue.jobs()], [FAILED, FAILED, DONE])
+        self.assertEqual(second.error, "no such file")
+
+    def test_initial_slots(self):
+        job = Job("in.mp4", "in.srt", "out.mp4")
+        scheduler = Scheduler(JobQueue(), None, cpu_count=32)
+
+        self.assertEqual(scheduler.initial_slots(job), 4)
+        job.hw_enabled = True
+        self.assertEqual(scheduler.initial_slots(job), 2)
+        self.assertEqual(Scheduler(JobQueue(), None, cpu_count=32, max_jobs=3).initial_slots(job), 3)
+
+    def test_tune_keeps_a_slot_only_when_it_pays(self):
+        scheduler = Scheduler(JobQueue(), None, cpu_count=32)
+        scheduler.slots = 4
+        scheduler._running = set(range(4))
+        scheduler._throughput = {4: 2.0}
+        scheduler._samples = {4: TUNE_MIN_SAMPLES}
+
+        scheduler._tune()
+        self.assertEqual(scheduler.slots, 5)
+
+        # Five encodes together are slower than four
+        scheduler._throughput[5] = 1.8
+        scheduler._samples[5] = TUNE_MIN_SAMPLES
+        scheduler._tune()
+        self.assertEqual(scheduler.slots, 4)
+        scheduler._tune()
+        self.assertEqual(scheduler.slots, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from foxbaker import normalize
+from foxbaker.encoders import FFMPEG
+from foxbaker.jobs import Job
+from foxbaker.normalize import guess_legacy_encoding, normalize_subtitles
+from foxbaker.preflight import PreflightReport, check_subtitles
+from foxbaker.subtitles import EMPTY_SRT
+
+RUSSIAN = "1\n00:00:00,000 --> 00:00:02,000\nПривет, как дела? Съешь ещё этих мягких французских булок.\n\n"
+FRENCH = "1\n00:00:00,000 --> 00:00:02,000\nÇa va très bien, merci. Où est la bibliothèque?\n\n"
+
+
+class NormalizeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        patcher = mock.patch.dict(os.environ, {"FOXBAKER_CACHE_DIR": os.path.join(self.root, "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+
+class EncodingTest(NormalizeTestCase):
+    def test_guess_legacy_encoding(self):
+        for text, encoding in ((RUSSIAN, "cp1251"), (RUSSIAN, "koi8-r"), (RUSSIAN, "cp866"), (FRENCH, "cp1252")):
+            with self.subTest(encoding):
+                self.assertEqual(guess_legacy_encoding(text.encode(encoding)), encoding)
+
+    def test_utf8_is_used_in_place(self):
+        for name, data in (("plain.srt", RUSSIAN.encode("utf-8")),
+                           ("bom.srt", b"\xef\xbb\xbf" + RUSSIAN.encode("utf-8"))):
+            with self.subTest(name):
+                path = self.write(name, data)
+                self.assertEqual(normalize_subtitles(path), path)
+
+    def test_legacy_file_is_transcoded_once(self):
+        path = self.write("in.srt", RUSSIAN.encode("cp1251"))
+
+        with mock.patch.object(normalize, "transcode", wraps=normalize.transcode) as transcode:
+            first = normalize_subtitles(path)
+            # The same content under another name hits the cache
+            self.assertEqual(normalize_subtitles(self.write("copy.srt", RUSSIAN.encode("cp1251"))), first)
+            self.assertEqual(transcode.call_count, 1)
+
+        with open(first, encoding="utf-8") as f:
+            self.assertEqual(f.read(), RUSSIAN)
+
+    def test_utf16(self):
+        path = normalize_subtitles(self.write("in.srt", RUSSIAN.encode("utf-16")))
+
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), RUSSIAN)
+
+
+class EmptySubtitlesTest(NormalizeTestCase):
+    def test_srt_without_cues_draws_nothing(self):
+        for name, data in (("empty.srt", b""), ("blank.srt", b"\n\r\n\n")):
+            with self.subTest(name):
+                path = normalize_subtitles(self.write(name, data))
+
+                self.assertNotEqual(path, os.path.join(self.root, name))
+                with open(path, encoding="utf-8") as f:
+                    self.assertEqual(f.read(), EMPTY_SRT)
+
+    def test_utf16_srt_has_cues(self):
+        text = "1\n00:00:00,000 --> 00:00:02,000\nHello\n\n"
+
+        with open(normalize_subtitles(self.write("in.srt", text.encode("utf-16"))), encoding="utf-8") as f:
+            self.assertEqual(f.read(), text)
+
+    def test_preflight_warns(self):
+        report = PreflightReport()
+
+        check_subtitles(normalize_subtitles(self.write("empty.srt", b"")), None, report)
+
+        self.assertEqual(report.errors, [])
+        self.assertEqual(report.warnings,
+                         ["The subtitle file contains no subtitle lines, the video is encoded without any"])
+
+    @unittest.skipUnless(shutil.which(FFMPEG), "needs ffmpeg")
+    def test_encode(self):
+        video = os.path.join(self.root, "in.mp4")
+        subprocess.run([FFMPEG, "-v", "error", "-f", "lavfi", "-i", "testsrc2=s=160x120:r=10:d=1",
+                        "-pix_fmt", "yuv420p", video], check=True)
+        job = Job(video, self.write("empty.srt", b""), os.path.join(self.root, "out.mp4"))
+        lines = []
+
+        from foxbaker.encode import run_job
+        self.assertEqual(run_job(job, on_log=lines.append), 0)
+
+        self.assertIn("Preflight warning: The subtitle file contains no subtitle lines, "
+                      "the video is encoded without any", lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
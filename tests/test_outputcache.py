@@ -0,0 +1,119 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from foxbaker import outputcache
+from foxbaker.encoders import FFMPEG
+from foxbaker.jobs import Job
+
+SUBTITLES = "1\n00:00:00,000 --> 00:00:01,000\nHello\n\n"
+
+
+def md5(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        patcher = mock.patch.dict(os.environ, {"FOXBAKER_CACHE_DIR": os.path.join(self.root, "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def write(self, name, data):
+        with open(self.path(name), "wb") as f:
+            f.write(data)
+        return self.path(name)
+
+
+class PlaceTest(CacheTestCase):
+    def test_restore_never_hardlinks(self):
+        first = self.write("c1.mp4", b"encoded")
+        job = Job(self.path("in.mp4"), self.path("in.srt"), first)
+        outputcache.store("key", job, lambda message: None)
+        second = Job(self.path("in.mp4"), self.path("in.srt"), self.path("c2.mp4"))
+
+        self.assertTrue(outputcache.restore("key", second, lambda message: None))
+
+        self.assertEqual(md5(self.path("c2.mp4")), md5(first))
+        self.assertNotEqual(os.stat(self.path("c2.mp4")).st_ino, os.stat(first).st_ino)
+
+    def test_unshare_keeps_the_cache_entry(self):
+        first = self.write("c1.mp4", b"encoded")
+        outputcache.store("key", Job(self.path("in.mp4"), self.path("in.srt"), first), lambda message: None)
+        outputcache.unshare_output(first)
+        self.write("c1.mp4", b"encoded again")
+
+        second = Job(self.path("in.mp4"), self.path("in.srt"), self.path("c2.mp4"))
+        self.assertTrue(outputcache.restore("key", second, lambda message: None))
+        with open(self.path("c2.mp4"), "rb") as f:
+            self.assertEqual(f.read(), b"encoded")
+
+    def test_store_without_copy_logs_once(self):
+        messages = []
+        output = self.write("c1.mp4", b"encoded")
+        with mock.patch.object(outputcache, "_reflink", side_effect=OSError("no reflinks")), \
+                mock.patch.object(os, "link", side_effect=OSError("cross-device link")), \
+                mock.patch.object(outputcache, "_unlinkable", set()):
+            for key in ("a", "b"):
+                outputcache.store(key, Job(self.path("in.mp4"), self.path("in.srt"), output), messages.append)
+
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(outputcache._load_index(outputcache.cache_dir("outputs")), {})
+
+    def test_evict_skips_entries_linked_to_outputs(self):
+        directory = outputcache.cache_dir("outputs")
+        linked = self.write("linked.mp4", b"x" * 100)
+        os.link(linked, directory / "linked_0.mp4")
+        with open(directory / "alone_0.mp4", "wb") as f:
+            f.write(b"x" * 100)
+        index = {"linked": {"files": ["linked_0.mp4"], "bytes": 100, "last_used": 1},
+                 "alone": {"files": ["alone_0.mp4"], "bytes": 100, "last_used": 2}}
+
+        outputcache.evict(directory, index, 50)
+
+        self.assertEqual(list(index), ["linked"])
+        self.assertTrue(os.path.exists(directory / "linked_0.mp4"))
+        self.assertFalse(os.path.exists(directory / "alone_0.mp4"))
+
+
+@unittest.skipUnless(shutil.which(FFMPEG), "needs ffmpeg")
+class RunJobTest(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.video = self.path("in.mp4")
+        subprocess.run([FFMPEG, "-v", "error", "-f", "lavfi", "-i", "testsrc2=s=160x120:r=10:d=1",
+                        "-pix_fmt", "yuv420p", self.video], check=True)
+        self.subtitles = self.write("in.srt", SUBTITLES.encode())
+
+    def run_job(self, output, **settings):
+        from foxbaker.encode import run_job
+        job = Job(self.video, self.subtitles, self.path(output), preflight=False, **settings)
+        self.assertEqual(run_job(job), 0)
+        return job
+
+    def test_plain_encode_does_not_overwrite_cached_outputs(self):
+        self.run_job("c1.mp4", cache=True)
+        self.run_job("c2.mp4", cache=True)
+        cached = md5(self.path("c2.mp4"))
+
+        self.run_job("c1.mp4", quality=2)
+
+        self.assertEqual(md5(self.path("c2.mp4")), cached)
+        self.assertNotEqual(md5(self.path("c1.mp4")), cached)
+        directory = outputcache.cache_dir("outputs")
+        entries = [name for name in os.listdir(directory) if name != outputcache.INDEX_FILE]
+        self.assertEqual([md5(directory / name) for name in entries], [cached])
+
+
+if __name__ == "__main__":
+    unittest.main()
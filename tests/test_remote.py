@@ -0,0 +1,172 @@
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from foxbaker import remote
+from foxbaker.jobs import Job
+from foxbaker.probe import FFPROBE
+from test_fonts import SCRIPT, sfnt_with_family
+
+# Encodes take STUB_SECONDS, reporting progress every 0.1 s, and write "encoded" to the output.
+# Capability probes and test encodes succeed at once
+STUB_FFMPEG = """#!{python}
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+if "-version" in args:
+    print("ffmpeg version 6.1-stub")
+elif "-encoders" in args:
+    print(" V....D libx264              stub encoder")
+elif "-progress" in args:
+    steps = int(float(os.environ.get("STUB_SECONDS", "0")) * 10)
+    for i in range(steps + 1):
+        print("out_time_us=%d" % (i * 100000))
+        print("speed=1x")
+        print("progress=" + ("end" if i == steps else "continue"), flush=True)
+        time.sleep(0.1)
+    with open(args[-1], "w") as f:
+        f.write("encoded")
+"""
+
+SUBTITLES = "1\n00:00:00,000 --> 00:00:01,000\nHello\n\n"
+
+
+@unittest.skipUnless(shutil.which(FFPROBE) and shutil.which("ffmpeg"), "needs ffmpeg and ffprobe for the test video")
+class WorkersTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.root, "in.mp4")
+        subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc2=s=160x120:r=10:d=2",
+                        "-pix_fmt", "yuv420p", cls.video], check=True)
+        cls.subtitles = os.path.join(cls.root, "in.srt")
+        with open(cls.subtitles, "w", encoding="utf-8") as f:
+            f.write(SUBTITLES)
+        cls.ffmpeg = os.path.join(cls.root, "ffmpeg")
+        with open(cls.ffmpeg, "w") as f:
+            f.write(STUB_FFMPEG.format(python=sys.executable))
+        os.chmod(cls.ffmpeg, os.stat(cls.ffmpeg).st_mode | stat.S_IEXEC)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.workers = {}
+        patcher = mock.patch.dict(os.environ, {"FOXBAKER_CACHE_DIR": os.path.join(self.root, "controller")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for name in ("a", "b"):
+            self.start_worker(name)
+
+    def start_worker(self, name):
+        env = dict(os.environ, FOXBAKER_FFMPEG=self.ffmpeg, FOXBAKER_CACHE_DIR=os.path.join(self.root, name),
+                   STUB_SECONDS="3", PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env.pop("FOXBAKER_WORKER_TOKEN", None)
+        process = subprocess.Popen([sys.executable, "-m", "foxbaker.remote", "serve", "--port", "0", "-j", "2"],
+                                   stdout=subprocess.PIPE, text=True, env=env)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        port = json.loads(process.stdout.readline())["port"]
+        self.workers[f"http://127.0.0.1:{port}"] = process
+
+    def job(self, name):
+        return Job(self.video, self.subtitles, os.path.join(self.root, name), preflight=False)
+
+    def run_in_thread(self, pool, job, log):
+        result = {}
+
+        def run():
+            try:
+                result["rc"] = remote.run_remote(job, pool, on_log=log)
+            except Exception as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread, result
+
+    def wait_for(self, condition, timeout=20):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            time.sleep(0.05)
+
+    def test_jobs_go_to_the_least_loaded_worker(self):
+        first, second = list(self.workers)
+        busy = remote.WorkerPool([first], token="")
+        thread, result = self.run_in_thread(busy, self.job("busy.mp4"), lambda line: None)
+        self.wait_for(lambda: busy.status(first)["jobs"] == 1)
+
+        pool = remote.WorkerPool([first, second], token="")
+        self.assertEqual(pool.pick(), second)
+        # The job just picked counts for the second worker until it registered there
+        self.assertEqual(pool.pick(), first)
+
+        thread.join(30)
+        self.assertEqual(result, {"rc": 0})
+
+    def test_job_moves_to_another_worker_when_one_is_killed(self):
+        pool = remote.WorkerPool(list(self.workers), token="")
+        lines = []
+        job = self.job("moved.mp4")
+        thread, result = self.run_in_thread(pool, job, lines.append)
+        self.wait_for(lambda: job.progress > 0)
+
+        used = next(line.split()[-1] for line in lines if line.startswith("Encoding on worker"))
+        self.workers[used].kill()
+        thread.join(30)
+
+        self.assertEqual(result, {"rc": 0})
+        self.assertTrue(any(line.startswith("Worker lost") for line in lines))
+        other = [line.split()[-1] for line in lines if line.startswith("Encoding on worker")][-1]
+        self.assertNotEqual(other, used)
+        with open(job.output_path) as f:
+            self.assertEqual(f.read(), "encoded")
+
+    def test_project_fonts_are_uploaded(self):
+        project = os.path.join(self.root, "project")
+        os.makedirs(os.path.join(project, "fonts"), exist_ok=True)
+        with open(os.path.join(project, "fonts", "Remote.ttf"), "wb") as f:
+            f.write(sfnt_with_family("Foxbaker Remote Sans"))
+        subtitles = os.path.join(project, "episode.ass")
+        with open(subtitles, "w", encoding="utf-8") as f:
+            f.write(SCRIPT.format(family="Foxbaker Remote Sans"))
+        job = Job(self.video, subtitles, os.path.join(self.root, "fonts.mp4"), preflight=False)
+        lines = []
+
+        self.assertEqual(remote.run_remote(job, remote.WorkerPool(list(self.workers), token=""), lines.append), 0)
+
+        self.assertIn("Fonts: uploading 1 font files with the job", lines)
+        self.assertTrue(any(line.startswith("Fonts: 1 found") for line in lines))
+        self.assertFalse(any(line.startswith("Fonts: not found") for line in lines))
+
+
+class RemoteJobEventsTest(unittest.TestCase):
+    def test_events_are_bounded(self):
+        job = remote.RemoteJob({}, None)
+        for i in range(remote.EVENTS_KEPT + 10):
+            job.add_event("log", line=str(i))
+        job.add_event("done")
+
+        self.assertEqual(len(job.events), remote.EVENTS_KEPT)
+        events, sent = job.events_after(0)
+        self.assertEqual(events[-1], {"event": "done"})
+        self.assertEqual(sent, remote.EVENTS_KEPT + 11)
+        events, _ = job.events_after(sent - 2)
+        self.assertEqual(events, [{"event": "log", "line": str(remote.EVENTS_KEPT + 9)}, {"event": "done"}])
+        self.assertEqual(job.events_after(sent), ([], sent))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from foxbaker.encoders import FFMPEG
+from foxbaker.jobs import Job
+from foxbaker.probe import FFPROBE
+from foxbaker.smartrender import plan_ranges, subtitle_intervals
+from foxbaker.subtitles import load_subtitles
+
+SUBTITLES = ("1\n00:00:02,500 --> 00:00:03,000\nHello\n\n"
+             "2\n00:00:02,900 --> 00:00:03,500\nAgain\n\n"
+             "3\n00:00:06,000 --> 00:00:07,000\n{\\an8}\n\n")
+
+
+def write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+class PlanTest(unittest.TestCase):
+    def test_subtitle_intervals(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        subtitles = load_subtitles(write(os.path.join(root, "in.srt"), SUBTITLES))
+
+        # Overlapping lines are merged, a line with nothing to draw is left out
+        self.assertEqual(subtitle_intervals(subtitles), [[2.5, 3.5]])
+
+    def test_plan_ranges(self):
+        frame_times = [i / 10 for i in range(100)]
+
+        ranges, frame_duration = plan_ranges([0.0, 2.0, 4.0, 6.0, 8.0], frame_times, [[2.5, 3.5]])
+
+        self.assertAlmostEqual(frame_duration, 0.1)
+        self.assertEqual([(start, encode, frames) for start, _, encode, frames in ranges],
+                         [(0.0, False, 20), (2.0, True, 20), (4.0, False, 60)])
+
+    def test_line_ending_on_a_keyframe(self):
+        frame_times = [i / 10 for i in range(40)]
+
+        ranges, _ = plan_ranges([0.0, 2.0], frame_times, [[1.5, 2.0]])
+
+        self.assertEqual([encode for _, _, encode, _ in ranges], [True, False])
+
+
+@unittest.skipUnless(shutil.which(FFMPEG) and shutil.which(FFPROBE), "needs ffmpeg and ffprobe")
+class RunSmartTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.root, "in.mp4")
+        subprocess.run([FFMPEG, "-v", "error", "-f", "lavfi", "-i", "testsrc2=s=160x120:r=10:d=10", "-pix_fmt",
+                        "yuv420p", "-c:v", "libx264", "-g", "20", "-keyint_min", "20", "-sc_threshold", "0", cls.video],
+                       check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def run_smart(self, subtitles):
+        from foxbaker.encode import run_job
+        job = Job(self.video, write(os.path.join(self.root, "in.srt"), subtitles), os.path.join(self.root, "out.mp4"),
+                  smart=True, preflight=False)
+        lines = []
+        with mock.patch.dict(os.environ, {"FOXBAKER_CACHE_DIR": os.path.join(self.root, "cache")}):
+            self.assertEqual(run_job(job, on_log=lines.append), 0)
+        frames = subprocess.run([FFPROBE, "-v", "error", "-count_frames", "-show_entries", "stream=nb_read_frames",
+                                 "-of", "csv=p=0", job.output_path], capture_output=True, text=True, check=True)
+        self.assertEqual(frames.stdout.strip(), "100")
+        return [line for line in lines if line.startswith("Smart render")]
+
+    def test_only_gops_with_subtitles_are_encoded(self):
+        self.assertEqual(self.run_smart(SUBTITLES),
+                         ["Smart render: re-encoding 20 of 100 frames in 1 parts, copying the rest"])
+
+    def test_mostly_subtitled_video_is_encoded_whole(self):
+        self.assertEqual(self.run_smart("1\n00:00:00,000 --> 00:00:09,000\nHello\n\n"),
+                         ["Smart render: subtitles are visible in 100 of 100 frames, encoding all of it"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from foxbaker.encoders import FFMPEG
+from foxbaker.jobs import Job
+from foxbaker.subtitles import EMPTY_SRT, load_subtitles
+
+SUBTITLES = "1\n00:00:00,000 --> 00:00:01,000\nHello\n\n2\n00:00:02,500 --> 00:00:04,000\nAgain\n\n"
+
+
+class SubtitlesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.subtitles = os.path.join(self.root, "in.srt")
+        with open(self.subtitles, "w", encoding="utf-8") as f:
+            f.write(SUBTITLES)
+
+
+class WriteWindowTest(SubtitlesTestCase):
+    def test_srt_window_is_shifted(self):
+        window = os.path.join(self.root, "window.srt")
+
+        self.assertEqual(load_subtitles(self.subtitles).write_window(window, 3.0, 10.0), 2.5)
+
+        with open(window, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "1\n00:00:00,000 --> 00:00:01,500\nAgain\n\n")
+
+    def test_srt_window_without_lines_is_not_empty(self):
+        # ffmpeg can not open an empty .srt, the chunk would fail
+        window = os.path.join(self.root, "window.srt")
+
+        self.assertEqual(load_subtitles(self.subtitles).write_window(window, 20.0, 40.0), 20.0)
+
+        with open(window, encoding="utf-8") as f:
+            self.assertEqual(f.read(), EMPTY_SRT)
+        self.assertEqual(len(load_subtitles(window).events), 1)
+
+
+@unittest.skipUnless(shutil.which(FFMPEG), "needs ffmpeg")
+class SegmentedTest(SubtitlesTestCase):
+    def test_chunk_without_lines(self):
+        video = os.path.join(self.root, "in.mp4")
+        subprocess.run([FFMPEG, "-v", "error", "-f", "lavfi", "-i", "testsrc2=s=64x48:r=5:d=50",
+                        "-pix_fmt", "yuv420p", "-g", "10", video], check=True)
+        job = Job(video, self.subtitles, os.path.join(self.root, "out.mp4"), segmented=True, preflight=False)
+        job.threads = 4
+        lines = []
+
+        from foxbaker.encode import run_job
+        with mock.patch.dict(os.environ, {"FOXBAKER_CACHE_DIR": os.path.join(self.root, "cache")}):
+            self.assertEqual(run_job(job, on_log=lines.append), 0)
+
+        self.assertIn("Segmented encode: 2 chunks, 1 parallel processes, 4 threads each", lines)
+        self.assertTrue(os.path.getsize(job.output_path) > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()